@@ -78,6 +78,24 @@ class CommonSettingsForm(SettingsForm):
     """ Configures common or generic settings that don't belong elsewhere. """
     pipelines_disabled = forms.BooleanField(required=False,
         label="Pipelines are disabled upon creation?")
+    rsync_retries = forms.IntegerField(required=False, min_value=0,
+        label="Number of times to retry a failed rsync (default 3)")
+    rsync_retry_delay = forms.IntegerField(required=False, min_value=0,
+        label="Seconds to wait before the first rsync retry, doubled for each further retry (default 10)")
+    rsync_move_retention = forms.IntegerField(required=False, min_value=0,
+        label="Days to keep the history of finished rsync moves, deleted by the delete_expired_rsync_moves command (default 30)")
+    quota_reservation_timeout = forms.IntegerField(required=False, min_value=1,
+        label="Hours before space reserved for a package being stored is released (default 24)")
+    browse_cache_ttl = forms.IntegerField(required=False, min_value=0,
+        label="Seconds to cache directory listings of remote spaces, 0 to disable (default 60)")
+    duracloud_index_max_age = forms.IntegerField(required=False, min_value=0,
+        label="Hours before the index used to browse DuraCloud spaces is refreshed, 0 to always list DuraCloud (default 0)")
+    duracloud_chunk_size = forms.IntegerField(required=False, min_value=0,
+        label="Files larger than this many MB are uploaded to DuraCloud in chunks of this size, 0 to disable (default 1024)")
+    duracloud_skip_unchanged = forms.BooleanField(required=False,
+        label="Skip uploading files DuraCloud already has with the same checksum?")
+    lockss_service_document_ttl = forms.IntegerField(required=False, min_value=0,
+        label="Seconds to reuse the LOCKSS-o-matic service document before fetching it again (default 3600)")
 
 
 class DefaultLocationsForm(SettingsForm):
@@ -11,6 +11,7 @@ import uuid
 
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.servers.basehttp import FileWrapper
+from django.db import connections
 from django import http
 
 from administration import models
@@ -83,22 +84,42 @@ def dependent_objects(object_):
     return dependent_objects
 
 
+############ PROCESSES ############
+
+def forget_inherited_db_connections():
+    """ Drops the DB connections a forked process inherited from its parent.
+
+    The child shares their sockets with the parent, so closing them would
+    also close the parent's connections.  The child opens its own the next
+    time it queries the database. """
+    for conn in connections.all():
+        conn.connection = None
+
+
 ############ DOWNLOADING ############
 
-def download_file_stream(filepath, temp_dir=None):
+def download_file_stream(filepath, temp_dir=None, byte_range=None, filename=None):
     """
     Returns `filepath` as a HttpResponse stream.
 
+    If `byte_range` is an (offset, size) tuple, only those bytes are streamed.
+    `filename` is the name to download as, defaulting to the name of
+    `filepath`.
+
     Deletes temp_dir once stream created if it exists.
     """
     # If not found, return 404
     if not os.path.exists(filepath):
         return http.HttpResponseNotFound("File not found")
 
-    filename = os.path.basename(filepath)
-    extension = os.path.splitext(filepath)[1].lower()
+    if filename is None:
+        filename = os.path.basename(filepath)
+    extension = os.path.splitext(filename)[1].lower()
 
-    wrapper = FileWrapper(file(filepath))
+    if byte_range:
+        wrapper = _file_range(filepath, *byte_range)
+    else:
+        wrapper = FileWrapper(file(filepath))
     response = http.HttpResponse(wrapper)
 
     # force download for certain filetypes
@@ -110,7 +131,10 @@ def download_file_stream(filepath, temp_dir=None):
         mimetype = mimetypes.guess_type(filename)[0]
         response['Content-type'] = mimetype
 
-    response['Content-Length'] = os.path.getsize(filepath)
+    if byte_range:
+        response['Content-Length'] = byte_range[1]
+    else:
+        response['Content-Length'] = os.path.getsize(filepath)
 
     # Delete temp dir if created
     if temp_dir and os.path.exists(temp_dir):
@@ -119,6 +143,18 @@ def download_file_stream(filepath, temp_dir=None):
     return response
 
 
+def _file_range(filepath, offset, size, blksize=8192):
+    """ Yields `size` bytes of `filepath`, starting at `offset`. """
+    with open(filepath, 'rb') as f:
+        f.seek(offset)
+        while size > 0:
+            data = f.read(min(blksize, size))
+            if not data:
+                break
+            size -= len(data)
+            yield data
+
+
 ############ XML & POINTER FILE ############
 
 def _storage_service_agent():
@@ -11,6 +11,7 @@ import urllib
 # Core Django, alphabetical
 from django.conf import settings
 from django.conf.urls import url
+from django.core.urlresolvers import reverse
 from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
 from django.forms.models import model_to_dict
 
@@ -31,7 +32,8 @@ from tastypie.utils import trailing_slash
 from common import utils
 from locations.api.sword import views as sword_views
 
-from ..models import (Callback, CallbackError, Event, File, Package, Location, Space, Pipeline, StorageException)
+from ..models import (Callback, CallbackError, Event, File, MoveJob, MoveJobFile, Package, Location, RsyncMove, Space, Pipeline, StorageException)
+from ..models.move_job import reap_dead_move_jobs
 from ..forms import LocationForm, SpaceForm
 from ..constants import PROTOCOL
 from locations import signals
@@ -96,6 +98,30 @@ def _custom_endpoint(expected_methods=['get'], required_fields=[]):
     return decorator
 
 
+def _browse_params(request):
+    """ Returns the properties and pagination arguments for Space.browse from
+    request.
+
+    Raises ValueError if limit isn't a positive integer. """
+    params = {}
+    if request.GET.get('properties') in ('1', 'true'):
+        params['properties'] = True
+    if 'limit' in request.GET:
+        params['limit'] = int(request.GET['limit'])
+        if params['limit'] < 1:
+            raise ValueError('limit must be a positive integer')
+        params['cursor'] = request.GET.get('cursor') or None
+    return params
+
+
+def _add_next_link(request, objects):
+    """ Replaces the 'next' cursor from Space.browse with a link to the next page. """
+    if objects.get('next'):
+        params = request.GET.copy()
+        params['cursor'] = objects['next']
+        objects['next'] = '{}?{}'.format(request.path, params.urlencode())
+
+
 class PipelineResource(ModelResource):
     # Attributes used for POST, exclude from GET
     create_default_locations = fields.BooleanField(use_in=lambda x: False)
@@ -152,7 +178,7 @@ class SpaceResource(ModelResource):
         resource_name = 'space'
 
         fields = ['access_protocol', 'last_verified', 'location_set', 'path',
-            'size', 'used', 'uuid', 'verified']
+            'reserved', 'size', 'used', 'uuid', 'verified']
         list_allowed_methods = ['get']
         detail_allowed_methods = ['get']
         detail_uri_name = 'uuid'
@@ -209,7 +235,7 @@ class SpaceResource(ModelResource):
         obj.save()
         return bundle
 
-    def get_objects(self, space, path):
+    def get_objects(self, space, path, **kwargs):
         message = 'This method should be accessed via a versioned subclass'
         raise NotImplementedError(message)
 
@@ -223,14 +249,28 @@ class SpaceResource(ModelResource):
         Directories is a subset of entries, all are just the name.
 
         If a path=<path> parameter is provided, will look in that path inside
-        the Space. """
+        the Space.
+
+        If a limit=<n> parameter is provided, returns at most n entries and
+        a 'next' link to the following page.  Pass that page's cursor=<cursor>
+        parameter to continue.  For spaces that are not locally accessible,
+        such as DuraCloud, the whole path is still listed on the server, so
+        this only shortens the response.
+
+        If a properties=1 parameter is provided, also returns 'properties', a
+        dict of entry to its 'size' and 'timestamp'.  Directories also have an
+        'object count', and their 'size' is the total of the files in them. """
 
         space = bundle.obj
         path = request.GET.get('path', '')
         if not path.startswith(space.path):
             path = os.path.join(space.path, path)
 
-        objects = self.get_objects(space, path)
+        try:
+            objects = self.get_objects(space, path, **_browse_params(request))
+        except ValueError as e:
+            return http.HttpBadRequest(str(e))
+        _add_next_link(request, objects)
 
         return self.create_response(request, objects)
 
@@ -251,7 +291,7 @@ class LocationResource(ModelResource):
         # validation = CleanedDataFormValidation(form_class=LocationForm)
         resource_name = 'location'
 
-        fields = ['enabled', 'relative_path', 'purpose', 'quota', 'used', 'uuid']
+        fields = ['enabled', 'relative_path', 'purpose', 'quota', 'reserved', 'used', 'uuid']
         list_allowed_methods = ['get']
         detail_allowed_methods = ['get', 'post']
         detail_uri_name = 'uuid'
@@ -277,7 +317,7 @@ class LocationResource(ModelResource):
     def decode_path(self, path):
         return path
 
-    def get_objects(self, space, path):
+    def get_objects(self, space, path, **kwargs):
         message = 'This method should be accessed via a versioned subclass'
         raise NotImplementedError(message)
 
@@ -291,7 +331,17 @@ class LocationResource(ModelResource):
         Directories is a subset of entries, all are just the name.
 
         If a path=<path> parameter is provided, will look in that path inside
-        the Location. """
+        the Location.
+
+        If a limit=<n> parameter is provided, returns at most n entries and
+        a 'next' link to the following page.  Pass that page's cursor=<cursor>
+        parameter to continue.  For spaces that are not locally accessible,
+        such as DuraCloud, the whole path is still listed on the server, so
+        this only shortens the response.
+
+        If a properties=1 parameter is provided, also returns 'properties', a
+        dict of entry to its 'size' and 'timestamp'.  Directories also have an
+        'object count', and their 'size' is the total of the files in them. """
 
         location = bundle.obj
         path = request.GET.get('path', '')
@@ -302,7 +352,11 @@ class LocationResource(ModelResource):
         if not path.startswith(location_path):
             path = os.path.join(location_path, path)
 
-        objects = self.get_objects(location.space, path)
+        try:
+            objects = self.get_objects(location.space, path, **_browse_params(request))
+        except ValueError as e:
+            return http.HttpBadRequest(str(e))
+        _add_next_link(request, objects)
 
         return self.create_response(request, objects)
 
@@ -317,6 +371,8 @@ class LocationResource(ModelResource):
         pipeline: URI of the Pipeline both Locations belong to
         files: List of dicts containing 'source' and 'destination', paths
             relative to their Location of the files to be moved.
+        async: Optional boolean. If true, return 202 immediately with the URI of a
+            MoveJob, and move the files in a separate process.
         """
         # Not right HTTP verb?  PUT is taken
 
@@ -345,38 +401,62 @@ class LocationResource(ModelResource):
         except (IndexError, Location.DoesNotExist):
             return http.HttpNotFound("The URL provided '%s' was not a link to a valid Location." % origin_uri)
 
-        # For each file in files, call move to/from
-        origin_space = origin_location.space
-        destination_space = destination_location.space
+        # Get the Pipeline, if one was given
+        pipeline = None
+        try:
+            pipeline = get_object_or_None(Pipeline,
+                uuid=data['pipeline'].split('/')[4])
+        except (AttributeError, IndexError):
+            pass
+
+        run_async = data.get('async', False)
+        if not isinstance(run_async, bool):
+            return http.HttpBadRequest('async must be a boolean.')
+
+        # Check all files before moving any of them
         files = data['files']
-        # TODO make these move async so the SS can continue to respond while
-        # moving large files
-        for sip_file in files:
-            source_path = sip_file.get('source', None)
-            destination_path = sip_file.get('destination', None)
-            if all([source_path, destination_path]):
-                # make path relative to the location
-                source_path = os.path.join(
-                    origin_location.relative_path, source_path)
-                destination_path = os.path.join(
-                    destination_location.relative_path, destination_path)
-                origin_space.move_to_storage_service(
-                    source_path=source_path,
-                    destination_path=destination_path,
-                    destination_space=destination_space,
-                )
-                origin_space.post_move_to_storage_service()
-                destination_space.move_from_storage_service(
-                    source_path=destination_path,
-                    destination_path=destination_path,
-                )
-                destination_space.post_move_from_storage_service()
-
-            else:
-                return http.HttpBadRequest
+        if not all(f.get('source') and f.get('destination') for f in files):
+            return http.HttpBadRequest
 
+        # Record the moves in a MoveJob
+        job = MoveJob.objects.create(
+            origin_location=origin_location,
+            destination_location=destination_location,
+            pipeline=pipeline,
+            files_total=len(files),
+        )
+        for sip_file in files:
+            MoveJobFile.objects.create(
+                job=job,
+                source=sip_file['source'],
+                destination=sip_file['destination'],
+            )
+        job_uri = reverse('api_dispatch_detail', kwargs={
+            'api_name': 'v2', 'resource_name': 'move_job', 'uuid': job.uuid})
+
+        # Moving large files can take a long time, so clients can ask for the
+        # move to happen outside this request and poll the job for status
+        if run_async:
+            job.spawn()
+            response = {'error': None,
+                        'message': 'Move job created',
+                        'job': job_uri}
+            return self.create_response(request, response,
+                response_class=http.HttpAccepted)
+
+        # Don't hold up the request waiting for other jobs' moves to finish
+        job.run(wait=False)
+        if job.status == MoveJob.FAILED:
+            errors = job.file_set.filter(status=MoveJob.FAILED).values_list(
+                'error', flat=True)
+            response = {'error': True,
+                        'message': 'Error moving files: {}'.format('; '.join(errors)),
+                        'job': job_uri}
+            return self.create_response(request, response,
+                response_class=http.HttpApplicationError)
         response = {'error': None,
-                    'message': 'Files moved successfully'}
+                    'message': 'Files moved successfully',
+                    'job': job_uri}
         return self.create_response(request, response)
 
     def sword_collection(self, request, **kwargs):
@@ -387,6 +467,92 @@ class LocationResource(ModelResource):
         return sword_views.collection(request, location or kwargs['uuid'])
 
 
+class MoveJobFileResource(ModelResource):
+    class Meta:
+        queryset = MoveJobFile.objects.all()
+        authentication = Authentication()
+        authorization = Authorization()
+        resource_name = 'move_job_file'
+
+        fields = ['source', 'destination', 'status', 'size', 'error']
+        list_allowed_methods = []
+        detail_allowed_methods = []
+        include_resource_uri = False
+
+
+class MoveJobResource(ModelResource):
+    """ Resource for checking on MoveJobs created by moving files to a Location.
+
+    Detail (api/v2/move_job/<uuid>/) supports:
+    GET: Status and per-file progress of a move job
+    """
+    origin_location = fields.ForeignKey(LocationResource, 'origin_location')
+    destination_location = fields.ForeignKey(LocationResource, 'destination_location')
+    files = fields.ToManyField(MoveJobFileResource, 'file_set', full=True)
+
+    class Meta:
+        queryset = MoveJob.objects.all()
+        authentication = Authentication()
+        # authentication = MultiAuthentication(
+        #     BasicAuthentication, ApiKeyAuthentication())
+        authorization = Authorization()
+        # authorization = DjangoAuthorization()
+        resource_name = 'move_job'
+
+        fields = ['uuid', 'status', 'files_total', 'files_moved',
+            'files_failed', 'bytes_moved', 'created_time', 'started_time',
+            'completed_time', 'files']
+        list_allowed_methods = ['get']
+        detail_allowed_methods = ['get']
+        detail_uri_name = 'uuid'
+        filtering = {
+            'status': ALL,
+            'uuid': ALL,
+        }
+
+    def get_object_list(self, request):
+        # Report jobs whose process died as failed, rather than leaving
+        # clients polling them forever
+        reap_dead_move_jobs()
+        return super(MoveJobResource, self).get_object_list(request)
+
+
+class RsyncMoveResource(ModelResource):
+    """ Resource for monitoring moves made with rsync.
+
+    List (api/v2/rsync_move/) supports:
+    GET: List of moves, eg. ?status=in%20progress for those still running
+
+    Detail (api/v2/rsync_move/<uuid>/) supports:
+    GET: Progress of one move
+    """
+    class Meta:
+        queryset = RsyncMove.objects.all()
+        authentication = Authentication()
+        # authentication = MultiAuthentication(
+        #     BasicAuthentication, ApiKeyAuthentication())
+        authorization = Authorization()
+        # authorization = DjangoAuthorization()
+        resource_name = 'rsync_move'
+
+        fields = ['uuid', 'source', 'destination', 'status',
+            'bytes_transferred', 'files_transferred', 'throughput',
+            'created_time', 'updated_time', 'completed_time']
+        list_allowed_methods = ['get']
+        detail_allowed_methods = ['get']
+        detail_uri_name = 'uuid'
+        ordering = ['created_time']
+        filtering = {
+            'status': ALL,
+            'created_time': ALL,
+            'uuid': ALL,
+        }
+
+    def dehydrate(self, bundle):
+        bundle.data['attempts'] = len(bundle.obj.attempts)
+        return bundle
+
+
 class PackageResource(ModelResource):
     """ Resource for managing Packages.
 
@@ -567,13 +733,17 @@ class PackageResource(ModelResource):
         package = bundle.obj
 
         lockss_au_number = kwargs.get('chunk_number')
+        byte_range = filename = None
         try:
             temp_dir = None
-            full_path = package.get_download_path(lockss_au_number)
+            full_path, byte_range = package.get_download(lockss_au_number)
         except StorageException:
             full_path, temp_dir = package.compress_package(Package.COMPRESSION_TAR)
+        if byte_range:
+            # Virtual LOCKSS chunk - download with the name a split chunk has
+            filename = os.path.splitext(os.path.basename(full_path))[0] + '.tar-' + str(lockss_au_number)
 
-        response = utils.download_file_stream(full_path)
+        response = utils.download_file_stream(full_path, byte_range=byte_range, filename=filename)
 
         return response
 
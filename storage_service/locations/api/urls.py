@@ -13,6 +13,8 @@ v2_api.register(v2.SpaceResource())
 v2_api.register(v2.LocationResource())
 v2_api.register(v2.PackageResource())
 v2_api.register(v2.PipelineResource())
+v2_api.register(v2.MoveJobResource())
+v2_api.register(v2.RsyncMoveResource())
 
 urlpatterns = patterns('',
     (r'', include(v1_api.urls)),
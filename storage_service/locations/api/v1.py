@@ -9,8 +9,8 @@ class PipelineResource(resources.PipelineResource):
 
 
 class SpaceResource(resources.SpaceResource):
-    def get_objects(self, space, path):
-        return space.browse(path)
+    def get_objects(self, space, path, **kwargs):
+        return space.browse(path, **kwargs)
 
 
 class LocationResource(resources.LocationResource):
@@ -19,8 +19,8 @@ class LocationResource(resources.LocationResource):
     description = fields.CharField(attribute='get_description', readonly=True)
     pipeline = fields.ToManyField(PipelineResource, 'pipeline')
 
-    def get_objects(self, space, path):
-        return space.browse(path)
+    def get_objects(self, space, path, **kwargs):
+        return space.browse(path, **kwargs)
 
 
 class PackageResource(resources.PackageResource):
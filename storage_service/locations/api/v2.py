@@ -11,10 +11,13 @@ class PipelineResource(resources.PipelineResource):
 
 
 class SpaceResource(resources.SpaceResource):
-    def get_objects(self, space, path):
-        objects = space.browse(path)
+    def get_objects(self, space, path, **kwargs):
+        objects = space.browse(path, **kwargs)
         objects['entries'] = map(base64.b64encode, objects['entries'])
         objects['directories'] = map(base64.b64encode, objects['directories'])
+        if 'properties' in objects:
+            objects['properties'] = dict((base64.b64encode(name), value)
+                for name, value in objects['properties'].iteritems())
 
         return objects
 
@@ -28,10 +31,13 @@ class LocationResource(resources.LocationResource):
     def decode_path(self, path):
         return str(base64.b64decode(path))
 
-    def get_objects(self, space, path):
-        objects = space.browse(path)
+    def get_objects(self, space, path, **kwargs):
+        objects = space.browse(path, **kwargs)
         objects['entries'] = map(base64.b64encode, objects['entries'])
         objects['directories'] = map(base64.b64encode, objects['directories'])
+        if 'properties' in objects:
+            objects['properties'] = dict((base64.b64encode(name), value)
+                for name, value in objects['properties'].iteritems())
 
         return objects
 
@@ -43,3 +49,12 @@ class PackageResource(resources.PackageResource):
     current_location = fields.ForeignKey(LocationResource, 'current_location')
 
     current_full_path = fields.CharField(attribute='full_path', readonly=True)
+
+
+class MoveJobResource(resources.MoveJobResource):
+    origin_location = fields.ForeignKey(LocationResource, 'origin_location')
+    destination_location = fields.ForeignKey(LocationResource, 'destination_location')
+
+
+class RsyncMoveResource(resources.RsyncMoveResource):
+    pass
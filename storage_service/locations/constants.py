@@ -9,7 +9,7 @@ PROTOCOL = {
     models.Space.DURACLOUD: {
         'model': models.Duracloud,
         'form': forms.DuracloudForm,
-        'fields': ['host', 'user', 'duraspace'],
+        'fields': ['host', 'user', 'duraspace', 'max_concurrent_transfers'],
     },
     models.Space.FEDORA: {
         'model': models.Fedora,
@@ -66,7 +66,7 @@ class PipelineForm(forms.ModelForm):
 class SpaceForm(forms.ModelForm):
     class Meta:
         model = models.Space
-        fields = ('access_protocol', 'size', 'path', 'staging_path')
+        fields = ('access_protocol', 'size', 'path', 'staging_path', 'max_concurrent_moves', 'copy_engine')
 
     def __init__(self, *args, **kwargs):
         super(SpaceForm, self).__init__(*args, **kwargs)
@@ -87,7 +87,7 @@ class SpaceForm(forms.ModelForm):
 class DuracloudForm(forms.ModelForm):
     class Meta:
         model = models.Duracloud
-        fields = ('host', 'user', 'password', 'duraspace')
+        fields = ('host', 'user', 'password', 'duraspace', 'max_concurrent_transfers')
 
 
 class LocalFilesystemForm(forms.ModelForm):
@@ -113,7 +113,7 @@ class LockssomaticForm(forms.ModelForm):
     # TODO SpaceForm.path help text should say path to staging space, preferably local
     class Meta:
         model = models.Lockssomatic
-        fields = ('sd_iri', 'content_provider_id', 'external_domain', 'keep_local')
+        fields = ('sd_iri', 'content_provider_id', 'external_domain', 'keep_local', 'virtual_chunks')
 
     def clean_external_domain(self):
         data = self.cleaned_data['external_domain']
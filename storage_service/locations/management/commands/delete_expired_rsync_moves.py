@@ -0,0 +1,13 @@
+# Core Django, alphabetical
+from django.core.management.base import BaseCommand
+
+# This project, alphabetical
+from locations.models import RsyncMove
+
+
+class Command(BaseCommand):
+    help = 'Deletes the history of rsync moves that finished more than rsync_move_retention days ago.'
+
+    def handle(self, *args, **options):
+        deleted = RsyncMove.delete_expired()
+        self.stdout.write('{} rsync moves deleted'.format(deleted))
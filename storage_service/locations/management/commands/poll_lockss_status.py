@@ -0,0 +1,30 @@
+# stdlib, alphabetical
+from optparse import make_option
+
+# Core Django, alphabetical
+from django.core.management.base import BaseCommand
+
+# This project, alphabetical
+from locations.models import lockssomatic
+
+
+class Command(BaseCommand):
+    help = 'Updates the status of packages staged in LOCKSS-o-matic spaces.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--workers', type='int',
+            default=lockssomatic.LOCKSS_POLL_WORKERS,
+            help='Number of SWORD statements to fetch at once.'),
+        make_option('--batch-size', type='int',
+            default=lockssomatic.LOCKSS_POLL_BATCH_SIZE,
+            help='Number of packages to fetch statements for before applying them.'),
+        make_option('--force', action='store_true', default=False,
+            help='Poll every staged package, ignoring the back-off for packages not yet in agreement.'),
+    )
+
+    def handle(self, *args, **options):
+        summary = lockssomatic.poll_lockss_status(
+            workers=options['workers'],
+            batch_size=options['batch_size'],
+            force=options['force'])
+        self.stdout.write('{uploaded} packages uploaded, {staging} still staging, {skipped} skipped until their next poll'.format(**summary))
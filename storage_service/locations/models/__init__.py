@@ -13,14 +13,17 @@ class StorageException(Exception):
 # May have multiple models, so import * and use __all__ in file.
 from event import *
 from location import *
+from move_job import *
 from package import *
 from pipeline import *
+from quota_reservation import *
+from rsync_move import *
 from space import *
 # not importing managers as that is internal
 
 # Protocol Spaces
 # Will only have one model, so import that directly
-from duracloud import Duracloud
+from duracloud import Duracloud, DuracloudContent
 from fedora import Fedora, PackageDownloadTask, PackageDownloadTaskFile
 from local_filesystem import LocalFilesystem
 from lockssomatic import Lockssomatic
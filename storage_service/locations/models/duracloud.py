@@ -1,12 +1,23 @@
 # stdlib, alphabetical
+import base64
+import calendar
+import datetime
+from email.utils import mktime_tz, parsedate_tz
+import hashlib
 import logging
 from lxml import etree
+from multiprocessing import Process, active_children
+from multiprocessing.pool import ThreadPool
 import os
 import re
+import time
 import urllib
 
 # Core Django, alphabetical
+from django.db import connection
 from django.db import models
+from django.db.models import Q
+from django.utils import timezone
 
 # Third party dependencies, alphabetical
 import requests
@@ -17,9 +28,35 @@ from common import utils
 # This module, alphabetical
 from . import StorageException
 from location import Location
+from space import BROWSE_PROPERTIES_WORKERS, _wanted_properties
 
 LOGGER = logging.getLogger(__name__)
 
+# Default for the duracloud_index_max_age setting
+DURACLOUD_INDEX_MAX_AGE = 0  # hours, disabled
+# A crawl that hasn't finished after this long is assumed to have died
+DURACLOUD_INDEX_CRAWL_TIMEOUT = 24  # hours
+# Content IDs read or written in each query to the index
+DURACLOUD_INDEX_BATCH_SIZE = 500
+# Size of the reads made while streaming content to or from disk
+DURACLOUD_STREAM_CHUNK_SIZE = 4 * 1024 * 1024
+# Default for the duracloud_chunk_size setting
+DURACLOUD_CHUNK_SIZE = 1024  # MB
+# DuraCloud's chunked content convention stores large files as numbered
+# chunks plus a manifest describing them
+DURACLOUD_CHUNK_SUFFIX = '.dura-chunk-'
+DURACLOUD_CHUNK_REGEX = re.compile(r'\.dura-chunk-\d{4,}$')
+DURACLOUD_MANIFEST_SUFFIX = '.dura-manifest'
+DURACLOUD_MANIFEST_NAMESPACE = 'duracloud.org'
+# Default for Duracloud.max_concurrent_transfers
+DURACLOUD_CONCURRENT_TRANSFERS = 4
+# Failed transfers listed in the exception when transferring many files
+DURACLOUD_ERRORS_REPORTED = 10
+# Retries of requests that DuraCloud reports as temporarily failed
+DURACLOUD_RETRIES = 3
+DURACLOUD_RETRY_DELAY = 1  # seconds, doubled after each attempt
+DURACLOUD_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
 
 class Duracloud(models.Model):
     space = models.OneToOneField('Space', to_field='uuid')
@@ -28,6 +65,15 @@ class Duracloud(models.Model):
     user = models.CharField(max_length=64, help_text='Username to authenticate as')
     password = models.CharField(max_length=64, help_text='Password to authenticate with')
     duraspace = models.CharField(max_length=64, help_text='Name of the Space within DuraCloud')
+    max_concurrent_transfers = models.PositiveIntegerField(
+        default=DURACLOUD_CONCURRENT_TRANSFERS,
+        help_text='Maximum number of files transferred to or from DuraCloud at once by each move or delete.')
+
+    # State of the DuracloudContent index
+    index_refreshed_time = models.DateTimeField(default=None, null=True,
+        blank=True, help_text="Start of the last complete crawl of the DuraCloud space.")
+    index_crawl_started = models.DateTimeField(default=None, null=True,
+        blank=True, help_text="Start of the crawl in progress, if any.")
 
     class Meta:
         verbose_name = "DuraCloud"
@@ -49,16 +95,251 @@ class Duracloud(models.Model):
         if self._session is None:
             self._session = requests.Session()
             self._session.auth = (self.user, self.password)
+            # Keep a connection open for each concurrent transfer
+            pool_size = max(self.max_concurrent_transfers,
+                requests.adapters.DEFAULT_POOLSIZE)
+            self._session.mount('https://', requests.adapters.HTTPAdapter(
+                pool_maxsize=pool_size))
         return self._session
 
+    def _transfer_all(self, transfer, items):
+        """ Calls transfer(*item) for each of items, transferring up to
+        max_concurrent_transfers files at once.
+
+        A failure doesn't stop the other transfers.  Once they have all
+        finished, raises a StorageException describing any that failed. """
+        results = self._map_concurrently(transfer, items)
+        errors = [(item[0], e) for item, (_, e) in zip(items, results) if e]
+        if errors:
+            raise StorageException('{} of {} transfers failed: {}'.format(
+                len(errors), len(items), '; '.join('{}: {}'.format(path, e)
+                    for path, e in errors[:DURACLOUD_ERRORS_REPORTED])))
+
+    def _map_concurrently(self, function, items):
+        """ Calls function(*item) for each of items, up to
+        max_concurrent_transfers at once.
+
+        Returns a list of (result, exception) for each item in order, where
+        exception is None unless function raised one. """
+        workers = min(self.max_concurrent_transfers, len(items))
+        if workers > 1:
+            LOGGER.info('Processing %s files with %s workers', len(items), workers)
+            # The threads share the session, so create it before they start
+            self.session
+            pool = ThreadPool(workers)
+            try:
+                return pool.map(
+                    lambda item: self._call_in_thread(function, item), items)
+            finally:
+                pool.close()
+                pool.join()
+        return [self._call(function, item) for item in items]
+
+    def _call_in_thread(self, function, item):
+        try:
+            return self._call(function, item)
+        finally:
+            # Django's connections are per thread, so this only closes the one
+            # opened by this pool thread
+            connection.close()
+
+    def _call(self, function, item):
+        try:
+            return function(*item), None
+        except Exception as e:
+            LOGGER.warning('%s of %s failed', function.__name__, item[0], exc_info=True)
+            return None, e
+
+    def _request(self, method, url, **kwargs):
+        """ Makes a request with the session, retrying with an exponential
+        backoff if DuraCloud is overloaded or temporarily failing. """
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.exceptions.ConnectionError:
+                if attempt > DURACLOUD_RETRIES:
+                    raise
+                LOGGER.warning('%s %s failed', method, url, exc_info=True)
+            else:
+                if (response.status_code not in DURACLOUD_RETRY_STATUSES
+                        or attempt > DURACLOUD_RETRIES):
+                    return response
+                LOGGER.warning('%s %s failed: %s', method, url, response)
+            time.sleep(DURACLOUD_RETRY_DELAY * 2 ** (attempt - 1))
+
     @property
     def duraspace_url(self):
         return 'https://' + self.host + '/durastore/' + self.duraspace + '/'
 
-    def _get_files_list(self, prefix):
+    def _index_max_age(self):
+        """ Returns how long the content index can be used for, as a
+        timedelta, or None if the index is disabled. """
+        max_age = utils.get_setting('duracloud_index_max_age')
+        if max_age is None:
+            max_age = DURACLOUD_INDEX_MAX_AGE
+        if not max_age:
+            return None
+        return datetime.timedelta(hours=max_age)
+
+    def _index_is_fresh(self):
+        """ Returns True if the content index can be used instead of listing
+        the DuraCloud space for browsing.
+
+        If the index is older than the duracloud_index_max_age setting, starts
+        a crawl to refresh it. """
+        max_age = self._index_max_age()
+        if max_age is None:
+            return False
+        if (self.index_refreshed_time and
+                timezone.now() - self.index_refreshed_time < max_age):
+            return True
+        self.spawn_index_refresh()
+        return False
+
+    def spawn_index_refresh(self):
+        """ Refresh the content index in a separate process and return immediately.
+
+        The crawl is claimed before forking, so nothing is started if one is
+        already running. """
+        # Reap crawls started by this process that have finished
+        active_children()
+        started = self._claim_index_crawl()
+        if not started:
+            return
+        p = Process(target=refresh_duracloud_index, args=(self.pk, started))
+        p.start()
+
+    def _claim_index_crawl(self):
+        """ Claims the crawl in a single UPDATE, so only one runs at a time.
+
+        Returns the time the crawl started, or None if one is already running. """
+        started = timezone.now()
+        timeout = started - datetime.timedelta(hours=DURACLOUD_INDEX_CRAWL_TIMEOUT)
+        claimed = Duracloud.objects.filter(pk=self.pk).filter(
+            Q(index_crawl_started__isnull=True) | Q(index_crawl_started__lt=timeout)
+        ).update(index_crawl_started=started)
+        if not claimed:
+            LOGGER.debug('Index of %s already being refreshed', self.space_id)
+            return None
+        return started
+
+    def refresh_index(self, started=None):
+        """ Crawls the DuraCloud space and replaces the content index.
+
+        Claims the crawl first, unless the caller already claimed it at
+        started.  Content written through the storage service while crawling
+        is kept even if the crawl missed it. """
+        if started is None:
+            started = self._claim_index_crawl()
+            if not started:
+                LOGGER.info('Index of %s already being refreshed, skipping', self.space_id)
+                return
+        LOGGER.info('Refreshing index of %s', self.space_id)
+        try:
+            batch = []
+            for content_id in self._list_remote(''):
+                batch.append(content_id)
+                if len(batch) >= DURACLOUD_INDEX_BATCH_SIZE:
+                    self._index_batch(batch, started)
+                    batch = []
+            self._index_batch(batch, started)
+            # Anything not seen by the crawl or written since it started has
+            # been deleted
+            self.content_set.filter(indexed_time__lt=started).delete()
+        except Exception:
+            LOGGER.exception('Refreshing index of %s failed', self.space_id)
+            Duracloud.objects.filter(pk=self.pk).update(index_crawl_started=None)
+            raise
+        self.index_refreshed_time = started
+        self.index_crawl_started = None
+        Duracloud.objects.filter(pk=self.pk).update(
+            index_refreshed_time=started, index_crawl_started=None)
+
+    def _index_batch(self, content_ids, indexed_time):
+        """ Marks content_ids as present at indexed_time, adding any that are
+        not in the index. """
+        hashes = dict((_content_id_hash(c), c) for c in content_ids)
+        existing = set(self.content_set.filter(
+            content_id_hash__in=hashes).values_list('content_id_hash', flat=True))
+        self.content_set.filter(content_id_hash__in=existing).update(
+            indexed_time=indexed_time)
+        DuracloudContent.objects.bulk_create([
+            DuracloudContent(duracloud=self, content_id=content_id,
+                content_id_hash=content_id_hash, indexed_time=indexed_time)
+            for content_id_hash, content_id in hashes.items()
+            if content_id_hash not in existing])
+
+    def _index_content(self, content_id, size=None, checksum=None):
+        """ Records content_id, just written by the storage service, in the
+        index, if the index is enabled. """
+        if self._index_max_age() is None:
+            return
+        now = timezone.now()
+        values = {'size': size, 'checksum': checksum, 'modified': now,
+            'indexed_time': now}
+        updated = self.content_set.filter(
+            content_id_hash=_content_id_hash(content_id)).update(**values)
+        if not updated:
+            DuracloudContent.objects.create(duracloud=self,
+                content_id=content_id, **values)
+
+    def _unindex_content(self, content_id):
+        """ Removes content_id, just deleted by the storage service, from the index. """
+        self.content_set.filter(
+            content_id_hash=_content_id_hash(content_id)).delete()
+
+    def _get_files_list(self, prefix, show_chunks=False, use_index=False):
         """
         Generator function to return the full path of all files starting with prefix.
 
+        Lists the DuraCloud space, or if use_index is True, uses the content
+        index if it is fresh enough.  The index can miss content written
+        without going through the storage service, so it is only used for
+        browsing.  Chunked content is returned once by its own path, rather
+        than as its manifest and chunks, unless show_chunks is True.
+
+        :param prefix: All paths returned will start with prefix
+        :param show_chunks: Return the paths of chunks and manifests
+        :param use_index: List from the content index if it is fresh
+        :returns: Iterator of paths
+        """
+        if use_index and self._index_is_fresh():
+            LOGGER.debug('Listing %s from the content index', prefix)
+            paths = self._list_index(prefix)
+        else:
+            paths = self._list_remote(prefix)
+        for path in paths:
+            if not show_chunks:
+                if DURACLOUD_CHUNK_REGEX.search(path):
+                    continue
+                if path.endswith(DURACLOUD_MANIFEST_SUFFIX):
+                    path = path[:-len(DURACLOUD_MANIFEST_SUFFIX)]
+            yield path
+
+    def _list_index(self, prefix):
+        """
+        Generator function to return the full path of all files starting with
+        prefix, from the content index.
+
+        :param prefix: All paths returned will start with prefix
+        :returns: Iterator of paths
+        """
+        content_ids = self.content_set.filter(
+            content_id__startswith=prefix).order_by('content_id').values_list(
+            'content_id', flat=True).iterator()
+        for content_id in content_ids:
+            content_id = utils.coerce_str(content_id)
+            # LIKE is case-insensitive in some databases
+            if content_id.startswith(prefix):
+                yield content_id
+
+    def _list_remote(self, prefix):
+        """
+        Generator function to return the full path of all files starting with
+        prefix, by listing the DuraCloud space.
+
         :param prefix: All paths returned will start with prefix
         :returns: Iterator of paths
         """
@@ -93,13 +374,48 @@ class Duracloud(models.Model):
             LOGGER.debug('Paths first 10: %s', paths[:10])
             LOGGER.debug('Paths last 10: %s', paths[-10:])
 
-    def browse(self, path):
+    def _get_properties(self, path):
+        """ Returns (size, timestamp) of the file at path, from a HEAD request.
+
+        Returns None if they can't be fetched, so one missing file doesn't
+        stop the rest of a browse. """
+        url = self.duraspace_url + urllib.quote(path)
+        try:
+            response = self.session.head(url)
+            if response.status_code == 404:
+                manifest = self._get_manifest(path)
+                if manifest:
+                    return manifest['size'], manifest['timestamp']
+        except Exception:
+            LOGGER.warning('Unable to get properties of %s', path, exc_info=True)
+            return None
+        if response.status_code != 200:
+            LOGGER.warning('Unable to get properties of %s: %s', path, response)
+            return None
+        size = int(response.headers.get('Content-Length', 0))
+        timestamp = None
+        if response.headers.get('Last-Modified'):
+            timestamp = mktime_tz(parsedate_tz(response.headers['Last-Modified']))
+        return size, timestamp
+
+    def browse(self, path, properties=False):
+        """ Lists path in the DuraCloud space.
+
+        If properties is True, also returns 'properties', a dict of entry name
+        to {'size': bytes, 'timestamp': modification time}.  For directories,
+        'size' is the total of the files below it and 'object count' is the
+        number of files.  DuraCloud's listing only has names, so each file is
+        fetched with a HEAD request, BROWSE_PROPERTIES_WORKERS at a time.  If
+        properties is a collection of entry names, only those entries are
+        fetched.  Entries that can't be fetched are left without properties. """
+        wanted = _wanted_properties(properties)
         if path and not path.endswith('/'):
             path += '/'
         entries = set()
         directories = set()
+        files = []
         # Handle paths one at a time to deal with lots of files
-        paths = self._get_files_list(path)
+        paths = self._get_files_list(path, use_index=True)
         for p in paths:
             path_parts = p.replace(path, '', 1).split('/')
             dirname = path_parts[0]
@@ -108,24 +424,136 @@ class Duracloud(models.Model):
             entries.add(dirname)
             if len(path_parts) > 1:
                 directories.add(dirname)
+            if properties and (wanted is None or dirname in wanted):
+                files.append((dirname, p))
 
         entries = sorted(entries, key=lambda s: s.lower())  # Also converts to list
         directories = sorted(directories, key=lambda s: s.lower())  # Also converts to list
-        return {'directories': directories, 'entries': entries}
+        objects = {'directories': directories, 'entries': entries}
+        if properties:
+            objects['properties'] = self._browse_properties(files,
+                [d for d in directories if wanted is None or d in wanted])
+        return objects
+
+    def browse_properties(self, path, entries, directories):
+        """ Returns browse properties for entries, names in path, as browse
+        does.  directories lists those entries that are directories.
+
+        Used by Space.browse for a page of a listing it already has: files are
+        fetched directly, and only the directories' contents are listed. """
+        if path and not path.endswith('/'):
+            path += '/'
+        directories = set(directories)
+        files = []
+        for name in entries:
+            if name in directories:
+                files.extend((name, p) for p in self._get_files_list(
+                    path + name + '/', use_index=True))
+            else:
+                files.append((name, path + name))
+        return self._browse_properties(files,
+            [d for d in entries if d in directories])
+
+    def _browse_properties(self, files, directories):
+        """ Returns browse properties for files, a list of (entry name, path).
+
+        If the content index is enabled, sizes and modification times it
+        recorded within duracloud_index_max_age are used, and the rest are
+        fetched and added to it. """
+        entry_properties = dict((d, {'size': 0, 'object count': 0})
+            for d in directories)
+        if not files:
+            return entry_properties
+        known = {}
+        max_age = self._index_max_age()
+        paths = [p for _, p in files] if max_age is not None else []
+        for i in range(0, len(paths), DURACLOUD_INDEX_BATCH_SIZE):
+            hashes = [_content_id_hash(p)
+                for p in paths[i:i + DURACLOUD_INDEX_BATCH_SIZE]]
+            indexed = self.content_set.filter(size__isnull=False,
+                modified__isnull=False,
+                indexed_time__gte=timezone.now() - max_age,
+                content_id_hash__in=hashes)
+            for content in indexed:
+                known[utils.coerce_str(content.content_id)] = (content.size,
+                    calendar.timegm(content.modified.utctimetuple()))
+        unknown = [p for _, p in files if p not in known]
+        if unknown:
+            pool = ThreadPool(min(BROWSE_PROPERTIES_WORKERS, len(unknown)))
+            try:
+                fetched = pool.map(self._get_properties, unknown)
+            finally:
+                pool.close()
+                pool.join()
+            for path, result in zip(unknown, fetched):
+                if result is None:
+                    continue
+                size, timestamp = result
+                known[path] = (size, timestamp)
+                if max_age is None:
+                    continue
+                modified = None
+                if timestamp is not None:
+                    modified = datetime.datetime.fromtimestamp(timestamp, timezone.utc)
+                self.content_set.filter(
+                    content_id_hash=_content_id_hash(path)).update(
+                    size=size, modified=modified, indexed_time=timezone.now())
+        failed = set(name for name, p in files if p not in known)
+        for name, path in files:
+            if name in failed:
+                # Incomplete, so leave the entry without properties
+                entry_properties.pop(name, None)
+                continue
+            size, timestamp = known[path]
+            if name in entry_properties:
+                entry_properties[name]['size'] += size
+                entry_properties[name]['object count'] += 1
+            else:
+                entry_properties[name] = {'size': size, 'timestamp': timestamp}
+        return entry_properties
 
     def delete_path(self, delete_path):
+        """ Deletes delete_path, or everything in it if it is a folder.
+
+        The contents of a folder are deleted max_concurrent_transfers at a
+        time.  Returns a summary with lists of the paths 'deleted' and 'not
+        found', and 'failed', a dict of path to error message. """
         # BUG If delete_path is a folder but provided without a trailing /, will delete a file with the same name.
+        summary = {'deleted': [], 'not found': [], 'failed': {}}
         # Files
-        url = self.duraspace_url + urllib.quote(delete_path)
-        response = self.session.delete(url)
-        if response.status_code == 404:
-            # File cannot be found - this may be a folder
-            to_delete = self._get_files_list(delete_path)
-            # Do not support globbing for delete - do not want to accidentally
-            # delete something
-            for d in to_delete:
-                url = self.duraspace_url + urllib.quote(d)
-                response = self.session.delete(url)
+        if self._delete_content(delete_path):
+            summary['deleted'].append(delete_path)
+            return summary
+        # File cannot be found - this may be a folder
+        # List everything first, since deleting changes the listing
+        to_delete = [(d, ) for d in self._get_files_list(delete_path, show_chunks=True)]
+        if not to_delete:
+            summary['not found'].append(delete_path)
+        # Do not support globbing for delete - do not want to accidentally
+        # delete something
+        results = self._map_concurrently(self._delete_content, to_delete)
+        for (path, ), (deleted, error) in zip(to_delete, results):
+            if error:
+                summary['failed'][path] = str(error)
+            elif deleted:
+                summary['deleted'].append(path)
+            else:
+                summary['not found'].append(path)
+        LOGGER.info('Deleted %s from %s: %s deleted, %s not found, %s failed',
+            delete_path, self.space_id, len(summary['deleted']),
+            len(summary['not found']), len(summary['failed']))
+        return summary
+
+    def _delete_content(self, content_id):
+        """ Deletes content_id.  Returns False if it doesn't exist. """
+        url = self.duraspace_url + urllib.quote(content_id)
+        response = self._request('DELETE', url)
+        if response.status_code not in (200, 204, 404):
+            LOGGER.warning('Response: %s when deleting %s', response, url)
+            raise StorageException('Unable to delete {}: {} {}'.format(
+                content_id, response.status_code, response.reason))
+        self._unindex_content(content_id)
+        return response.status_code != 404
 
     def move_to_storage_service(self, src_path, dest_path, dest_space):
         """ Moves src_path to dest_space.staging_path/dest_path. """
@@ -135,47 +563,226 @@ class Duracloud(models.Model):
         dest_path = utils.coerce_str(dest_path)
         # Try to fetch if it's a file
         url = self.duraspace_url + urllib.quote(src_path)
-        response = self.session.get(url)
+        response = self.session.get(url, stream=True)
         if response.status_code == 404:
-            LOGGER.debug('%s not found, trying as folder', src_path)
-            # File cannot be found - this may be a folder
+            response.close()
             # Remove /. and /* at the end of the string. These glob-match on a
             # filesystem, but do not character-match in Duracloud.
-            # Normalize dest_path as well so replace continues to work
             find_regex = r'/[\.\*]$'
+            # Paths ending in / or a glob can only be folders
+            if not src_path.endswith('/') and not re.search(find_regex, src_path):
+                manifest = self._get_manifest(src_path)
+                if manifest:
+                    return self._download_chunked(src_path, dest_path, manifest)
+            LOGGER.debug('%s not found, trying as folder', src_path)
+            # File cannot be found - this may be a folder
+            # Normalize dest_path as well so replace continues to work
             src_path = re.sub(find_regex, '/', src_path)
             dest_path = re.sub(find_regex, '/', dest_path)
             LOGGER.debug('Modified paths: src: %s dest: %s', src_path, dest_path)
-            to_get = self._get_files_list(src_path)
-            for entry in to_get:
-                dest = entry.replace(src_path, dest_path, 1)
-                url = self.duraspace_url + urllib.quote(entry)
-                LOGGER.debug('Getting %s', url)
-                response = self.session.get(url)
-                if response.status_code != 200:
-                    LOGGER.warning('Response: %s when fetching %s', response, url)
-                    LOGGER.warning('Response text: %s', response.text)
-                    raise StorageException('Unable to fetch %s' % entry)
-                self.space._create_local_directory(dest)
-                LOGGER.debug('Writing %s to %s', entry, dest)
-                with open(dest, 'wb') as f:
-                    f.write(response.content)
+            to_get = [(entry, entry.replace(src_path, dest_path, 1))
+                for entry in self._get_files_list(src_path)]
+            self._transfer_all(self._download_file, to_get)
         elif response.status_code != 200:
+            response.close()
             raise StorageException('Unable to fetch %s' % src_path)
         else:  # status_code == 200
-            self.space._create_local_directory(dest_path)
-            LOGGER.debug('Writing to %s', dest_path)
-            with open(dest_path, 'wb') as f:
-                f.write(response.content)
+            self._write_response(response, src_path, dest_path)
 
-    def _upload_file(self, url, upload_file):
+    def _download_file(self, content_id, download_file):
+        url = self.duraspace_url + urllib.quote(content_id)
+        LOGGER.debug('Getting %s', url)
+        response = self.session.get(url, stream=True)
+        if response.status_code == 404:
+            response.close()
+            manifest = self._get_manifest(content_id)
+            if manifest:
+                return self._download_chunked(content_id, download_file, manifest)
+        if response.status_code != 200:
+            LOGGER.warning('Response: %s when fetching %s', response, url)
+            LOGGER.warning('Response text: %s', response.text)
+            raise StorageException('Unable to fetch %s' % content_id)
+        self._write_response(response, content_id, download_file)
+
+    def _write_response(self, response, content_id, download_file):
+        """ Streams the body of response, a GET of content_id, to download_file.
+
+        The body is read in DURACLOUD_STREAM_CHUNK_SIZE chunks, so memory use
+        doesn't depend on the size of the content.  Raises StorageException
+        if the body doesn't match the response's Content-Length or
+        Content-MD5.  download_file is removed if the download fails for any
+        reason, so a truncated file is never left behind. """
+        self.space._create_local_directory(download_file)
+        LOGGER.debug('Writing %s to %s', content_id, download_file)
+        try:
+            with open(download_file, 'wb') as f:
+                size, checksum = _stream_response(response, f)
+            error = _response_error(response, size, checksum)
+            if error:
+                raise StorageException('Incomplete download of {}: {}'.format(content_id, error))
+        except Exception:
+            response.close()
+            if os.path.exists(download_file):
+                os.remove(download_file)
+            raise
+
+    def _get_manifest(self, content_id):
+        """ Returns the chunks manifest of content_id, or None if it isn't
+        chunked.
+
+        The manifest is a dict with the 'size', 'md5' and 'timestamp' of the
+        whole file, and 'chunks', a list of (chunk ID, size, md5) in order. """
+        url = self.duraspace_url + urllib.quote(content_id + DURACLOUD_MANIFEST_SUFFIX)
+        response = self.session.get(url)
+        if response.status_code == 404:
+            return None
+        if response.status_code != 200:
+            LOGGER.warning('Response: %s when fetching %s', response, url)
+            LOGGER.warning('Response text: %s', response.text)
+            raise StorageException('Unable to fetch manifest of %s' % content_id)
+        manifest = _parse_manifest(response.content)
+        manifest['timestamp'] = None
+        if response.headers.get('Last-Modified'):
+            manifest['timestamp'] = mktime_tz(parsedate_tz(response.headers['Last-Modified']))
+        return manifest
+
+    def _download_chunked(self, content_id, download_file, manifest):
+        """ Reassembles chunked content_id into download_file.
+
+        Each chunk is checked against the manifest as it is streamed, and the
+        whole file once it is complete.  Raises StorageException and removes
+        download_file if any don't match. """
+        self.space._create_local_directory(download_file)
+        LOGGER.debug('Reassembling %s from %s chunks to %s', content_id,
+            len(manifest['chunks']), download_file)
+        whole = hashlib.md5()
+        size = 0
+        try:
+            with open(download_file, 'wb') as f:
+                for chunk_id, chunk_size, chunk_md5 in manifest['chunks']:
+                    url = self.duraspace_url + urllib.quote(chunk_id)
+                    response = self.session.get(url, stream=True)
+                    if response.status_code != 200:
+                        LOGGER.warning('Response: %s when fetching %s', response, url)
+                        response.close()
+                        raise StorageException('Unable to fetch %s' % chunk_id)
+                    written, checksum = _stream_response(response, f, whole)
+                    error = _response_error(response, written, checksum)
+                    if not error and (written != chunk_size
+                            or checksum.hexdigest() != chunk_md5):
+                        error = 'does not match the manifest'
+                    if error:
+                        raise StorageException('Incomplete download of {}: {}'.format(chunk_id, error))
+                    size += written
+            if size != manifest['size'] or whole.hexdigest() != manifest['md5']:
+                raise StorageException('Reassembled {} does not match its manifest'.format(content_id))
+        except Exception:
+            if os.path.exists(download_file):
+                os.remove(download_file)
+            raise
+
+    def _remote_md5(self, content_id):
+        """ Returns the MD5 DuraCloud has for content_id, or None if it isn't stored. """
+        url = self.duraspace_url + urllib.quote(content_id)
+        response = self.session.head(url)
+        if response.status_code != 200:
+            return None
+        return response.headers.get('Content-MD5', '').lower() or None
+
+    def _upload_file(self, content_id, upload_file):
+        """ Uploads upload_file as content_id.
+
+        If the duracloud_skip_unchanged setting is on, first checks the MD5
+        of any content already stored as content_id, and doesn't upload the
+        file if it matches. """
+        chunk_size = utils.get_setting('duracloud_chunk_size')
+        if chunk_size is None:
+            chunk_size = DURACLOUD_CHUNK_SIZE
+        chunk_size *= 1024 * 1024
+        if chunk_size and os.path.getsize(upload_file) > chunk_size:
+            return self._upload_chunked(content_id, upload_file, chunk_size)
+        headers = {}
+        if utils.get_setting('duracloud_skip_unchanged', False):
+            md5 = _file_md5(upload_file)
+            if self._remote_md5(content_id) == md5:
+                LOGGER.debug('%s unchanged, skipping', content_id)
+                self._index_content(content_id, size=os.path.getsize(upload_file),
+                    checksum=md5)
+                return
+            # Have DuraCloud verify what it receives
+            headers['Content-MD5'] = md5
+        url = self.duraspace_url + urllib.quote(content_id)
         # Example URL: https://trial.duracloud.org/durastore/trial261//ts/test.txt
         with open(upload_file, 'rb') as f:
-            response = self.session.put(url, data=f)
+            response = self.session.put(url, data=f, headers=headers)
         LOGGER.info('Response from %s: %s', url, response)
         if response.status_code != 201:
             LOGGER.warning('Response text: %s', response.text)
             raise StorageException('Unable to store %s' % upload_file)
+        self._index_content(content_id, size=os.path.getsize(upload_file),
+            checksum=response.headers.get('Content-MD5') or headers.get('Content-MD5'))
+
+    def _upload_chunked(self, content_id, upload_file, chunk_size):
+        """ Uploads upload_file as chunks of chunk_size bytes and a manifest,
+        following DuraCloud's chunked content convention.
+
+        Chunks are uploaded concurrently, each with its checksum for DuraCloud
+        to verify.  Chunks already in DuraCloud with the right checksum are
+        skipped, so an interrupted upload resumes where it stopped. """
+        whole = hashlib.md5()
+        chunks = []
+        with open(upload_file, 'rb') as f:
+            while True:
+                checksum = hashlib.md5()
+                length = 0
+                while length < chunk_size:
+                    data = f.read(min(DURACLOUD_STREAM_CHUNK_SIZE, chunk_size - length))
+                    if not data:
+                        break
+                    checksum.update(data)
+                    whole.update(data)
+                    length += len(data)
+                if not length:
+                    break
+                chunk_id = '{}{}{:04d}'.format(content_id, DURACLOUD_CHUNK_SUFFIX, len(chunks))
+                chunks.append((chunk_id, length, checksum.hexdigest()))
+        LOGGER.info('Uploading %s to %s in %s chunks', upload_file, content_id, len(chunks))
+
+        to_put = []
+        offset = 0
+        for chunk_id, length, md5 in chunks:
+            to_put.append((chunk_id, upload_file, offset, length, md5))
+            offset += length
+        self._transfer_all(self._upload_chunk, to_put)
+
+        manifest_id = content_id + DURACLOUD_MANIFEST_SUFFIX
+        manifest = _chunks_manifest(content_id, offset, whole.hexdigest(), chunks)
+        url = self.duraspace_url + urllib.quote(manifest_id)
+        response = self.session.put(url, data=manifest,
+            headers={'Content-Type': 'application/xml'})
+        LOGGER.info('Response from %s: %s', url, response)
+        if response.status_code != 201:
+            LOGGER.warning('Response text: %s', response.text)
+            raise StorageException('Unable to store manifest of %s' % upload_file)
+        self._index_content(manifest_id, size=len(manifest),
+            checksum=hashlib.md5(manifest).hexdigest())
+
+    def _upload_chunk(self, chunk_id, upload_file, offset, length, md5):
+        """ Uploads length bytes of upload_file from offset as chunk_id,
+        unless DuraCloud already has it. """
+        url = self.duraspace_url + urllib.quote(chunk_id)
+        if self._remote_md5(chunk_id) == md5:
+            LOGGER.debug('%s already stored, skipping', chunk_id)
+        else:
+            with open(upload_file, 'rb') as f:
+                f.seek(offset)
+                response = self.session.put(url, data=_FileRange(f, length),
+                    headers={'Content-MD5': md5})
+            LOGGER.info('Response from %s: %s', url, response)
+            if response.status_code != 201:
+                LOGGER.warning('Response text: %s', response.text)
+                raise StorageException('Unable to store %s' % chunk_id)
+        self._index_content(chunk_id, size=length, checksum=md5)
 
     def move_from_storage_service(self, source_path, destination_path):
         """ Moves self.staging_path/src_path to dest_path. """
@@ -185,16 +792,165 @@ class Duracloud(models.Model):
             # Both source and destination paths should end with /
             destination_path = os.path.join(destination_path, '')
             # Duracloud does not accept folders, so upload each file individually
+            to_put = []
             for path, _, files in os.walk(source_path):
                 for basename in files:
                     entry = os.path.join(path, basename)
                     dest = entry.replace(source_path, destination_path, 1)
-                    url = self.duraspace_url + urllib.quote(dest)
-                    self._upload_file(url, entry)
+                    to_put.append((dest, entry))
+            self._transfer_all(self._upload_file, to_put)
         elif os.path.isfile(source_path):
-            url = self.duraspace_url + urllib.quote(destination_path)
-            self._upload_file(url, source_path)
+            self._upload_file(destination_path, source_path)
         elif not os.path.exists(source_path):
             raise StorageException('%s does not exist.' % source_path)
         else:
             raise StorageException('%s is not a file or directory.' % source_path)
+
+
+class DuracloudContent(models.Model):
+    """ Index of the content in a DuraCloud space.
+
+    Listing a large DuraCloud space takes many requests, so browsing and
+    expanding folders use this index instead while it is fresh.  It is
+    rebuilt by Duracloud.refresh_index and updated as the storage service
+    writes and deletes content.  Sizes, checksums and modification times are
+    only known for content written or browsed through the storage service. """
+    duracloud = models.ForeignKey('Duracloud', related_name='content_set')
+    content_id = models.CharField(max_length=1024)
+    # Content IDs are too long to index in MySQL, so they are looked up by hash
+    content_id_hash = models.CharField(max_length=40, editable=False,
+        help_text="SHA-1 of the content ID")
+    size = models.BigIntegerField(default=None, null=True, blank=True,
+        help_text="Size in bytes")
+    checksum = models.CharField(max_length=32, default=None, null=True,
+        blank=True, help_text="MD5 checksum")
+    modified = models.DateTimeField(default=None, null=True, blank=True)
+    indexed_time = models.DateTimeField(
+        help_text="When this content was last seen or written.")
+
+    class Meta:
+        verbose_name = "DuraCloud Content"
+        app_label = 'locations'
+        unique_together = ('duracloud', 'content_id_hash')
+
+    def __unicode__(self):
+        return u'{}'.format(self.content_id)
+
+    def save(self, *args, **kwargs):
+        self.content_id_hash = _content_id_hash(self.content_id)
+        super(DuracloudContent, self).save(*args, **kwargs)
+
+
+class _FileRange(object):
+    """ Read-only view of the next length bytes of an open file, so a chunk
+    can be uploaded without reading all of it into memory. """
+
+    def __init__(self, f, length):
+        self._file = f
+        self._remaining = length
+        # requests reads the length of the body from len or __len__
+        self.len = length
+
+    def __len__(self):
+        return self.len
+
+    def read(self, size=-1):
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._file.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def __iter__(self):
+        return iter(lambda: self.read(DURACLOUD_STREAM_CHUNK_SIZE), '')
+
+
+def _file_md5(path):
+    """ Returns the hex MD5 of the file at path. """
+    checksum = hashlib.md5()
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(DURACLOUD_STREAM_CHUNK_SIZE), ''):
+            checksum.update(data)
+    return checksum.hexdigest()
+
+
+def _stream_response(response, f, *checksums):
+    """ Writes the body of response to f, DURACLOUD_STREAM_CHUNK_SIZE bytes at
+    a time, and closes it.
+
+    Also updates each of checksums with the body.  Returns the size of the
+    body and its MD5 hash object. """
+    checksum = hashlib.md5()
+    size = 0
+    try:
+        for chunk in response.iter_content(DURACLOUD_STREAM_CHUNK_SIZE):
+            f.write(chunk)
+            checksum.update(chunk)
+            for c in checksums:
+                c.update(chunk)
+            size += len(chunk)
+    finally:
+        response.close()
+    return size, checksum
+
+
+def _response_error(response, size, checksum):
+    """ Returns why a body of size bytes with MD5 hash object checksum
+    doesn't match response's Content-Length or Content-MD5, or None. """
+    expected_size = response.headers.get('Content-Length')
+    # Content-Length is of the encoded body if the response was compressed
+    if (expected_size is not None and 'Content-Encoding' not in response.headers
+            and int(expected_size) != size):
+        return 'expected {} bytes, got {}'.format(expected_size, size)
+    expected_md5 = response.headers.get('Content-MD5')
+    # DuraCloud sends the checksum in hex, rather than base64 as in RFC 1864
+    if expected_md5 and expected_md5.lower() != checksum.hexdigest() \
+            and expected_md5 != base64.b64encode(checksum.digest()):
+        return 'expected MD5 {}, got {}'.format(expected_md5, checksum.hexdigest())
+    return None
+
+
+def _content_id_hash(content_id):
+    """ Returns the DuracloudContent.content_id_hash of content_id. """
+    return hashlib.sha1(utils.coerce_str(content_id)).hexdigest()
+
+
+def _chunks_manifest(content_id, size, md5, chunks):
+    """ Returns a DuraCloud chunks manifest, as XML, for content_id of size
+    bytes with checksum md5, stored as chunks, a list of (chunk ID, size, md5). """
+    root = etree.Element('{%s}chunksManifest' % DURACLOUD_MANIFEST_NAMESPACE,
+        nsmap={'dur': DURACLOUD_MANIFEST_NAMESPACE}, schemaVersion='0.2')
+    header = etree.SubElement(root, 'header', schemaVersion='0.2')
+    source = etree.SubElement(header, 'sourceContent',
+        contentId=content_id.decode('utf-8'))
+    etree.SubElement(source, 'mimetype').text = 'application/octet-stream'
+    etree.SubElement(source, 'byteSize').text = str(size)
+    etree.SubElement(source, 'md5').text = md5
+    chunks_element = etree.SubElement(root, 'chunks')
+    for index, (chunk_id, chunk_size, chunk_md5) in enumerate(chunks):
+        chunk = etree.SubElement(chunks_element, 'chunk',
+            chunkId=chunk_id.decode('utf-8'), index=str(index))
+        etree.SubElement(chunk, 'byteSize').text = str(chunk_size)
+        etree.SubElement(chunk, 'md5').text = chunk_md5
+    return etree.tostring(root, encoding='UTF-8', xml_declaration=True,
+        pretty_print=True)
+
+
+def _parse_manifest(manifest):
+    """ Returns the 'size' and 'md5' of the content described by a DuraCloud
+    chunks manifest, and its 'chunks' as (chunk ID, size, md5) in order. """
+    root = etree.fromstring(manifest)
+    source = root.find('header/sourceContent')
+    chunks = sorted(root.findall('chunks/chunk'), key=lambda c: int(c.get('index')))
+    return {
+        'size': int(source.findtext('byteSize')),
+        'md5': source.findtext('md5'),
+        'chunks': [(utils.coerce_str(c.get('chunkId')), int(c.findtext('byteSize')),
+            c.findtext('md5')) for c in chunks],
+    }
+
+
+def refresh_duracloud_index(duracloud_id, started):
+    """ Entry point for the process started by Duracloud.spawn_index_refresh. """
+    utils.forget_inherited_db_connections()
+    Duracloud.objects.get(pk=duracloud_id).refresh_index(started)
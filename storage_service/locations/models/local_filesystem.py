@@ -34,12 +34,12 @@ class LocalFilesystem(models.Model):
         """ Moves src_path to dest_space.staging_path/dest_path. """
         # Archivematica expects the file to still be on disk even after stored
         self.space._create_local_directory(dest_path)
-        return self.space._move_rsync(src_path, dest_path)
+        return self.space._move_local(src_path, dest_path, keep_source=True)
 
     def move_from_storage_service(self, source_path, destination_path):
         """ Moves self.staging_path/src_path to dest_path. """
         self.space._create_local_directory(destination_path)
-        return self.space._move_rsync(source_path, destination_path)
+        return self.space._move_local(source_path, destination_path, keep_source=False)
 
     def verify(self):
         """ Verify that the space is accessible to the storage service. """
@@ -59,6 +59,8 @@ class Location(models.Model):
         help_text="Size, in bytes (optional)")
     used = models.BigIntegerField(default=0,
         help_text="Amount used, in bytes.")
+    reserved = models.BigIntegerField(default=0,
+        help_text="Amount reserved for packages being stored, in bytes.")
     enabled = models.BooleanField(default=True,
         help_text="True if space can be accessed.")
 
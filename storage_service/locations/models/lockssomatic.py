@@ -1,28 +1,49 @@
 # stdlib, alphabetical
 import errno
+import hashlib
 import logging
 from lxml import etree
 import math
+from multiprocessing.pool import ThreadPool
 import os
-import shutil
-import subprocess
+import time
 
 # Core Django, alphabetical
 from django.core.urlresolvers import reverse
 from django.db import models
 
 # Third party dependencies, alphabetical
+import requests
 import sword2
 
 # This project, alphabetical
 from common import utils
 
 # This module, alphabetical
+from . import StorageException
 from location import Location
 from package import Package
 
 LOGGER = logging.getLogger(__name__)
 
+# Size of the reads made while splitting a package into LOCKSS chunks
+SPLIT_READ_SIZE = 4 * 1024 * 1024
+
+# Polling of staged packages' SWORD statements by poll_lockss_status
+LOCKSS_POLL_WORKERS = 8
+LOCKSS_POLL_BATCH_SIZE = 100
+# Packages not yet in agreement wait this long before being polled again,
+# doubling each time up to LOCKSS_POLL_MAX_DELAY
+LOCKSS_POLL_DELAY = 60 * 60  # seconds
+LOCKSS_POLL_MAX_DELAY = 7 * 24 * 60 * 60  # seconds
+
+# Default for the lockss_service_document_ttl setting
+SERVICE_DOCUMENT_TTL = 60 * 60  # seconds
+# Service documents and SWORD connections shared by all calls in this
+# process.  Space UUID: dict of 'time', 'sd_iri', 'on_behalf_of',
+# 'connection', 'au_size', 'collection_iri' and 'checksum_type'
+SERVICE_DOCUMENT_CACHE = {}
+
 
 class Lockssomatic(models.Model):
     """ Spaces that store their contents in LOCKSS, via LOCKSS-o-matic. """
@@ -43,6 +64,8 @@ class Lockssomatic(models.Model):
     checksum_type = models.CharField(max_length=64, null=True, blank=True, verbose_name='Checksum type', help_text='Checksum type to send to LOCKSS-o-matic for verification.  Eg. md5, sha1, sha256')
     keep_local = models.BooleanField(blank=True, default=True, verbose_name="Keep local copy?",
         help_text="If checked, keep a local copy even after the AIP is stored in the LOCKSS network.")
+    virtual_chunks = models.BooleanField(blank=True, default=False, verbose_name="Virtual chunks?",
+        help_text="If checked, LOCKSS chunks are served as byte ranges of the AIP instead of being written to disk as separate files.")
 
     class Meta:
         verbose_name = 'LOCKSS-o-matic'
@@ -57,9 +80,12 @@ class Lockssomatic(models.Model):
     # Parsed pointer file
     pointer_root = None
 
-    def browse(self, path):
+    def browse(self, path, properties=False):
         LOGGER.warning('Lockssomatic does not support browsing')
-        return {'directories': [], 'entries': []}
+        objects = {'directories': [], 'entries': []}
+        if properties:
+            objects['properties'] = {}
+        return objects
 
     def move_to_storage_service(self, source_path, destination_path, dest_space):
         """ Moves source_path to dest_space.staging_path/destination_path. """
@@ -69,13 +95,15 @@ class Lockssomatic(models.Model):
     def move_from_storage_service(self, source_path, destination_path):
         """ Moves self.staging_path/source_path to destination_path. """
         self.space._create_local_directory(destination_path)
-        return self.space._move_rsync(source_path, destination_path)
+        return self.space._move_local(source_path, destination_path, keep_source=False)
 
     def post_move_from_storage_service(self, staging_path, destination_path, package):
         # LOCKSS can only save packages in the storage service, since it needs
         # to track information on it over time
         if package is None:
             return
+        # Pointer file is parsed per package
+        self.pointer_root = None
         # Post to Lockss-o-matic with the create resource atom entry
         LOGGER.info('Storing %s in LOCKSS', package.current_path)
 
@@ -101,6 +129,7 @@ class Lockssomatic(models.Model):
             # sword.Deposit_Recipt (might be None, or sword.Error_Document) and
             # may not have the required attributes
             LOGGER.warning('Unable to contact LOCKSS for package %s', package.uuid)
+            self.invalidate_service_document()
         else:
             LOGGER.info("LOCKSS State IRI for %s: %s", package.uuid, state_iri)
             LOGGER.info("LOCKSS Edit IRI for %s: %s", package.uuid, edit_iri)
@@ -119,8 +148,6 @@ class Lockssomatic(models.Model):
         If all are in agreement, add those URLs to the pointer file for each
         LOCKSS chunk.
         """
-        status = package.status
-
         # Need to have state and edit IRI to talk to LOM
         if 'state_iri' not in package.misc_attributes or 'edit_iri' not in package.misc_attributes:
             self.post_move_from_storage_service(None, None, package)
@@ -132,14 +159,52 @@ class Lockssomatic(models.Model):
         if not self.sword_connection and not self.update_service_document():
             return (None, 'Error contacting LOCKSS-o-matic.')
 
+        statement_root = self._fetch_statement(package)
+        if statement_root is None:
+            return (None, 'Error polling LOCKSS-o-matic for SWORD statement.')
+
+        return self._apply_statement(package, statement_root)
+
+    def _fetch_statement(self, package, session=None):
+        """
+        Fetches and parses the SWORD statement for package from LOM.
+
+        Returns None on error.  Only makes HTTP requests, so it can be called
+        from several threads sharing one requests session.
+        """
         # SWORD2 client has only experimental support for getting SWORD2
         # statements, so implementing the fetch and parse here. (March 2014)
-        response = self.sword_connection.get_resource(package.misc_attributes['state_iri'], headers={'Accept': 'application/atom+xml;type=feed'})
+        session = session or requests
+        headers = {
+            'Accept': 'application/atom+xml;type=feed',
+            'On-Behalf-Of': str(self.content_provider_id),
+        }
+        try:
+            response = session.get(package.misc_attributes['state_iri'],
+                headers=headers)
+        except requests.exceptions.RequestException:
+            LOGGER.exception('Error fetching SWORD statement for %s', package.uuid)
+            self.invalidate_service_document()
+            return None
+        if response.status_code != 200:
+            LOGGER.warning('Error %s fetching SWORD statement for %s',
+                response.status_code, package.uuid)
+            self.invalidate_service_document()
+            return None
+        try:
+            return etree.fromstring(response.content)
+        except etree.XMLSyntaxError:
+            LOGGER.exception('Invalid SWORD statement for %s', package.uuid)
+            return None
 
-        if response.code != 200:
-            return (None, 'Error polling LOCKSS-o-matic for SWORD statement.')
+    def _apply_statement(self, package, statement_root):
+        """
+        Updates package's status, pointer file and local copies from its
+        parsed SWORD statement.
 
-        statement_root = etree.fromstring(response.content)
+        Helper to update_package_status.
+        """
+        status = package.status
 
         # TODO Check that number of lom:content entries is same as number of chunks
         # TODO what to do if was quorum, and now not??
@@ -154,8 +219,7 @@ class Lockssomatic(models.Model):
         status = Package.UPLOADED
 
         # Add LOCKSS URLs to each chunk
-        if not self.pointer_root:
-            self.pointer_root = etree.parse(package.full_pointer_file_path)
+        self.pointer_root = etree.parse(package.full_pointer_file_path)
         files = self.pointer_root.findall(".//mets:fileSec/mets:fileGrp[@USE='LOCKSS chunk']/mets:file", namespaces=utils.NSMAP)
         # If not files, find AIP fileGrp (package unsplit)
         if not files:
@@ -231,6 +295,7 @@ class Lockssomatic(models.Model):
         # Return with error message if response not 200
         LOGGER.debug('response code: %s', response['status'])
         if response['status'] != 200:
+            self.invalidate_service_document()
             if response['status'] == 202:  # Accepted - pushing new config
                 return 'Lockss-o-matic is updating the config to stop harvesting.  Please try again to delete local files.'
             if response['status'] == 204:  # No Content - no matching AIP
@@ -295,38 +360,82 @@ class Lockssomatic(models.Model):
                 # Delete structMap div TYPE='Local copy'
                 del_elem = self.pointer_root.find(".//mets:structMap/*/mets:div[@TYPE='Local copy']", namespaces=utils.NSMAP)
                 del_elem.getparent().remove(del_elem)
+                # Delete byte ranges of the local copy from virtual chunks
+                for del_elem in self.pointer_root.findall(".//mets:structMap//mets:fptr/mets:area", namespaces=utils.NSMAP):
+                    del_elem.getparent().remove(del_elem)
         return None
 
-    def update_service_document(self):
+    def update_service_document(self, force=False):
         """ Fetch the service document from self.sd_iri and updates based on that.
 
-        Updates AU size and collection IRI.
+        Updates AU size, collection IRI and checksum type, saving them only if
+        they changed.
+
+        The service document and SWORD connection are cached for this process
+        for lockss_service_document_ttl seconds, and are only fetched again
+        once that expires, or if force is True.
 
         Returns True on success, False on error.  No updates performed on error."""
+        cached = SERVICE_DOCUMENT_CACHE.get(self.space_id)
+        if (force or not cached or cached['sd_iri'] != self.sd_iri
+                or cached['on_behalf_of'] != self.content_provider_id
+                or time.time() - cached['time'] >= _service_document_ttl()):
+            cached = self._fetch_service_document()
+            if cached is None:
+                self.invalidate_service_document()
+                return False
+            SERVICE_DOCUMENT_CACHE[self.space_id] = cached
+
+        self.sword_connection = cached['connection']
+        changed = [field for field in ('au_size', 'collection_iri', 'checksum_type')
+            if getattr(self, field) != cached[field]]
+        for field in changed:
+            setattr(self, field, cached[field])
+        if changed:
+            self.save()
+        return True
+
+    def invalidate_service_document(self):
+        """ Discards the cached service document, so the next call to
+        update_service_document fetches it again.  Called when LOM returns an
+        error, in case its configuration has changed. """
+        SERVICE_DOCUMENT_CACHE.pop(self.space_id, None)
+
+    def _fetch_service_document(self):
+        """ Fetches and parses the service document from self.sd_iri.
+
+        Returns a SERVICE_DOCUMENT_CACHE entry, or None on error. """
         try:
-            self.sword_connection = sword2.Connection(self.sd_iri, download_service_document=True,
+            connection = sword2.Connection(self.sd_iri, download_service_document=True,
                 on_behalf_of=self.content_provider_id)
         except Exception:  # TODO make this more specific
             LOGGER.exception("Error getting service document from SWORD server.")
-            return False
+            return None
         # AU size
-        self.au_size = self.sword_connection.maxUploadSize * 1000  # Convert from kB
+        au_size = connection.maxUploadSize * 1000  # Convert from kB
 
         # Collection IRI
         # Workspaces are a list of ('workspace name', [collections]) tuples
         # Currently only support one workspace, so take the first one
         try:
-            self.collection_iri = self.sword_connection.workspaces[0][1][0].href
+            collection_iri = connection.workspaces[0][1][0].href
         except IndexError:
             LOGGER.warning("No collection IRI found in LOCKSS-o-matic service document.")
-            return False
+            return None
 
         # Checksum type - LOM specific tag
-        root = self.sword_connection.sd.service_dom
-        self.checksum_type = root.findtext('lom:uploadChecksumType', namespaces=utils.NSMAP)
-
-        self.save()
-        return True
+        root = connection.sd.service_dom
+        checksum_type = root.findtext('lom:uploadChecksumType', namespaces=utils.NSMAP)
+
+        return {
+            'time': time.time(),
+            'sd_iri': self.sd_iri,
+            'on_behalf_of': self.content_provider_id,
+            'connection': connection,
+            'au_size': au_size,
+            'collection_iri': collection_iri,
+            'checksum_type': checksum_type,
+        }
 
     def _split_package(self, package):
         """
@@ -337,6 +446,12 @@ class Lockssomatic(models.Model):
 
         Updates the pointer file with the new LOCKSS chunks, and adds 'division'
         event.
+
+        Chunks are consecutive byte ranges of the package, named
+        <package>.tar-1, <package>.tar-2, etc., so concatenating them in order
+        recreates the package.  If self.virtual_chunks is set, the chunks are
+        not written to disk; instead the structMap records each chunk's byte
+        range in the AIP, and downloads of a chunk are served from the AIP.
         """
         # Parse pointer file
         if not self.pointer_root:
@@ -361,36 +476,23 @@ class Lockssomatic(models.Model):
             return output_files
 
         # Split file
-        # Strip extension, add .tar-1 ('-1' to make rename script happy)
-        output_path = os.path.splitext(file_path)[0] + '.tar-1'
-        command = ['tar', '--create', '--multi-volume',
-            '--tape-length', str(self.au_size),
-            '--new-volume-script', 'common/tar_new_volume.sh',
-            '-f', output_path, file_path]
         # TODO reserve space in quota for extra files
-        LOGGER.info('LOCKSS split command: %s', command)
         try:
-            subprocess.check_call(command)
+            chunks = self._write_chunks(package)
         except Exception:
-            LOGGER.exception("Split of %s failed with command %s", file_path, command)
+            LOGGER.exception("Split of %s failed", file_path)
             raise
-        output_path = output_path[:-2]  # Remove '-1'
-        dirname, basename = os.path.split(output_path)
-        output_files = sorted([os.path.join(dirname, entry) for entry in os.listdir(dirname) if entry.startswith(basename)])
+        output_files = [c['path'] for c in chunks]
 
         # Update pointer file
         amdsec = self.pointer_root.find('mets:amdSec', namespaces=utils.NSMAP)
 
         # Add 'division' PREMIS:EVENT
-        try:
-            event_detail = subprocess.check_output(['tar', '--version'])
-        except subprocess.CalledProcessError as e:
-            event_detail = e.output or 'Error: getting tool info; probably GNU tar'
         digiprov_id = 'digiprovMD_{}'.format(len(amdsec))
         digiprov_split = utils.mets_add_event(
             digiprov_id=digiprov_id,
             event_type='division',
-            event_detail=event_detail,
+            event_detail='Split into chunks of {} bytes by the Storage Service'.format(self.au_size),
             event_outcome_detail_note='{} LOCKSS chunks created'.format(len(output_files)),
         )
         LOGGER.debug('PREMIS:EVENT division: %s', etree.tostring(digiprov_split, pretty_print=True))
@@ -404,42 +506,125 @@ class Lockssomatic(models.Model):
             amdsec.append(digiprov_agent)
 
         # Update structMap & fileSec
+        mets = '{' + utils.NSMAP['mets'] + '}'
         self.pointer_root.find('mets:structMap', namespaces=utils.NSMAP).set('TYPE', 'logical')
         aip_div = self.pointer_root.find("mets:structMap/mets:div[@TYPE='Archival Information Package']", namespaces=utils.NSMAP)
         filesec = self.pointer_root.find('mets:fileSec', namespaces=utils.NSMAP)
-        filegrp = etree.SubElement(filesec, 'fileGrp', USE='LOCKSS chunk')
+        aip_file_id = filesec.find('.//mets:file', namespaces=utils.NSMAP).get('ID')
+        filegrp = etree.SubElement(filesec, mets + 'fileGrp', USE='LOCKSS chunk')
 
         # Move ftpr to Local copy div
         local_ftpr = aip_div.find('mets:fptr', namespaces=utils.NSMAP)
         if local_ftpr is not None:
-            div = etree.SubElement(aip_div, 'div', TYPE='Local copy')
+            div = etree.SubElement(aip_div, mets + 'div', TYPE='Local copy')
             div.append(local_ftpr)  # This moves local_fptr
 
         # Add each split chunk to structMap & fileSec
-        for idx, out_path in enumerate(output_files):
+        for idx, chunk in enumerate(chunks):
+            out_path = chunk['path']
             # Add div to structMap
-            div = etree.SubElement(aip_div, 'div', TYPE='LOCKSS chunk', ORDER=str(idx + 1))
-            etree.SubElement(div, 'fptr', FILEID=os.path.basename(out_path))
-            # Get checksum and size for fileSec
-            try:
-                checksum = utils.generate_checksum(out_path, self.checksum_type)
-            except ValueError:  # Invalid checksum type
-                checksum = utils.generate_checksum(out_path, 'md5')
-            checksum_name = checksum.name.upper().replace('SHA', 'SHA-')
-            size = os.path.getsize(out_path)
+            div = etree.SubElement(aip_div, mets + 'div', TYPE='LOCKSS chunk', ORDER=str(idx + 1))
+            fptr = etree.SubElement(div, mets + 'fptr', FILEID=os.path.basename(out_path))
             # Add file & FLocat to fileSec
-            file_e = etree.SubElement(filegrp, 'file',
-                ID=os.path.basename(out_path), SIZE=str(size),
-                CHECKSUM=checksum.hexdigest(), CHECKSUMTYPE=checksum_name)
-            flocat = etree.SubElement(file_e, 'FLocat', OTHERLOCTYPE="SYSTEM", LOCTYPE="OTHER")
-            flocat.set('{' + utils.NSMAP['xlink'] + '}href', out_path)
+            file_e = etree.SubElement(filegrp, mets + 'file',
+                ID=os.path.basename(out_path), SIZE=str(chunk['size']),
+                CHECKSUM=chunk['checksum'], CHECKSUMTYPE=chunk['checksum_type'])
+            if self.virtual_chunks:
+                # Chunk is a byte range of the local copy
+                etree.SubElement(fptr, mets + 'area', BETYPE='BYTE',
+                    FILEID=aip_file_id,
+                    BEGIN=str(chunk['offset']),
+                    END=str(chunk['offset'] + chunk['size'] - 1))
+            else:
+                flocat = etree.SubElement(file_e, mets + 'FLocat', OTHERLOCTYPE="SYSTEM", LOCTYPE="OTHER")
+                flocat.set('{' + utils.NSMAP['xlink'] + '}href', out_path)
 
         # Write out pointer file again
         with open(package.full_pointer_file_path, 'w') as f:
             f.write(etree.tostring(self.pointer_root, pretty_print=True))
 
+        # The pointer file now records the chunks
+        package.misc_attributes.pop('lockss_split', None)
+        package.save()
+
         return output_files
 
+    def _write_chunks(self, package):
+        """
+        Writes the package to chunks of self.au_size bytes, checksumming each
+        chunk as it is written.  Returns a list of dicts with the 'path',
+        'offset', 'size', 'checksum' and 'checksum_type' of each chunk.
+
+        If self.virtual_chunks is set, the chunks are only checksummed, and
+        nothing is written to 'path'.
+
+        Progress is saved in the package's misc_attributes after each chunk,
+        so if splitting is interrupted it resumes after the last complete
+        chunk.
+        """
+        file_path = package.full_path
+        try:
+            hashlib.new(self.checksum_type)
+            algorithm = self.checksum_type
+        except (TypeError, ValueError):  # Invalid checksum type
+            algorithm = 'md5'
+        # Strip extension, add .tar-N
+        base_path = os.path.splitext(file_path)[0] + '.tar-'
+
+        state = package.misc_attributes.get('lockss_split')
+        settings = {'au_size': self.au_size, 'algorithm': algorithm,
+            'virtual': self.virtual_chunks}
+        if not state or any(state.get(k) != v for k, v in settings.items()):
+            state = dict(settings, chunks=[])
+        # Only resume from chunks that were completely written
+        chunks = []
+        for chunk in state['chunks']:
+            if not self.virtual_chunks and (not os.path.isfile(chunk['path']) or os.path.getsize(chunk['path']) != chunk['size']):
+                break
+            chunks.append(chunk)
+        state['chunks'] = chunks
+        offset = sum(c['size'] for c in chunks)
+        if chunks:
+            LOGGER.info('Resuming split of %s after %s chunks', file_path, len(chunks))
+
+        with open(file_path, 'rb') as f:
+            f.seek(offset)
+            while True:
+                out_path = base_path + str(len(chunks) + 1)
+                checksum = hashlib.new(algorithm)
+                size = 0
+                out = None if self.virtual_chunks else open(out_path, 'wb')
+                try:
+                    while size < self.au_size:
+                        data = f.read(min(SPLIT_READ_SIZE, self.au_size - size))
+                        if not data:
+                            break
+                        if out:
+                            out.write(data)
+                        checksum.update(data)
+                        size += len(data)
+                finally:
+                    if out:
+                        out.flush()
+                        os.fsync(out.fileno())
+                        out.close()
+                if not size:
+                    if out:
+                        os.remove(out_path)
+                    break
+                LOGGER.debug('Wrote LOCKSS chunk %s', out_path)
+                chunks.append({
+                    'path': out_path,
+                    'offset': offset,
+                    'size': size,
+                    'checksum': checksum.hexdigest(),
+                    'checksum_type': checksum.name.upper().replace('SHA', 'SHA-'),
+                })
+                offset += size
+                package.misc_attributes['lockss_split'] = state
+                package.save()
+        return chunks
+
     def _download_url(self, uuid, index=None):
         """
         Returns externally available download URL for a file.
@@ -462,36 +647,14 @@ class Lockssomatic(models.Model):
         LOCKSS-o-matic-specific tags to describe size and checksums.
         """
 
-        # Parse METS to get information for atom entry
-        relative_mets_path = os.path.join(
-            os.path.splitext(os.path.basename(package.current_path))[0],
-            "data",
-            'METS.{}.xml'.format(package.uuid))
-        (mets_path, temp_dir) = package.extract_file(relative_mets_path)
-        mets = etree.parse(mets_path)
-        # Delete temp dir if created
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
-
-        # Parse out name and description if found
-        slug = str(package.uuid)
-        title = os.path.basename(package.current_path)
-        summary = 'AIP generated by Archivematica with uuid {}'.format(package.uuid)
-        dublincore = mets.find('mets:dmdSec/mets:mdWrap[@MDTYPE="DC"]/mets:xmlData/dcterms:dublincore', namespaces=utils.NSMAP)
-        if dublincore is not None:
-            title = dublincore.findtext('dcterms:title', namespaces=utils.NSMAP, default=title)
-            slug = dublincore.findtext('dcterms:title', namespaces=utils.NSMAP, default=slug)
-            summary = dublincore.findtext('dcterms:description', namespaces=utils.NSMAP, default=summary)
-        # Parse out Agent for author
-        authors = mets.xpath(".//mets:mdWrap[@MDTYPE='PREMIS:AGENT']//mets:agentType[text()='organization']/ancestor::mets:agent/*/mets:agentIdentifierValue", namespaces=utils.NSMAP)
-        author = authors[0].text if authors else None
+        metadata = self._mets_metadata(package)
 
         # Create atom entry
         entry = sword2.Entry(
-            title=title,
+            title=metadata['title'],
             id='urn:uuid:' + package.uuid,
-            author={'name': author},
-            summary=summary)
+            author={'name': metadata['author']},
+            summary=metadata['summary'])
 
         # Add each chunk to the atom entry
         if not self.pointer_root:
@@ -532,4 +695,138 @@ class Lockssomatic(models.Model):
             content_entry.set('checksumValue', checksum_value)
 
         LOGGER.debug('LOCKSS atom entry: %s', entry)
-        return entry, slug
+        return entry, metadata['slug']
+
+    def _mets_metadata(self, package):
+        """
+        Returns a dict of the 'title', 'slug', 'summary' and 'author' of
+        package for its Atom entry, parsed from its METS file.
+
+        Only the METS file is read from the package, and the result is cached
+        in the package's misc_attributes so retries don't read it again.
+        """
+        if 'mets_metadata' in package.misc_attributes:
+            return package.misc_attributes['mets_metadata']
+
+        # Parse METS to get information for atom entry
+        relative_mets_path = os.path.join(
+            os.path.splitext(os.path.basename(package.current_path))[0],
+            "data",
+            'METS.{}.xml'.format(package.uuid))
+        with package.open_file(relative_mets_path) as mets_file:
+            if mets_file is None:
+                raise StorageException('{} not found in package {}'.format(
+                    relative_mets_path, package.uuid))
+            mets = etree.parse(mets_file).getroot()
+
+        # Parse out name and description if found
+        slug = str(package.uuid)
+        title = os.path.basename(package.current_path)
+        summary = 'AIP generated by Archivematica with uuid {}'.format(package.uuid)
+        dublincore = mets.find('mets:dmdSec/mets:mdWrap[@MDTYPE="DC"]/mets:xmlData/dcterms:dublincore', namespaces=utils.NSMAP)
+        if dublincore is not None:
+            title = dublincore.findtext('dcterms:title', namespaces=utils.NSMAP, default=title)
+            slug = dublincore.findtext('dcterms:title', namespaces=utils.NSMAP, default=slug)
+            summary = dublincore.findtext('dcterms:description', namespaces=utils.NSMAP, default=summary)
+        # Parse out Agent for author
+        authors = mets.xpath(".//mets:mdWrap[@MDTYPE='PREMIS:AGENT']//mets:agentType[text()='organization']/ancestor::mets:agent/*/mets:agentIdentifierValue", namespaces=utils.NSMAP)
+        author = authors[0].text if authors else None
+
+        metadata = {'title': title, 'slug': slug, 'summary': summary, 'author': author}
+        package.misc_attributes['mets_metadata'] = metadata
+        package.save()
+        return metadata
+
+
+def _service_document_ttl():
+    ttl = utils.get_setting('lockss_service_document_ttl')
+    if ttl is None:
+        ttl = SERVICE_DOCUMENT_TTL
+    return ttl
+
+
+def poll_lockss_status(workers=LOCKSS_POLL_WORKERS,
+        batch_size=LOCKSS_POLL_BATCH_SIZE, force=False):
+    """
+    Updates the status of every package staged in a LOCKSS-o-matic space.
+
+    Each space's SWORD statements are fetched concurrently by `workers`
+    threads sharing one HTTP session, `batch_size` packages at a time, and
+    then applied to each package in turn.  Packages that are not yet in
+    agreement are polled again after a back-off, unless `force` is set.
+
+    Returns a dict of the number of packages 'uploaded', 'staging' and
+    'skipped'.
+    """
+    summary = {'uploaded': 0, 'staging': 0, 'skipped': 0}
+    now = time.time()
+    for lom in Lockssomatic.objects.all():
+        packages = Package.objects.filter(status=Package.STAGING,
+            current_location__space=lom.space_id).order_by('id')
+        due = []
+        for package in packages:
+            if force or (package.misc_attributes or {}).get('lockss_poll', {}).get('next_poll', 0) <= now:
+                due.append(package)
+            else:
+                summary['skipped'] += 1
+        if not due:
+            continue
+        # Also sets up the SWORD connection used to update LOM
+        if not lom.update_service_document():
+            LOGGER.warning('Unable to contact LOCKSS-o-matic for %s', lom.space)
+            summary['staging'] += len(due)
+            continue
+
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=workers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        pool = ThreadPool(workers)
+        try:
+            for start in range(0, len(due), batch_size):
+                batch = []
+                for package in due[start:start + batch_size]:
+                    # Retry sending packages LOM hasn't accepted yet
+                    if 'state_iri' not in package.misc_attributes or 'edit_iri' not in package.misc_attributes:
+                        lom.post_move_from_storage_service(None, None, package)
+                    if 'state_iri' in package.misc_attributes and 'edit_iri' in package.misc_attributes:
+                        batch.append(package)
+                    else:
+                        _record_poll(package, None, now)
+                        summary['staging'] += 1
+                statements = pool.map(
+                    lambda package: lom._fetch_statement(package, session), batch)
+                for package, statement_root in zip(batch, statements):
+                    status, error = None, None
+                    if statement_root is not None:
+                        try:
+                            status, error = lom._apply_statement(package, statement_root)
+                        except Exception:
+                            LOGGER.exception('Error updating status of %s', package.uuid)
+                    if error:
+                        LOGGER.info('LOCKSS status of %s: %s', package.uuid, error)
+                    _record_poll(package, status, now)
+                    if status == Package.UPLOADED:
+                        summary['uploaded'] += 1
+                    else:
+                        summary['staging'] += 1
+        finally:
+            pool.close()
+            pool.join()
+    return summary
+
+
+def _record_poll(package, status, now):
+    """ Saves when package should next be polled, backing off exponentially
+    while it is not stored in LOCKSS. """
+    if status == Package.UPLOADED:
+        if package.misc_attributes.pop('lockss_poll', None) is not None:
+            package.save()
+        return
+    attempts = package.misc_attributes.get('lockss_poll', {}).get('attempts', 0) + 1
+    delay = min(LOCKSS_POLL_DELAY * 2 ** (attempts - 1), LOCKSS_POLL_MAX_DELAY)
+    package.misc_attributes['lockss_poll'] = {
+        'attempts': attempts,
+        'next_poll': now + delay,
+    }
+    package.save()
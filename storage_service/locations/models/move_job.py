@@ -0,0 +1,340 @@
+# stdlib, alphabetical
+import datetime
+import logging
+from multiprocessing import Process
+from multiprocessing.pool import ThreadPool
+import os
+import random
+import threading
+import time
+
+# Core Django, alphabetical
+from django.db import connection
+from django.db import models
+from django.db.models import Q
+from django.utils import timezone
+
+# Third party dependencies, alphabetical
+from django_extensions.db.fields import UUIDField
+
+# This project, alphabetical
+from common import utils
+
+# This module, alphabetical
+from . import StorageException
+
+__all__ = ('MoveJob', 'MoveJobFile')
+
+LOGGER = logging.getLogger(__name__)
+
+# Seconds between checks for a free move on a busy space, with some jitter so
+# waiting jobs don't keep claiming in step
+MOVE_SLOT_POLL = 5
+# Files moved at once by a job when neither space limits its moves
+MOVE_JOB_WORKERS = 4
+# Longest a file waits for a free move before it fails
+MOVE_SLOT_TIMEOUT = 30 * 60  # seconds
+# Seconds between updates of a running job's heartbeat_time.  A job that
+# hasn't updated it for MOVE_JOB_STALE seconds is assumed to have died.
+MOVE_JOB_HEARTBEAT = 60
+MOVE_JOB_STALE = 5 * 60
+
+
+class MoveJob(models.Model):
+    """ Tracks moving a set of files from one Location to another.
+
+    Created by the Location move endpoint.  The moves are run outside the
+    HTTP request by run_move_job, and pipelines poll the job for progress. """
+    uuid = UUIDField(editable=False, unique=True, version=4,
+        help_text="Unique identifier")
+    origin_location = models.ForeignKey('Location', to_field='uuid',
+        related_name='+')
+    destination_location = models.ForeignKey('Location', to_field='uuid',
+        related_name='+')
+    pipeline = models.ForeignKey('Pipeline', to_field='uuid', null=True,
+        blank=True)
+
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    COMPLETE = 'complete'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (COMPLETE, 'Complete'),
+        (FAILED, 'Failed'),
+    )
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES,
+        default=PENDING)
+
+    files_total = models.IntegerField(default=0)
+    files_moved = models.IntegerField(default=0)
+    files_failed = models.IntegerField(default=0)
+    bytes_moved = models.BigIntegerField(default=0,
+        help_text="Size, in bytes, of the files moved so far.")
+
+    created_time = models.DateTimeField(auto_now_add=True)
+    started_time = models.DateTimeField(default=None, null=True, blank=True)
+    completed_time = models.DateTimeField(default=None, null=True, blank=True)
+    heartbeat_time = models.DateTimeField(default=None, null=True, blank=True,
+        help_text="Last time the process running this job reported it was alive.")
+
+    class Meta:
+        verbose_name = "Move Job"
+        app_label = 'locations'
+
+    def __unicode__(self):
+        return u'MoveJob ID: {uuid} from {origin} to {destination} ({status})'.format(
+            uuid=self.uuid,
+            origin=self.origin_location_id,
+            destination=self.destination_location_id,
+            status=self.status)
+
+    def spawn(self):
+        """ Run this job in a separate process and return immediately. """
+        p = Process(target=run_move_job, args=(self.uuid, ))
+        p.start()
+
+    def run(self, wait=True):
+        """ Move each pending file, recording progress as it goes.
+
+        Claims the job by switching it from PENDING to PROCESSING in a single
+        UPDATE, so a job is only run once even if run is called twice.
+
+        If wait is False, files are moved straight away even if a space is at
+        its max_concurrent_moves, rather than waiting for a free move.  They
+        still count towards the limit for other jobs. """
+        now = timezone.now()
+        claimed = MoveJob.objects.filter(uuid=self.uuid, status=self.PENDING).update(
+            status=self.PROCESSING, started_time=now, heartbeat_time=now)
+        if not claimed:
+            LOGGER.info('Move job %s already claimed, skipping', self.uuid)
+            return
+        self.status = self.PROCESSING
+
+        # Show other jobs this one is still alive while it moves files, so its
+        # moves aren't reaped by reap_dead_move_jobs
+        stopped = threading.Event()
+        heartbeat = threading.Thread(target=_heartbeat,
+            args=(self.uuid, stopped))
+        heartbeat.daemon = True
+        heartbeat.start()
+        try:
+            self._move_files(wait)
+        finally:
+            stopped.set()
+
+    def _move_files(self, wait):
+        """ Moves the job's pending files, then records whether any failed. """
+        origin_space = self.origin_location.space
+        destination_space = self.destination_location.space
+        move_files = list(self.file_set.filter(status=self.PENDING).order_by('id'))
+
+        # Independent files can be moved concurrently, up to the limit of
+        # whichever space allows the fewest.  _claim_file enforces the limits
+        # across all jobs.
+        limits = [space.max_concurrent_moves for space in
+            (origin_space, destination_space) if space.max_concurrent_moves]
+        workers = min(limits or [MOVE_JOB_WORKERS])
+        workers = min(workers, len(move_files))
+        if workers > 1:
+            LOGGER.info('Move job %s moving %s files with %s workers',
+                self.uuid, len(move_files), workers)
+            pool = ThreadPool(workers)
+            pool.map(lambda move_file: self._move_file_in_thread(move_file, wait),
+                move_files)
+            pool.close()
+            pool.join()
+        else:
+            for move_file in move_files:
+                self._move_file(move_file, wait)
+
+        failed = self.file_set.filter(status=self.FAILED).exists()
+        self.status = self.FAILED if failed else self.COMPLETE
+        self.completed_time = timezone.now()
+        # Unless reap_dead_move_jobs has already given up on the job
+        MoveJob.objects.filter(uuid=self.uuid, status=self.PROCESSING).update(
+            status=self.status, completed_time=self.completed_time)
+
+
+    def _move_file_in_thread(self, move_file, wait):
+        try:
+            self._move_file(move_file, wait)
+        finally:
+            # Django's connections are per thread, so this only closes the one
+            # opened by this pool thread
+            connection.close()
+
+    def _move_file(self, move_file, wait):
+        """ Moves one MoveJobFile and records the outcome. """
+        origin_location = self.origin_location
+        destination_location = self.destination_location
+        origin_space = origin_location.space
+        destination_space = destination_location.space
+
+        source_path = os.path.join(
+            origin_location.relative_path, move_file.source)
+        destination_path = os.path.join(
+            destination_location.relative_path, move_file.destination)
+        move_file.size = _path_size(
+            os.path.join(origin_space.path, source_path))
+        try:
+            self._claim_file(move_file, set([origin_space, destination_space]),
+                wait)
+            origin_space.move_to_space(
+                source_path=source_path,
+                destination_path=destination_path,
+                destination_space=destination_space,
+            )
+            origin_space.post_move_to_storage_service()
+            destination_space.post_move_from_storage_service()
+        except Exception as e:
+            LOGGER.exception('Move job %s failed to move %s to %s',
+                self.uuid, source_path, destination_path)
+            move_file.status = self.FAILED
+            move_file.error = str(e)
+            move_file.save()
+            MoveJob.objects.filter(uuid=self.uuid).update(
+                files_failed=models.F('files_failed') + 1)
+        else:
+            move_file.status = self.COMPLETE
+            move_file.save()
+            MoveJob.objects.filter(uuid=self.uuid).update(
+                files_moved=models.F('files_moved') + 1,
+                bytes_moved=models.F('bytes_moved') + (move_file.size or 0))
+
+
+    def _claim_file(self, move_file, spaces, wait=True):
+        """ Marks move_file PROCESSING once each of spaces has a free move.
+
+        Jobs run in separate processes, so the spaces' max_concurrent_moves
+        are enforced in the database: the file is marked PROCESSING, and put
+        back to wait if that takes a space over its limit.  Moves belonging to
+        jobs whose process has died are freed by reap_dead_move_jobs.  Spaces
+        without a limit, and callers that can't wait, don't check.
+
+        Raises a StorageException if no move is free after MOVE_SLOT_TIMEOUT
+        seconds. """
+        limited = [space for space in spaces if space.max_concurrent_moves]
+        deadline = time.time() + MOVE_SLOT_TIMEOUT
+        while True:
+            MoveJobFile.objects.filter(pk=move_file.pk).update(
+                status=self.PROCESSING)
+            if not wait or all(_running_moves(space) <= space.max_concurrent_moves
+                    for space in limited):
+                break
+            MoveJobFile.objects.filter(pk=move_file.pk).update(
+                status=self.PENDING)
+            # Try again straight away if a dead job was holding a move
+            if reap_dead_move_jobs():
+                continue
+            LOGGER.debug('Move job %s waiting to move %s', self.uuid,
+                move_file.source)
+            if time.time() > deadline:
+                raise StorageException(
+                    'Timed out after {} seconds waiting for a free move on {}'.format(
+                        MOVE_SLOT_TIMEOUT, ', '.join(sorted(
+                            space.uuid for space in spaces))))
+            time.sleep(MOVE_SLOT_POLL * random.uniform(0.5, 1.5))
+        move_file.status = self.PROCESSING
+
+
+class MoveJobFile(models.Model):
+    """ One source/destination pair in a MoveJob. """
+    job = models.ForeignKey('MoveJob', to_field='uuid', related_name='file_set')
+
+    source = models.TextField(
+        help_text="Path to move from, relative to the job's origin location.")
+    destination = models.TextField(
+        help_text="Path to move to, relative to the job's destination location.")
+
+    status = models.CharField(max_length=16, choices=MoveJob.STATUS_CHOICES,
+        default=MoveJob.PENDING)
+    size = models.BigIntegerField(default=None, null=True, blank=True,
+        help_text="Size in bytes, if the source is locally accessible.")
+    error = models.TextField(default=None, null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Move Job File"
+        app_label = 'locations'
+
+    def __unicode__(self):
+        return u'Move {source} to {destination} ({status})'.format(
+            source=self.source,
+            destination=self.destination,
+            status=self.status)
+
+
+def run_move_job(job_uuid):
+    """ Entry point for the process started by MoveJob.spawn. """
+    utils.forget_inherited_db_connections()
+    MoveJob.objects.get(uuid=job_uuid).run()
+
+
+def reap_dead_move_jobs():
+    """ Marks move jobs whose process has died as FAILED.
+
+    A job is dead if it is PROCESSING and hasn't updated heartbeat_time for
+    MOVE_JOB_STALE seconds, or is still PENDING that long after it was
+    created.  Its unfinished files are marked FAILED too, which frees the
+    moves they held on their spaces.  Returns the number of jobs reaped. """
+    now = timezone.now()
+    stale = now - datetime.timedelta(seconds=MOVE_JOB_STALE)
+    dead = (Q(status=MoveJob.PROCESSING, heartbeat_time__lt=stale) |
+        Q(status=MoveJob.PROCESSING, heartbeat_time__isnull=True,
+            started_time__lt=stale) |
+        Q(status=MoveJob.PENDING, created_time__lt=stale))
+    reaped = 0
+    for job_uuid in MoveJob.objects.filter(dead).values_list('uuid', flat=True):
+        # Only reap the job if it is still dead, in case it just recovered
+        if not MoveJob.objects.filter(dead, uuid=job_uuid).update(
+                status=MoveJob.FAILED, completed_time=now):
+            continue
+        LOGGER.warning('Move job %s stopped responding, marking it failed',
+            job_uuid)
+        failed = MoveJobFile.objects.filter(job__uuid=job_uuid,
+            status__in=(MoveJob.PENDING, MoveJob.PROCESSING)).update(
+            status=MoveJob.FAILED,
+            error='The process running the move job stopped responding')
+        MoveJob.objects.filter(uuid=job_uuid).update(
+            files_failed=models.F('files_failed') + failed)
+        reaped += 1
+    return reaped
+
+
+def _heartbeat(job_uuid, stopped):
+    """ Updates the job's heartbeat_time every MOVE_JOB_HEARTBEAT seconds
+    until stopped is set. """
+    try:
+        while not stopped.wait(MOVE_JOB_HEARTBEAT):
+            MoveJob.objects.filter(uuid=job_uuid).update(
+                heartbeat_time=timezone.now())
+    finally:
+        # Each thread has its own DB connection
+        connection.close()
+
+
+def _running_moves(space):
+    """ Returns how many files are being moved to or from space by running
+    move jobs. """
+    return MoveJobFile.objects.filter(
+        status=MoveJob.PROCESSING, job__status=MoveJob.PROCESSING).filter(
+        Q(job__origin_location__space=space) |
+        Q(job__destination_location__space=space)).count()
+
+
+def _path_size(path):
+    """ Returns the size in bytes of the file or directory at path, or None if
+    it is not locally accessible. """
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    elif os.path.isdir(path):
+        size = 0
+        for dirpath, _, filenames in os.walk(path):
+            for filename in filenames:
+                try:
+                    size += os.path.getsize(os.path.join(dirpath, filename))
+                except OSError:
+                    pass
+        return size
+    return None
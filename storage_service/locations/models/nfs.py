@@ -44,7 +44,7 @@ class NFS(models.Model):
     def move_to_storage_service(self, src_path, dest_path, dest_space):
         """ Moves src_path to dest_space.staging_path/dest_path. """
         self.space._create_local_directory(dest_path)
-        return self.space._move_rsync(src_path, dest_path)
+        return self.space._move_local(src_path, dest_path, keep_source=True)
 
     def post_move_to_storage_service(self, *args, **kwargs):
         # TODO delete original file?
@@ -52,9 +52,8 @@ class NFS(models.Model):
 
     def move_from_storage_service(self, source_path, destination_path):
         """ Moves self.staging_path/src_path to dest_path. """
-        # TODO optimization - check if the staging path and destination path are on the same device and use os.rename/self.space._move_locally if so
         self.space._create_local_directory(destination_path)
-        return self.space._move_rsync(source_path, destination_path)
+        return self.space._move_local(source_path, destination_path, keep_source=False)
 
     def post_move_from_storage_service(self, staging_path, destination_path, package):
         # TODO Remove the staging file, since rsync leaves it behind
@@ -1,10 +1,12 @@
 # stdlib, alphabetical
+import contextlib
 import json
 import logging
 from lxml import etree
 import os
 import shutil
 import subprocess
+import tarfile
 import tempfile
 
 # Core Django, alphabetical
@@ -21,10 +23,14 @@ from common import utils
 # This module, alphabetical
 from . import StorageException
 from location import Location
+from quota_reservation import QuotaReservation
 from space import Space
 
 __all__ = ('Package', )
 
+# Magic number at the start of 7z archives
+SEVENZIP_SIGNATURE = '7z\xbc\xaf\x27\x1c'
+
 LOGGER = logging.getLogger(__name__)
 
 
@@ -77,6 +83,8 @@ class Package(models.Model):
         (DELETED, "Deleted"),
         (FINALIZED, "Deposit Finalized")
     )
+    # Packages whose size has been added to their Space and Location usage
+    USAGE_STATUSES = (STAGING, UPLOADED, VERIFIED)
     status = models.CharField(max_length=8, choices=STATUS_CHOICES,
         default=FAIL,
         help_text="Status of the package in the storage service.")
@@ -151,20 +159,48 @@ class Package(models.Model):
             raise StorageException(message)
 
     def get_download_path(self, lockss_au_number=None):
+        return self.get_download(lockss_au_number)[0]
+
+    def get_download(self, lockss_au_number=None):
+        """
+        Returns (path, byte_range) to download the package, or LOCKSS chunk
+        lockss_au_number of it.  byte_range is (offset, size) within path for
+        a virtual chunk, and None when all of path is downloaded.
+        """
         full_path = self.fetch_local_path()
+        byte_range = None
         if lockss_au_number is None:
             if not self.is_compressed:
                 raise StorageException("Cannot return a download path for an uncompressed package")
             path = full_path
         elif self.current_location.space.access_protocol == Space.LOM:
             # Only LOCKSS breaks files into AUs
-            # TODO Get path from pointer file
-            # self.pointer_root.find("mets:structMap/*/mets:div[@ORDER='{}']".format(lockss_au_number), namespaces=NSMAP)
-            path = os.path.splitext(full_path)[0] + '.tar-' + str(lockss_au_number)
+            byte_range = self.get_download_range(lockss_au_number)
+            if byte_range:
+                # Virtual chunk, served from a byte range of the package
+                path = full_path
+            else:
+                path = os.path.splitext(full_path)[0] + '.tar-' + str(lockss_au_number)
         else:  # LOCKSS AU number specified, but not a LOCKSS package
             LOGGER.warning('Trying to download LOCKSS chunk for a non-LOCKSS package.')
             path = full_path
-        return path
+        return path, byte_range
+
+    def get_download_range(self, lockss_au_number):
+        """
+        Returns (offset, size) in bytes of LOCKSS chunk lockss_au_number
+        within the package if it is a virtual chunk, or None if it is not.
+        """
+        if lockss_au_number is None or not self.full_pointer_file_path:
+            return None
+        if self.current_location.space.access_protocol != Space.LOM:
+            return None
+        root = etree.parse(self.full_pointer_file_path)
+        area = root.find(".//mets:structMap//mets:div[@TYPE='LOCKSS chunk'][@ORDER='{}']/mets:fptr/mets:area[@BETYPE='BYTE']".format(int(lockss_au_number)), namespaces=utils.NSMAP)
+        if area is None:
+            return None
+        begin = int(area.get('BEGIN'))
+        return (begin, int(area.get('END')) - begin + 1)
 
     def get_local_path(self):
         """
@@ -255,35 +291,23 @@ class Package(models.Model):
         else:
             return os.path.basename(full_path)
 
-    def _check_quotas(self, dest_space, dest_location):
-        """
-        Verify that there is enough storage space on dest_space and dest_location for this package.  All sizes in bytes.
+    def _update_quotas(self, space, location, size=None):
         """
-        # Check if enough space on the space and location
-        # All sizes expected to be in bytes
-        if dest_space.size is not None and dest_space.used + self.size > dest_space.size:
-            raise StorageException(
-                "Not enough space for AIP on storage device {space}; Used: {used}; Size: {size}; AIP size: {aip_size}".format(
-                    space=dest_space, used=dest_space.used, size=dest_space.size,
-                    aip_size=self.size))
-        if (dest_location.quota is not None and
-                dest_location.used + self.size > dest_location.quota):
-            raise StorageException(
-                "AIP too big for quota on {location}; Used: {used}; Quota: {quota}; AIP size: {aip_size}".format(
-                    location=dest_location,
-                    used=dest_location.used,
-                    quota=dest_location.quota,
-                    aip_size=self.size)
-            )
-
-    def _update_quotas(self, space, location):
-        """
-        Add this package's size to the space and location.
+        Add size (default this package's size) to the space and location.
+
+        The usage is updated in the database with an F() expression rather
+        than read, modified and saved, so concurrent updates are not lost.
+        Pass a negative size to remove usage.
         """
-        space.used += self.size
-        space.save()
-        location.used += self.size
-        location.save()
+        if size is None:
+            size = self.size
+        if not size:
+            return
+        Space.objects.filter(pk=space.pk).update(used=models.F('used') + size)
+        Location.objects.filter(pk=location.pk).update(used=models.F('used') + size)
+        # Refresh so a later save() doesn't write back a stale value
+        space.used = Space.objects.values_list('used', flat=True).get(pk=space.pk)
+        location.used = Location.objects.values_list('used', flat=True).get(pk=location.pk)
 
     def store_aip(self, origin_location, origin_path):
         """ Stores an AIP in the correct Location.
@@ -298,57 +322,56 @@ class Package(models.Model):
         # TODO Move some of the procesing in archivematica
         # clientScripts/storeAIP to here?
 
-        # Check if enough space on the space and location
+        # Reserve enough space on the space and location
         # All sizes expected to be in bytes
         src_space = self.origin_location.space
         dest_space = self.current_location.space
-        self._check_quotas(dest_space, self.current_location)
-
-        # Store AIP at
-        # destination_location/uuid/split/into/chunks/destination_path
-        uuid_path = utils.uuid_to_path(self.uuid)
-        self.current_path = os.path.join(uuid_path, self.current_path)
-        self.save()
-
-        # Store AIP Pointer File at
-        # internal_usage_location/uuid/split/into/chunks/pointer.uuid.xml
-        if self.package_type in (Package.AIP, Package.AIC):
-            self.pointer_file_location = Location.active.get(purpose=Location.STORAGE_SERVICE_INTERNAL)
-            self.pointer_file_path = os.path.join(uuid_path, 'pointer.{}.xml'.format(self.uuid))
-            pointer_file_src = os.path.join(self.origin_location.relative_path, os.path.dirname(self.origin_path), 'pointer.xml')
-            pointer_file_dst = os.path.join(self.pointer_file_location.relative_path, self.pointer_file_path)
-
-        self.status = Package.PENDING
-        self.save()
+        reservation = QuotaReservation.reserve(self, dest_space, self.current_location)
 
-        # Move pointer file
-        if self.package_type in (Package.AIP, Package.AIC):
-            try:
-                src_space.move_to_storage_service(pointer_file_src, self.pointer_file_path, self.pointer_file_location.space)
-                self.pointer_file_location.space.move_from_storage_service(self.pointer_file_path, pointer_file_dst)
-            except:
-                LOGGER.warning("No pointer file found")
-                self.pointer_file_location = None
-                self.pointer_file_path = None
-                self.save()
-
-        # Move AIP
-        src_space.move_to_storage_service(
-            source_path=os.path.join(self.origin_location.relative_path, self.origin_path),
-            destination_path=self.current_path,  # This should include Location.path
-            destination_space=dest_space)
-        src_space.post_move_to_storage_service()
-        dest_space.move_from_storage_service(
-            source_path=self.current_path,  # This should include Location.path
-            destination_path=os.path.join(self.current_location.relative_path, self.current_path),
-        )
-        dest_space.post_move_from_storage_service(
-            staging_path=self.current_path,
-            destination_path=os.path.join(self.current_location.relative_path, self.current_path),
-            package=self)
+        try:
+            # Store AIP at
+            # destination_location/uuid/split/into/chunks/destination_path
+            uuid_path = utils.uuid_to_path(self.uuid)
+            self.current_path = os.path.join(uuid_path, self.current_path)
+            self.save()
+
+            # Store AIP Pointer File at
+            # internal_usage_location/uuid/split/into/chunks/pointer.uuid.xml
+            if self.package_type in (Package.AIP, Package.AIC):
+                self.pointer_file_location = Location.active.get(purpose=Location.STORAGE_SERVICE_INTERNAL)
+                self.pointer_file_path = os.path.join(uuid_path, 'pointer.{}.xml'.format(self.uuid))
+                pointer_file_src = os.path.join(self.origin_location.relative_path, os.path.dirname(self.origin_path), 'pointer.xml')
+                pointer_file_dst = os.path.join(self.pointer_file_location.relative_path, self.pointer_file_path)
+
+            self.status = Package.PENDING
+            self.save()
+
+            # Move pointer file
+            if self.package_type in (Package.AIP, Package.AIC):
+                try:
+                    src_space.move_to_space(pointer_file_src, pointer_file_dst, self.pointer_file_location.space)
+                except:
+                    LOGGER.warning("No pointer file found")
+                    self.pointer_file_location = None
+                    self.pointer_file_path = None
+                    self.save()
+
+            # Move AIP
+            src_space.move_to_space(
+                source_path=os.path.join(self.origin_location.relative_path, self.origin_path),
+                destination_path=os.path.join(self.current_location.relative_path, self.current_path),
+                destination_space=dest_space)
+            src_space.post_move_to_storage_service()
+            dest_space.post_move_from_storage_service(
+                staging_path=self.current_path,
+                destination_path=os.path.join(self.current_location.relative_path, self.current_path),
+                package=self)
+        except Exception:
+            reservation.release()
+            raise
 
         # Save new space/location usage, package status
-        self._update_quotas(dest_space, self.current_location)
+        reservation.convert()
         if dest_space.access_protocol == Space.LOM:
             self.status = Package.STAGING
         else:
@@ -418,6 +441,90 @@ class Package(models.Model):
 
         return (output_path, extract_path)
 
+    @contextlib.contextmanager
+    def open_file(self, relative_path):
+        """
+        Opens the file at `relative_path` in this package for a with
+        statement, yielding a file object to read it from, or None if it is
+        not found.
+
+        Unlike extract_file, only that file is read: plain tar files are
+        seeked through, compressed tar files are decompressed only as far as
+        the file, and 7z only extracts the one file.  Other formats fall back
+        to extract_file.  The file is streamed rather than read into memory,
+        and a copy of the package fetched from remote storage is deleted once
+        the with block exits.
+        """
+        fetched = self.get_local_path() is None
+        full_path = self.fetch_local_path()
+        try:
+            with self._open_local_file(full_path, relative_path) as f:
+                yield f
+        finally:
+            if fetched:
+                # fetch_local_path copied the package into a temp dir in
+                # the SS internal location
+                internal_path = self.local_path_location.full_path
+                temp_dir = os.path.relpath(full_path, internal_path).split(os.sep)[0]
+                shutil.rmtree(os.path.join(internal_path, temp_dir), ignore_errors=True)
+                self.local_path_location = self.local_path = None
+
+    @contextlib.contextmanager
+    def _open_local_file(self, full_path, relative_path):
+        """ open_file for the package at the local full_path. """
+        if os.path.isdir(full_path):
+            path = os.path.join(os.path.dirname(full_path), relative_path)
+            if not os.path.isfile(path):
+                yield None
+                return
+            with open(path, 'rb') as f:
+                yield f
+            return
+
+        with open(full_path, 'rb') as f:
+            signature = f.read(len(SEVENZIP_SIGNATURE))
+        if signature == SEVENZIP_SIGNATURE:
+            command = ['7z', 'e', '-so', '-y', full_path, relative_path]
+            LOGGER.info('Reading file with: %s', command)
+            # Spooled to disk, since 7z's exit status is only known at the end
+            with tempfile.TemporaryFile() as output, open(os.devnull, 'w') as devnull:
+                returncode = subprocess.call(command, stdout=output, stderr=devnull)
+                if returncode != 0 or not output.tell():
+                    yield None
+                    return
+                output.seek(0)
+                yield output
+            return
+
+        try:
+            # Plain tar headers can be seeked between; compressed tar has to be
+            # streamed, but stops once the file is found
+            try:
+                tar = tarfile.open(full_path, 'r:')
+            except tarfile.ReadError:
+                tar = tarfile.open(full_path, 'r|*')
+        except tarfile.ReadError:
+            tar = None
+        if tar is None:
+            path, temp_dir = self.extract_file(relative_path)
+            try:
+                if not os.path.isfile(path):
+                    yield None
+                    return
+                with open(path, 'rb') as f:
+                    yield f
+            finally:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+            return
+        try:
+            for member in tar:
+                if member.isfile() and os.path.normpath(member.name) == os.path.normpath(relative_path):
+                    yield tar.extractfile(member)
+                    return
+            yield None
+        finally:
+            tar.close()
+
     def compress_package(self, algorithm, extract_path=None):
         """
         Produces a compressed copy of the package.
@@ -497,31 +604,31 @@ class Package(models.Model):
         self.origin_location = origin_location
         self.origin_path = origin_path
 
-        # Check if enough space on the space and location
+        # Reserve enough space on the space and location
         # All sizes expected to be in bytes
         src_space = self.origin_location.space
         dest_space = self.current_location.space
-        self._check_quotas(dest_space, self.current_location)
-
-        # No pointer file
-        self.pointer_file_location = None
-        self.pointer_file_path = None
+        reservation = QuotaReservation.reserve(self, dest_space, self.current_location)
 
-        self.status = Package.PENDING
-        self.save()
-
-        # Move transfer
-        src_space.move_to_storage_service(
-            source_path=os.path.join(self.origin_location.relative_path, self.origin_path),
-            destination_path=self.current_path,  # This should include Location.path
-            destination_space=dest_space)
-        dest_space.move_from_storage_service(
-            source_path=self.current_path,  # This should include Location.path
-            destination_path=os.path.join(self.current_location.relative_path, self.current_path),
-        )
+        try:
+            # No pointer file
+            self.pointer_file_location = None
+            self.pointer_file_path = None
+
+            self.status = Package.PENDING
+            self.save()
+
+            # Move transfer
+            src_space.move_to_space(
+                source_path=os.path.join(self.origin_location.relative_path, self.origin_path),
+                destination_path=os.path.join(self.current_location.relative_path, self.current_path),
+                destination_space=dest_space)
+        except Exception:
+            reservation.release()
+            raise
 
         # Save new space/location usage, package status
-        self._update_quotas(dest_space, self.current_location)
+        reservation.convert()
         self.status = Package.UPLOADED
         self.save()
 
@@ -576,7 +683,10 @@ class Package(models.Model):
     def delete_from_storage(self):
         """ Deletes the package from filesystem and updates metadata.
 
-        Returns (True, None) on success, and (False, error_msg) on failure. """
+        Returns (True, None) on success, and (False, error_msg) on failure.
+        If the package's files weren't all deleted, it keeps its status and
+        the usage it counted towards.  On success, error_msg may still
+        describe a problem notifying LOCKSS-o-matic. """
         error = None
         # LOCKSS must notify LOM before deleting
         if self.current_location.space.access_protocol == Space.LOM:
@@ -588,9 +698,18 @@ class Package(models.Model):
                 error = lom._delete_update_lom(self, delete_lom_ids)
 
         try:
-            self.current_location.space.delete_path(self.full_path)
+            summary = self.current_location.space.delete_path(self.full_path)
         except Exception as e:
-            error = e.message
+            LOGGER.warning('Unable to delete package %s', self.uuid, exc_info=True)
+            return False, e.message
+        # Some spaces report what happened to each file they deleted
+        if summary and summary.get('failed'):
+            failed = sorted(summary['failed'].items())
+            delete_error = 'Unable to delete {} of {} files: {}'.format(
+                len(failed), len(failed) + len(summary['deleted']) + len(summary['not found']),
+                '; '.join('{}: {}'.format(path, e) for path, e in failed[:10]))
+            LOGGER.warning('Package %s: %s', self.uuid, delete_error)
+            return False, delete_error
 
         # Remove pointer file, and the UUID quad directories if they're empty
         pointer_path = self.full_pointer_file_path
@@ -602,6 +721,10 @@ class Package(models.Model):
             utils.removedirs(os.path.dirname(self.pointer_file_path),
                 base=self.pointer_file_location.full_path)
 
+        # Pending and failed packages never had their size added
+        if self.status in self.USAGE_STATUSES:
+            self._update_quotas(self.current_location.space,
+                self.current_location, -self.size)
         self.status = self.DELETED
         self.save()
         return True, error
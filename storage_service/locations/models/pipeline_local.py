@@ -1,10 +1,13 @@
 # stdlib, alphabetical
+import errno
 import logging
 import os
+import pipes
 import shutil
 import re
 import subprocess
 import tempfile
+import time
 
 # Core Django, alphabetical
 from django.db import models
@@ -16,9 +19,24 @@ from common import utils
 
 # This module, alphabetical
 from location import Location
+from space import _wanted_properties
 
 LOGGER = logging.getLogger(__name__)
 
+PRIVATE_SSH_KEY = '/var/lib/archivematica/.ssh/id_rsa'
+# Shared SSH connections are kept open this long after they were last used
+SSH_CONTROL_PERSIST = 600  # seconds
+# Control sockets for the shared connections.  They are named by ssh's %C hash
+# of the user, host and port, which keeps them under the socket path limit.
+SSH_CONTROL_DIR = os.path.join(tempfile.gettempdir(), 'storage-service-ssh')
+# How long a master found or started by this process is assumed to still be
+# running, unless a command fails to connect
+SSH_MASTER_CHECK_INTERVAL = 60  # seconds
+# ssh's exit code when it fails to connect, or rsync's when ssh does
+SSH_ERROR = 255
+# user@host to the time.time() the master connection to it was last checked
+_ssh_masters_checked = {}
+
 
 class PipelineLocalFS(models.Model):
     """ Spaces local to the creating machine, but not to the storage service.
@@ -53,8 +71,90 @@ class PipelineLocalFS(models.Model):
 
         return "{}@{}:{}".format(user, host, utils.coerce_str(path))
 
-    def browse(self, path):
-        private_ssh_key = '/var/lib/archivematica/.ssh/id_rsa'
+    def _ssh_command(self):
+        """ Returns the ssh command used for every connection to the pipeline.
+
+        The ssh and rsync calls are multiplexed over a master connection to
+        remote_user@remote_name instead of each making a new SSH handshake.
+        They never become the master themselves: a master that persisted
+        from one of them would hold its stdout open, and check_output would
+        wait SSH_CONTROL_PERSIST seconds for it to close.  If there is no
+        master, they connect directly. """
+        self._start_ssh_master()
+        return self._ssh_options() + ['-o', 'ControlMaster=no']
+
+    def _ssh_options(self):
+        """ Returns ssh and the options shared by the master and its clients. """
+        return [
+            'ssh',
+            '-i', PRIVATE_SSH_KEY,  # Specify identify file
+            '-o', 'ControlPath=' + os.path.join(SSH_CONTROL_DIR, '%C'),
+        ]
+
+    def _start_ssh_master(self):
+        """ Starts a master connection to the pipeline, unless one is running.
+
+        The master detaches once connected (-f) with its output sent to
+        /dev/null, and stays open for SSH_CONTROL_PERSIST seconds after its
+        last client.
+
+        Only checks for a master every SSH_MASTER_CHECK_INTERVAL seconds, or
+        after _ssh_failed.  If the master has gone in between, ssh connects
+        directly. """
+        host = '{}@{}'.format(self.remote_user, self.remote_name)
+        if time.time() - _ssh_masters_checked.get(host, 0) < SSH_MASTER_CHECK_INTERVAL:
+            return
+        _ssh_masters_checked[host] = time.time()
+        try:
+            os.makedirs(SSH_CONTROL_DIR, 0o700)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        with open(os.devnull, 'r+') as devnull:
+            if subprocess.call(self._ssh_options() + ['-O', 'check', host],
+                    stdin=devnull, stdout=devnull, stderr=devnull) == 0:
+                return
+            command = self._ssh_options() + [
+                '-f', '-N', '-M',
+                '-o', 'ControlPersist={}'.format(SSH_CONTROL_PERSIST),
+                host]
+            LOGGER.debug('ssh master command: %s', command)
+            if subprocess.call(command, stdin=devnull, stdout=devnull, stderr=devnull) != 0:
+                LOGGER.warning('Unable to start an ssh master connection to %s', host)
+
+    def _ssh_failed(self, returncode):
+        """ Checks for the master connection again before the next command
+        if returncode shows that a command couldn't connect. """
+        if returncode == SSH_ERROR:
+            _ssh_masters_checked.pop(
+                '{}@{}'.format(self.remote_user, self.remote_name), None)
+
+    def _rsh(self):
+        """ Returns _ssh_command for rsync's --rsh option. """
+        return ' '.join(pipes.quote(arg) for arg in self._ssh_command())
+
+    def _create_remote_directory(self, path):
+        """ Creates path and any missing parents on the pipeline. """
+        command = self._ssh_command() + [
+            '{}@{}'.format(self.remote_user, self.remote_name),
+            'mkdir -p -- ' + pipes.quote(utils.coerce_str(path))]
+        LOGGER.info("ssh path creation command: %s", command)
+        try:
+            subprocess.check_call(command)
+        except subprocess.CalledProcessError as e:
+            LOGGER.warning("ssh path creation failed: %s", e)
+            self._ssh_failed(e.returncode)
+            raise
+
+    def browse(self, path, properties=False):
+        """ Lists path on the pipeline using rsync.
+
+        If properties is True, also returns 'properties', a dict of entry name
+        to {'size': bytes, 'timestamp': modification time}, taken from the
+        same listing.  Directories are listed recursively so their 'size' is
+        the total of the files below them and 'object count' is the number of
+        files.  If properties is a collection of entry names, only those
+        entries get properties. """
         path = os.path.join(path, '')  # Rsync requires a / on the end of dirs to list contents
 
         # Get entries
@@ -63,16 +163,20 @@ class PipelineLocalFS(models.Model):
             '--protect-args',
             '--list-only',
             '--exclude', '.*',  # Ignore hidden files
-            '--rsh', 'ssh -i ' + private_ssh_key,  # Specify identify file
+            '--rsh', self._rsh(),
             self._format_host_path(path)]
+        if properties:
+            command.insert(-1, '--recursive')
         LOGGER.info('rsync list command: %s', command)
         LOGGER.debug('"%s"', '" "'.join(command))  # For copying to shell
         try:
             output = subprocess.check_output(command)
         except Exception as e:
             LOGGER.warning("rsync list failed: %s", e, exc_info=True)
+            self._ssh_failed(getattr(e, 'returncode', None))
             entries = []
             directories = []
+            entry_properties = {}
         else:
             output = output.splitlines()
             # Output is lines in format:
@@ -81,20 +185,58 @@ class PipelineLocalFS(models.Model):
             # Eg: -rw-r--r--            201 2013/05/13 13:26:48 LICENSE.md
             # Eg: lrwxrwxrwx             78 2015/02/19 12:13:40 sharedDirectory
             # Parse out the path and type
-            regex = r'^(?P<type>.).{9} +[\d,]+ ..../../.. ..:..:.. (?P<name>.*)$'
+            regex = r'^(?P<type>.).{9} +(?P<size>[\d,]+) (?P<timestamp>..../../.. ..:..:..) (?P<name>.*)$'
             matches = [re.match(regex, e) for e in output]
-            # Take the last entry. Ignore empty lines and '.'
-            entries = [e.group('name') for e in matches
-                if e and e.group('name') != '.']
+            # Ignore empty lines and '.'
+            matches = [e for e in matches if e and e.group('name') != '.']
+            # When listing recursively, the contents of subdirectories are
+            # only used for properties
+            top_level = [e for e in matches if '/' not in e.group('name')]
+            entries = [e.group('name') for e in top_level]
             # Only items whose type is not '-'. Links count as dirs.
-            directories = [e.group('name') for e in matches
-                if e and e.group('name') != '.' and e.group('type') != '-']
+            directories = [e.group('name') for e in top_level
+                if e.group('type') != '-']
+            entry_properties = {}
+            if properties:
+                wanted = _wanted_properties(properties)
+                entry_properties = dict((name, props) for name, props
+                    in self._listing_properties(matches).iteritems()
+                    if wanted is None or name in wanted)
 
         directories = sorted(directories, key=lambda s: s.lower())
         entries = sorted(entries, key=lambda s: s.lower())
         LOGGER.debug('entries: %s', entries)
         LOGGER.debug('directories: %s', directories)
-        return {'directories': directories, 'entries': entries}
+        objects = {'directories': directories, 'entries': entries}
+        if properties:
+            objects['properties'] = entry_properties
+        return objects
+
+    @staticmethod
+    def _listing_properties(matches):
+        """ Returns browse properties from the parsed lines of a recursive
+        rsync listing. """
+        entry_properties = {}
+        for match in matches:
+            size = int(match.group('size').replace(',', ''))
+            name = match.group('name')
+            if '/' not in name:
+                timestamp = time.mktime(time.strptime(
+                    match.group('timestamp'), '%Y/%m/%d %H:%M:%S'))
+                props = entry_properties.setdefault(name, {})
+                props['timestamp'] = timestamp
+                if match.group('type') == 'd':
+                    props.setdefault('size', 0)
+                    props.setdefault('object count', 0)
+                else:
+                    props['size'] = size
+            elif match.group('type') != 'd':
+                # A file inside one of the listed directories
+                props = entry_properties.setdefault(name.split('/', 1)[0],
+                    {'size': 0, 'object count': 0})
+                props['size'] += size
+                props['object count'] += 1
+        return entry_properties
 
     def delete_path(self, delete_path):
         # Sync from an empty directory to delete the contents of delete_path;
@@ -104,14 +246,15 @@ class PipelineLocalFS(models.Model):
         temp_dir = tempfile.mkdtemp()
         dest_path = self._format_host_path(os.path.join(delete_path, ''))
         command = ['rsync', '-vv', '--itemize-changes', '--protect-args',
-                   '--delete', '--dirs',
+                   '--delete', '--dirs', '--rsh', self._rsh(),
                    os.path.join(temp_dir, ''),
                    dest_path]
         LOGGER.info("rsync delete command: %s", command)
         try:
             subprocess.check_call(command)
-        except Exception:
+        except Exception as e:
             LOGGER.warning("rsync delete failed: %s", command, exc_info=True)
+            self._ssh_failed(getattr(e, 'returncode', None))
             raise
         finally:
             shutil.rmtree(temp_dir)
@@ -138,7 +281,7 @@ class PipelineLocalFS(models.Model):
         # else:
         src_path = self._format_host_path(src_path)
         self.space._create_local_directory(dest_path)
-        return self.space._move_rsync(src_path, dest_path)
+        return self.space._move_rsync(src_path, dest_path, rsh=self._rsh())
 
     def post_move_to_storage_service(self, *args, **kwargs):
         # TODO delete original file?
@@ -147,37 +290,18 @@ class PipelineLocalFS(models.Model):
     def move_from_storage_service(self, source_path, destination_path):
         """ Moves self.staging_path/src_path to dest_path. """
 
-        # Assemble a set of directories to create on the remote server;
-        # these will be created one at a time
-        directories = []
-        path = destination_path
-        while path != '' and path != '/':
-            directories.insert(0, path)
-            path = os.path.dirname(path)
-
-        # Syncing an empty directory will ensure no files get transferred
-        temp_dir = os.path.join(tempfile.mkdtemp(), '')
-
-        # Creates the destination_path directory without copying any files
-        # Dir must end in a / for rsync to create it
-        for directory in directories:
-            path = self._format_host_path(os.path.join(os.path.dirname(directory), ''))
-            cmd = ['rsync', '-vv', '--protect-args', '--recursive', temp_dir, path]
-            LOGGER.info("rsync path creation command: %s", cmd)
-            try:
-                subprocess.check_call(cmd)
-            except subprocess.CalledProcessError as e:
-                shutil.rmtree(temp_dir)
-                LOGGER.warning("rsync path creation failed: %s", e)
-                raise
-
-        shutil.rmtree(temp_dir)
+        # Create the directories leading to destination_path in one round
+        # trip.  If destination_path ends in a /, that includes itself.
+        parent = os.path.dirname(destination_path)
+        if parent not in ('', '/'):
+            self._create_remote_directory(parent)
 
         # Prepend user and host to destination
         destination_path = self._format_host_path(destination_path)
 
         # Move file
-        return self.space._move_rsync(source_path, destination_path)
+        return self.space._move_rsync(source_path, destination_path,
+            rsh=self._rsh())
 
     def post_move_from_storage_service(self, staging_path, destination_path, package):
         # TODO Remove the staging file, since rsync leaves it behind
@@ -0,0 +1,153 @@
+# stdlib, alphabetical
+import datetime
+import logging
+
+# Core Django, alphabetical
+from django.db import models
+from django.db.models import F, Q
+from django.utils import timezone
+
+# Third party dependencies, alphabetical
+from django_extensions.db.fields import UUIDField
+
+# This project, alphabetical
+from common import utils
+
+# This module, alphabetical
+from . import StorageException
+from location import Location
+from space import Space
+
+__all__ = ('QuotaReservation', )
+
+LOGGER = logging.getLogger(__name__)
+
+
+class QuotaReservation(models.Model):
+    """ Space held on a Space and Location while a package is being stored.
+
+    Reserving checks and claims the space in one UPDATE, so concurrent stores
+    can't all pass the quota check and then overflow the Space together.  When
+    the store finishes the reservation is converted to usage, or released if
+    it fails.  Reservations that are never finished expire after
+    quota_reservation_timeout hours. """
+    uuid = UUIDField(editable=False, unique=True, version=4,
+        help_text="Unique identifier")
+    package = models.ForeignKey('Package', to_field='uuid', null=True,
+        blank=True)
+    space = models.ForeignKey('Space', to_field='uuid')
+    location = models.ForeignKey('Location', to_field='uuid')
+    size = models.BigIntegerField(help_text="Size in bytes")
+
+    ACTIVE = 'active'
+    CONVERTED = 'converted'
+    RELEASED = 'released'
+    EXPIRED = 'expired'
+    STATUS_CHOICES = (
+        (ACTIVE, 'Active'),
+        (CONVERTED, 'Converted to usage'),
+        (RELEASED, 'Released'),
+        (EXPIRED, 'Expired'),
+    )
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES,
+        default=ACTIVE)
+    created_time = models.DateTimeField(auto_now_add=True)
+    expires_time = models.DateTimeField()
+
+    class Meta:
+        verbose_name = "Quota Reservation"
+        app_label = 'locations'
+
+    # Default for the quota_reservation_timeout setting
+    TIMEOUT = 24  # hours
+
+    def __unicode__(self):
+        return u'{size} bytes on {location} for {package} ({status})'.format(
+            size=self.size,
+            location=self.location_id,
+            package=self.package_id,
+            status=self.status)
+
+    @classmethod
+    def reserve(cls, package, space, location, size=None):
+        """ Reserves size bytes (default the package's size) on space and location.
+
+        Raises StorageException if the space or location does not have that
+        much unused and unreserved space. """
+        cls.release_expired()
+        if size is None:
+            size = package.size
+
+        reserved = Space.objects.filter(pk=space.pk).filter(
+            Q(size__isnull=True) | Q(size__gte=F('used') + F('reserved') + size)
+        ).update(reserved=F('reserved') + size)
+        if not reserved:
+            space = Space.objects.get(pk=space.pk)
+            raise StorageException(
+                "Not enough space for AIP on storage device {space}; Used: {used}; Reserved: {reserved}; Size: {size}; AIP size: {aip_size}".format(
+                    space=space, used=space.used, reserved=space.reserved,
+                    size=space.size, aip_size=size))
+
+        reserved = Location.objects.filter(pk=location.pk).filter(
+            Q(quota__isnull=True) | Q(quota__gte=F('used') + F('reserved') + size)
+        ).update(reserved=F('reserved') + size)
+        if not reserved:
+            Space.objects.filter(pk=space.pk).update(
+                reserved=F('reserved') - size)
+            location = Location.objects.get(pk=location.pk)
+            raise StorageException(
+                "AIP too big for quota on {location}; Used: {used}; Reserved: {reserved}; Quota: {quota}; AIP size: {aip_size}".format(
+                    location=location, used=location.used,
+                    reserved=location.reserved, quota=location.quota,
+                    aip_size=size))
+
+        timeout = utils.get_setting('quota_reservation_timeout')
+        if timeout is None:
+            timeout = cls.TIMEOUT
+        return cls.objects.create(
+            package=package if package.pk else None,
+            space=space,
+            location=location,
+            size=size,
+            expires_time=timezone.now() + datetime.timedelta(hours=timeout),
+        )
+
+    @classmethod
+    def release_expired(cls):
+        """ Releases reservations past their expiry time. """
+        expired = cls.objects.filter(status=cls.ACTIVE,
+            expires_time__lt=timezone.now())
+        for reservation in expired:
+            if reservation._finish(cls.EXPIRED):
+                LOGGER.warning('Quota reservation %s expired', reservation)
+                reservation._update(reserved=-reservation.size)
+
+    def convert(self):
+        """ Converts the reservation to usage, once the package is stored. """
+        if self._finish(self.CONVERTED):
+            self._update(used=self.size, reserved=-self.size)
+        else:
+            # Already expired, so only the usage needs adding
+            self._update(used=self.size)
+
+    def release(self):
+        """ Releases the reservation without using it. """
+        if self._finish(self.RELEASED):
+            self._update(reserved=-self.size)
+
+    def _finish(self, status):
+        """ Moves an active reservation to status.
+
+        Returns False if something else already finished it, so the space and
+        location totals are only adjusted once. """
+        finished = QuotaReservation.objects.filter(
+            pk=self.pk, status=self.ACTIVE).update(status=status)
+        if finished:
+            self.status = status
+        return bool(finished)
+
+    def _update(self, **deltas):
+        """ Adds deltas to the fields named by its keys on the space and location. """
+        updates = dict((field, F(field) + delta) for field, delta in deltas.iteritems())
+        Space.objects.filter(uuid=self.space_id).update(**updates)
+        Location.objects.filter(uuid=self.location_id).update(**updates)
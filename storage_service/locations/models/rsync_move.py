@@ -0,0 +1,106 @@
+# stdlib, alphabetical
+import datetime
+import time
+
+# Core Django, alphabetical
+from django.db import models
+from django.utils import timezone
+
+# Third party dependencies, alphabetical
+from django_extensions.db.fields import UUIDField
+import jsonfield
+
+# This project, alphabetical
+from common import utils
+
+# This module, alphabetical
+
+__all__ = ('RsyncMove', )
+
+
+class RsyncMove(models.Model):
+    """ History of the rsync attempts made for one Space._move_rsync call.
+
+    Finished moves are deleted after rsync_move_retention days by the
+    delete_expired_rsync_moves management command. """
+    uuid = UUIDField(editable=False, unique=True, version=4,
+        help_text="Unique identifier")
+    source = models.TextField()
+    destination = models.TextField()
+
+    IN_PROGRESS = 'in progress'
+    COMPLETE = 'complete'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (IN_PROGRESS, 'In progress'),
+        (COMPLETE, 'Complete'),
+        (FAILED, 'Failed'),
+    )
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES,
+        default=IN_PROGRESS)
+    # List of dicts with 'started', 'finished', 'returncode' and 'output' for
+    # each rsync run
+    attempts = jsonfield.JSONField(blank=True, default=[])
+
+    # Progress, updated while rsync runs
+    bytes_transferred = models.BigIntegerField(default=0)
+    files_transferred = models.IntegerField(default=0)
+    throughput = models.BigIntegerField(default=None, null=True, blank=True,
+        help_text="Bytes per second at the last progress update.")
+
+    created_time = models.DateTimeField(auto_now_add=True)
+    updated_time = models.DateTimeField(default=None, null=True, blank=True)
+    completed_time = models.DateTimeField(default=None, null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Rsync Move"
+        app_label = 'locations'
+
+    PROGRESS_INTERVAL = 2  # seconds
+    # Default for the rsync_move_retention setting
+    RETENTION = 30  # days
+    # (time.time(), bytes_transferred) when progress was last saved
+    _last_progress = None
+
+    def __unicode__(self):
+        return u'Rsync {source} to {destination} ({status}, {attempts} attempts)'.format(
+            source=self.source,
+            destination=self.destination,
+            status=self.status,
+            attempts=len(self.attempts))
+
+    @classmethod
+    def delete_expired(cls):
+        """ Deletes finished moves older than rsync_move_retention days.
+
+        Returns the number of moves deleted. """
+        retention = utils.get_setting('rsync_move_retention')
+        if retention is None:
+            retention = cls.RETENTION
+        expired = cls.objects.exclude(status=cls.IN_PROGRESS).filter(
+            completed_time__lt=timezone.now() - datetime.timedelta(days=retention))
+        count = expired.count()
+        expired.delete()
+        return count
+
+    def update_progress(self, bytes_transferred, files_transferred, force=False):
+        """ Records progress, saving it at most every PROGRESS_INTERVAL seconds
+        unless force is True. """
+        self.bytes_transferred = bytes_transferred
+        self.files_transferred = files_transferred
+        now = time.time()
+        if self._last_progress:
+            last_time, last_bytes = self._last_progress
+            if not force and now - last_time < self.PROGRESS_INTERVAL:
+                return
+            if now > last_time:
+                self.throughput = int((bytes_transferred - last_bytes) / (now - last_time))
+        self._last_progress = (now, bytes_transferred)
+        self.updated_time = timezone.now()
+        # Only update the progress columns, the rest of the row is saved by
+        # the caller
+        RsyncMove.objects.filter(pk=self.pk).update(
+            bytes_transferred=self.bytes_transferred,
+            files_transferred=self.files_transferred,
+            throughput=self.throughput,
+            updated_time=self.updated_time)
@@ -1,17 +1,33 @@
 # stdlib, alphabetical
+import base64
+import collections
+import copy
 import errno
+import hashlib
+import heapq
 import logging
 import os
+import Queue
+import re
 import shutil
 import stat
 import subprocess
+import tempfile
+import threading
+import time
 
 # Core Django, alphabetical
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.utils import timezone
 
 # Third party dependencies, alphabetical
 from django_extensions.db.fields import UUIDField
+# Python 2 needs the scandir backport
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir
 
 # This project, alphabetical
 from common import utils
@@ -19,15 +35,272 @@ LOGGER = logging.getLogger(__name__)
 
 # This module, alphabetical
 from . import StorageException
+from rsync_move import RsyncMove
 
 __all__ = ('Space', )
 
 
+# rsync exit codes worth retrying: socket, file and protocol stream I/O
+# errors (10-12) and timeouts (30, 35).  Everything else (eg. syntax errors)
+# fails immediately.
+RSYNC_TRANSIENT_ERRORS = {10, 11, 12, 30, 35}
+# ssh failures are retried, unless ssh couldn't authenticate or verify the
+# host, which retrying won't fix
+RSYNC_SSH_ERROR = 255
+RSYNC_SSH_PERMANENT_ERROR_REGEX = re.compile(
+    r'Permission denied \(|Host key verification failed|REMOTE HOST IDENTIFICATION HAS CHANGED|Too many authentication failures|No supported authentication methods')
+# rsync also reports missing or unreadable source files as a partial transfer,
+# which retrying won't fix, so that is only retried when rsync's output shows
+# an I/O error and none of the permanent errors
+RSYNC_PARTIAL_TRANSFER = 23
+RSYNC_IO_ERROR_REGEX = re.compile(
+    r'Input/output error|Connection reset|Broken pipe|Stale (NFS )?file handle|timed? ?out')
+RSYNC_PERMANENT_ERROR_REGEX = re.compile(
+    r'No such file or directory|Permission denied|Operation not permitted')
+# Defaults for the rsync_retries and rsync_retry_delay settings
+RSYNC_RETRIES = 3
+RSYNC_RETRY_DELAY = 10  # seconds, doubled after each attempt
+RSYNC_MAX_RETRY_DELAY = 600  # seconds
+# Relative to each destination directory, and skipped by rsync itself
+RSYNC_PARTIAL_DIR = '.rsync-partial'
+# Lines of rsync output kept for each attempt
+RSYNC_OUTPUT_LINES = 100
+# rsync --progress line, eg. "  1,238,099 100%  146.38MB/s    0:00:00 (xfr#1, to-chk=2/4)"
+# rsync before 3.1 prints xfer# and no commas
+RSYNC_PROGRESS_REGEX = re.compile(
+    r'^\s*(?P<bytes>[\d,]+)\s+\d+%\s+\S+\s+\S+(?:\s+\(xfe?r#(?P<files>\d+),)?')
+
+
+# Size of the reads and writes made by the native copy engine
+NATIVE_COPY_CHUNK_SIZE = 4 * 1024 * 1024
+# Bag manifest algorithms, in order of preference
+BAG_MANIFEST_ALGORITHMS = ('sha512', 'sha256', 'sha1', 'md5')
+# Default for the browse_cache_ttl setting, in seconds
+BROWSE_CACHE_TTL = 60
+# Number of browse results cached in each process
+BROWSE_CACHE_SIZE = 1000
+# Threads used to total up directory contents for browse properties
+BROWSE_PROPERTIES_WORKERS = 8
+
+
 def validate_space_path(path):
     """ Validation for path in Space.  Must be absolute. """
     if path[0] != '/':
         raise ValidationError("Path must begin with a /")
 
+class BrowseCache(object):
+    """ Least recently used cache of Space.browse results.
+
+    Holds at most max_entries results, and results older than the ttl passed
+    to get are ignored.  The cache is per process, so writes made by other
+    processes are only seen once the ttl runs out. """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, ttl):
+        """ Returns a copy of the result cached for key, or None. """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or time.time() - entry[0] > ttl:
+                return None
+            # Re-insert to mark as most recently used
+            self._entries[key] = entry
+            return copy.deepcopy(entry[1])
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time(), copy.deepcopy(value))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, space_uuid, path):
+        """ Drops cached results for path in the space, and for any directory
+        above or below it. """
+        path = os.path.normpath(path)
+        with self._lock:
+            for key in list(self._entries):
+                if key[0] == space_uuid and (key[1] == path
+                        or key[1].startswith(path + os.sep)
+                        or path.startswith(key[1].rstrip(os.sep) + os.sep)):
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+BROWSE_CACHE = BrowseCache(BROWSE_CACHE_SIZE)
+# Recursive directory totals for browse properties of local spaces
+DIRECTORY_USAGE_CACHE = BrowseCache(BROWSE_CACHE_SIZE)
+
+
+def _browse_cache_ttl():
+    ttl = utils.get_setting('browse_cache_ttl')
+    if ttl is None:
+        ttl = BROWSE_CACHE_TTL
+    return ttl
+
+
+def _invalidate_browse_caches(space_uuid, path):
+    BROWSE_CACHE.invalidate(space_uuid, path)
+    DIRECTORY_USAGE_CACHE.invalidate(space_uuid, path)
+
+
+def _directory_usage(paths, workers=BROWSE_PROPERTIES_WORKERS):
+    """ Returns {path: {'object count': files, 'size': bytes}} for each of paths.
+
+    Totals cover all files below each path, ignoring hidden files and
+    directories as browse does.  Symlinks are counted but not followed.
+    Directories are scanned from a shared queue by a pool of workers
+    threads, so a single deep tree is walked in parallel too. """
+    usage = dict((p, {'object count': 0, 'size': 0}) for p in paths)
+    if not paths:
+        return usage
+    queue = Queue.Queue()
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            item = queue.get()
+            if item is None:
+                queue.task_done()
+                return
+            top, path = item
+            count = size = 0
+            try:
+                for entry in scandir(path):
+                    if entry.name[0] == '.':
+                        continue
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            queue.put((top, entry.path))
+                        else:
+                            count += 1
+                            size += entry.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        LOGGER.debug('Unable to stat %s', entry.path, exc_info=True)
+            except OSError:
+                LOGGER.debug('Unable to scan %s', path, exc_info=True)
+            with lock:
+                usage[top]['object count'] += count
+                usage[top]['size'] += size
+            queue.task_done()
+
+    for path in paths:
+        queue.put((path, path))
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    queue.join()
+    for thread in threads:
+        queue.put(None)
+    for thread in threads:
+        thread.join()
+    return usage
+
+
+def _wanted_properties(properties):
+    """ Returns the set of entry names a browse's properties argument asks
+    for, or None for all of them. """
+    if properties is True:
+        return None
+    return set(utils.coerce_str(name) for name in properties or ())
+
+
+def _browse_sort_key(name):
+    """ Orders browse entries case-insensitively by name. """
+    name = utils.coerce_str(name)
+    return (name.lower(), name)
+
+
+def _browse_cursor(name):
+    """ Returns the cursor for the page after the entry name. """
+    return base64.urlsafe_b64encode(utils.coerce_str(name))
+
+
+def _browse_after(cursor):
+    """ Returns the sort key of the last entry before cursor, or None if
+    there is no cursor.  Raises ValueError if the cursor can't be decoded. """
+    if not cursor:
+        return None
+    cursor = str(cursor)
+    try:
+        after = base64.urlsafe_b64decode(cursor)
+    except TypeError:
+        after = None
+    # b64decode skips invalid characters, so check it round trips
+    if not after or base64.urlsafe_b64encode(after) != cursor:
+        raise ValueError('Invalid cursor: {}'.format(cursor))
+    return _browse_sort_key(after)
+
+
+def _browse_page(objects, limit, cursor=None):
+    """ Returns the page of browse results objects after cursor.
+
+    A cursor is the urlsafe base64 encoded name of the last entry on the
+    previous page.  Raises ValueError if the cursor can't be decoded. """
+    sort_key = _browse_sort_key
+    after = _browse_after(cursor)
+    entries = sorted(objects['entries'], key=sort_key)
+    if after:
+        entries = [e for e in entries if sort_key(e) > after]
+    page = entries[:limit]
+    page_names = set(page)
+    objects = dict(objects)
+    objects['entries'] = page
+    objects['directories'] = sorted(
+        (d for d in objects['directories'] if d in page_names), key=sort_key)
+    if 'properties' in objects:
+        objects['properties'] = dict((name, value) for name, value
+            in objects['properties'].iteritems() if name in page_names)
+    if len(entries) > limit and page:
+        objects['next'] = _browse_cursor(page[-1])
+    else:
+        objects['next'] = None
+    return objects
+
+
+def _rsync_error_is_transient(returncode, output):
+    """ Returns True if rsync failing with returncode and output is worth
+    retrying. """
+    if returncode in RSYNC_TRANSIENT_ERRORS:
+        return True
+    if returncode == RSYNC_PARTIAL_TRANSFER:
+        return bool(RSYNC_IO_ERROR_REGEX.search(output)
+            and not RSYNC_PERMANENT_ERROR_REGEX.search(output))
+    if returncode == RSYNC_SSH_ERROR:
+        return not RSYNC_SSH_PERMANENT_ERROR_REGEX.search(output)
+    return False
+
+
+def _bag_manifest(path):
+    """ Returns the algorithm and payload checksums of the bag at path.
+
+    Returns a dict with 'algorithm' and 'entries', a dict of checksums keyed
+    by path relative to the bag, or None if path is not a bag.
+    """
+    if not os.path.isfile(os.path.join(path, 'bagit.txt')):
+        return None
+    for algorithm in BAG_MANIFEST_ALGORITHMS:
+        manifest_path = os.path.join(path, 'manifest-{}.txt'.format(algorithm))
+        if not os.path.isfile(manifest_path):
+            continue
+        entries = {}
+        with open(manifest_path) as f:
+            for line in f:
+                line = line.rstrip('\r\n')
+                if not line:
+                    continue
+                checksum, entry_path = line.split(None, 1)
+                entries[os.path.normpath(entry_path.lstrip('*'))] = checksum.lower()
+        return {'algorithm': algorithm, 'entries': entries}
+    return None
+
 # To add a new storage space the following places must be updated:
 #  locations/models/space.py (this file)
 #   Add constant for storage protocol
@@ -90,6 +363,9 @@ class Space(models.Model):
     NFS = 'NFS'
     PIPELINE_LOCAL_FS = 'PIPE_FS'
     OBJECT_STORAGE = {DURACLOUD}
+    # Spaces whose path is on the storage service's filesystem, so other
+    # spaces can move files directly to or from them without staging
+    LOCALLY_ACCESSIBLE = {LOCAL_FILESYSTEM, LOM, NFS}
     ACCESS_PROTOCOL_CHOICES = (
         (DURACLOUD, 'DuraCloud'),
         (FEDORA, "FEDORA via SWORD2"),
@@ -105,6 +381,8 @@ class Space(models.Model):
         help_text="Size in bytes (optional)")
     used = models.BigIntegerField(default=0,
         help_text="Amount used in bytes")
+    reserved = models.BigIntegerField(default=0,
+        help_text="Amount reserved for packages being stored, in bytes")
     path = models.TextField(default='', blank=True,
         help_text="Absolute path to the space on the storage service machine.")
     staging_path = models.TextField(validators=[validate_space_path],
@@ -113,6 +391,17 @@ class Space(models.Model):
        help_text="Whether or not the space has been verified to be accessible.")
     last_verified = models.DateTimeField(default=None, null=True, blank=True,
         help_text="Time this location was last verified to be accessible.")
+    max_concurrent_moves = models.PositiveIntegerField(default=0,
+        help_text="Maximum number of files moved to or from this space at once by asynchronous move jobs, 0 for no limit.")
+    RSYNC = 'rsync'
+    NATIVE = 'native'
+    COPY_ENGINE_CHOICES = (
+        (RSYNC, 'rsync'),
+        (NATIVE, 'Native (copy in the storage service, checking sizes and bag checksums)'),
+    )
+    copy_engine = models.CharField(max_length=8,
+        choices=COPY_ENGINE_CHOICES, default=RSYNC,
+        help_text="How files are copied on the local filesystem.  Files whose source isn't kept are renamed instead when they are on the same device.  Native copies check the size of every file, and the checksums of bags against their manifest.")
 
     class Meta:
         verbose_name = 'Space'
@@ -152,13 +441,65 @@ class Space(models.Model):
         'entries' in the return dict is the name of any file (directory or other)
             located at that path
 
+        If `limit` is passed, returns at most that many entries, starting
+        after the opaque `cursor` (if passed), and adds 'next', the cursor for
+        the following page or None if this is the last.  Entries are ordered
+        case-insensitively by name, and the cursor is the name of the last
+        entry returned, so entries added or removed between pages don't shift
+        the rest.  If `properties` is also passed, they are only computed for
+        the entries on the page.
+
+        Locally accessible spaces read the directory without sorting it or
+        looking at entries that aren't on the page.  Other spaces can only
+        list the whole path, so for them limit and cursor shorten the response
+        but the full listing is still fetched (and cached for browse_cache_ttl
+        seconds).  Properties for the page come from the child space's
+        browse_properties if it has one, so path isn't listed again;
+        otherwise they are computed with the full listing and cached with it.
+
         If not implemented in the child space, looks locally.
         """
+        limit = kwargs.pop('limit', None)
+        cursor = kwargs.pop('cursor', None)
+        if limit is None:
+            return self._browse(path, *args, **kwargs)
+        child = self.get_child_space()
+        if not hasattr(child, 'browse'):
+            return self._browse_local(path, *args, limit=limit, cursor=cursor, **kwargs)
+        properties = kwargs.pop('properties', False)
+        if properties and not hasattr(child, 'browse_properties'):
+            # Computed from the listing, so every page can share one
+            kwargs['properties'] = properties
+            return _browse_page(self._browse(path, *args, **kwargs), limit, cursor)
+        objects = _browse_page(self._browse(path, *args, **kwargs), limit, cursor)
+        if properties:
+            wanted = _wanted_properties(properties)
+            entries = [e for e in objects['entries'] if wanted is None or e in wanted]
+            objects['properties'] = {}
+            if entries:
+                objects['properties'] = child.browse_properties(
+                    path, entries, objects['directories'])
+        return objects
+
+    def _browse(self, path, *args, **kwargs):
         LOGGER.info('path: %s', path)
+        # Listing remote spaces is slow, so cache the results for a while
+        cache_key = None
+        if self.access_protocol not in self.LOCALLY_ACCESSIBLE:
+            ttl = _browse_cache_ttl()
+            if ttl:
+                cache_key = (self.uuid, os.path.normpath(path), args,
+                    tuple(sorted(kwargs.items())))
+                cached = BROWSE_CACHE.get(cache_key, ttl)
+                if cached is not None:
+                    return cached
         try:
-            return self.get_child_space().browse(path, *args, **kwargs)
+            objects = self.get_child_space().browse(path, *args, **kwargs)
         except AttributeError:
-            return self._browse_local(path)
+            return self._browse_local(path, *args, **kwargs)
+        if cache_key:
+            BROWSE_CACHE.set(cache_key, objects)
+        return objects
 
     def delete_path(self, delete_path, *args, **kwargs):
         """
@@ -166,6 +507,10 @@ class Space(models.Model):
 
         `delete_path` is a full path in this space.
 
+        Child spaces may return a summary of the outcome for each file, with
+        lists of the paths 'deleted' and 'not found', and 'failed', a dict of
+        path to error message.
+
         If not implemented in the child space, looks locally.
         """
         # Enforce delete_path is in self.path
@@ -175,6 +520,9 @@ class Space(models.Model):
             return self.get_child_space().delete_path(delete_path, *args, **kwargs)
         except AttributeError:
             return self._delete_path_local(delete_path)
+        finally:
+            # After the delete, so a listing made while it ran isn't kept
+            _invalidate_browse_caches(self.uuid, delete_path)
 
     def move_to_storage_service(self, source_path, destination_path,
                                 destination_space, *args, **kwargs):
@@ -249,6 +597,9 @@ class Space(models.Model):
                 source_path, destination_path, *args, **kwargs)
         except AttributeError:
             raise NotImplementedError('{} space has not implemented move_from_storage_service'.format(self.get_access_protocol_display()))
+        finally:
+            # After the transfer, so a listing made while it ran isn't kept
+            _invalidate_browse_caches(self.uuid, destination_path)
         # Delete staging copy
         if source_path != destination_path:
             try:
@@ -277,6 +628,70 @@ class Space(models.Model):
             # This is optional for the child class to implement
             pass
 
+    def move_to_space(self, source_path, destination_path, destination_space):
+        """ Move source_path in this Space to destination_path in destination_space.
+
+        If source_path or destination_path are not absolute paths, they are
+        assumed to be relative to the Space.path of their space.
+
+        If destination_space is locally accessible to the storage service,
+        this Space moves source_path straight to its final destination.  If
+        this Space is locally accessible, destination_space fetches from
+        source_path directly.  Only if neither is does the move go through
+        destination_space's staging area with move_to_storage_service and
+        move_from_storage_service.
+
+        Callers are responsible for calling the post_move_* hooks.
+        """
+        LOGGER.debug('MOVE: src: %s (%s)', source_path, self.access_protocol)
+        LOGGER.debug('MOVE: dst: %s (%s)', destination_path, destination_space.access_protocol)
+
+        if (destination_space.access_protocol not in self.LOCALLY_ACCESSIBLE
+                and self.access_protocol not in self.LOCALLY_ACCESSIBLE):
+            LOGGER.info('Moving %s to %s through staging', source_path, destination_path)
+            self.move_to_storage_service(
+                source_path=source_path,
+                destination_path=destination_path,
+                destination_space=destination_space)
+            destination_space.move_from_storage_service(
+                source_path=destination_path,
+                destination_path=destination_path)
+            return
+
+        source_path = os.path.join(self.path, source_path)
+        destination_path = os.path.join(destination_space.path, destination_path)
+        try:
+            self._move_to_space_directly(
+                source_path, destination_path, destination_space)
+        finally:
+            # After the transfer, so a listing made while it ran isn't kept
+            _invalidate_browse_caches(destination_space.uuid, destination_path)
+
+    def _move_to_space_directly(self, source_path, destination_path, destination_space):
+        """ Moves absolute source_path to absolute destination_path, without
+        staging, when either space is locally accessible. """
+        if destination_space.access_protocol in self.LOCALLY_ACCESSIBLE:
+            LOGGER.info('Moving %s directly to %s', source_path, destination_path)
+            try:
+                self.get_child_space().move_to_storage_service(
+                    source_path, destination_path, destination_space)
+            except AttributeError:
+                raise NotImplementedError('{} space has not implemented move_to_storage_service'.format(self.get_access_protocol_display()))
+        else:
+            # move_from_storage_service expects a trailing / on directories
+            # to move their contents.  A directory without one is moved
+            # inside destination_path, as it would be moving through staging.
+            if os.path.isdir(source_path) and not source_path.endswith(os.sep):
+                destination_path = os.path.join(
+                    destination_path, os.path.basename(source_path))
+                source_path += os.sep
+            LOGGER.info('Moving %s directly from %s', destination_path, source_path)
+            try:
+                destination_space.get_child_space().move_from_storage_service(
+                    source_path, destination_path)
+            except AttributeError:
+                raise NotImplementedError('{} space has not implemented move_from_storage_service'.format(destination_space.get_access_protocol_display()))
+
     def update_package_status(self, package):
         """
         Check and update the status of `package` stored in this Space.
@@ -305,11 +720,214 @@ class Space(models.Model):
         # Move the file
         os.rename(source_path, destination_path)
 
-    def _move_rsync(self, source, destination):
+    def _move_local(self, source, destination, keep_source=True):
+        """ Moves source to destination, both on the local filesystem.
+
+        If keep_source is False and source and the directory destination will
+        be created in are on the same device, the move is done with os.rename
+        without copying any data.  Otherwise, or if the destination already
+        exists or the rename fails, source is copied with the space's
+        copy_engine.  Copies never share data with source, so later changes
+        to one don't affect the other.
+
+        Moves between spaces, such as storing an AIP or a transfer in backlog,
+        keep source for the pipeline to clean up, so they are always copied
+        even on the same device.
+
+        Follows rsync's semantics for a trailing / on source.
+
+        All directories leading to destination must exist.
+        Space._create_local_directory may be useful.
+        """
+        source = utils.coerce_str(source)
+        destination = utils.coerce_str(destination)
+        if source == destination:
+            return
+
+        if self.copy_engine == self.NATIVE:
+            engine = 'native copy'
+        else:
+            engine = 'rsync'
+
+        if not keep_source:
+            target = self._local_move_target(source, destination)
+            if target and self._same_device(source, os.path.dirname(target)):
+                try:
+                    os.rename(source.rstrip(os.sep), target)
+                except OSError:
+                    LOGGER.warning('Unable to move %s to %s using rename, falling back to %s',
+                        source, target, engine, exc_info=True)
+                else:
+                    LOGGER.info('Moved %s to %s using rename', source, target)
+                    return
+
+        LOGGER.info('Moving %s to %s using %s', source, destination, engine)
+        if self.copy_engine == self.NATIVE:
+            return self._copy_native(source, destination)
+        return self._move_rsync(source, destination)
+
+    def _local_move_target(self, source, destination):
+        """ Returns the path rsync would create when moving source to destination.
+
+        Returns None if source does not exist or the target already exists,
+        since rename can't merge into an existing tree, so the move has to be
+        copied with the copy_engine.  An empty directory can be replaced by a
+        directory, since rename allows it.
+        """
+        if not os.path.exists(source):
+            return None
+        target = self._rsync_target(source, destination)
+        if os.path.isdir(source) and (os.path.isdir(target)
+                and not os.path.islink(target) and not os.listdir(target)):
+            return target
+        if os.path.lexists(target):
+            return None
+        return target
+
+    def _rsync_target(self, source, destination):
+        """ Returns the path rsync -r would copy source to. """
+        if os.path.isdir(source):
+            if source.endswith(os.sep):
+                # Contents of source go into destination
+                return destination.rstrip(os.sep)
+            return os.path.join(destination, os.path.basename(source))
+        elif destination.endswith(os.sep) or os.path.isdir(destination):
+            return os.path.join(destination, os.path.basename(source))
+        return destination
+
+    def _same_device(self, *paths):
+        """ Returns True if all paths exist and are on the same device. """
+        try:
+            devices = set(os.stat(p.rstrip(os.sep) or os.sep).st_dev for p in paths)
+        except OSError:
+            return False
+        return len(devices) == 1
+
+    def _copy_native(self, source, destination):
+        """ Copies source to destination on the local filesystem without rsync.
+
+        Follows rsync's semantics for a trailing / on source, merging into an
+        existing destination.  Files are copied in large chunks, and each
+        copy's size is checked against its source.  If source is a bag, they
+        are also checksummed as they are read and compared to its manifest,
+        so the copy is verified without reading anything twice.
+        Each file is written to a temporary name and renamed into place once
+        complete.
+
+        Returns a dict of checksums, keyed by path relative to source, if
+        source is a bag, and None otherwise.
+
+        All directories leading to destination must exist.
+        Space._create_local_directory may be useful.
+        """
+        source = utils.coerce_str(source)
+        destination = utils.coerce_str(destination)
+        if not os.path.exists(source):
+            raise StorageException('{} does not exist'.format(source))
+        target = self._rsync_target(source, destination)
+
+        if not os.path.isdir(source):
+            self._copy_file_native(source, target)
+            return None
+
+        source = source.rstrip(os.sep)
+        manifest = _bag_manifest(source)
+        # Only checksum when there is something to verify against
+        algorithm = manifest['algorithm'] if manifest else None
+        checksums = {}
+        buf = bytearray(NATIVE_COPY_CHUNK_SIZE)
+        for dirpath, dirnames, filenames in os.walk(source):
+            relative_dir = os.path.relpath(dirpath, source)
+            dest_dir = os.path.normpath(os.path.join(target, relative_dir))
+            if not os.path.isdir(dest_dir):
+                os.mkdir(dest_dir)
+                shutil.copymode(dirpath, dest_dir)
+            for name in dirnames + filenames:
+                src = os.path.join(dirpath, name)
+                dst = os.path.join(dest_dir, name)
+                if os.path.islink(src):
+                    if os.path.lexists(dst):
+                        os.remove(dst)
+                    os.symlink(os.readlink(src), dst)
+                elif name in filenames:
+                    checksum = self._copy_file_native(src, dst, algorithm, buf)
+                    if algorithm:
+                        relative_path = os.path.normpath(os.path.join(relative_dir, name))
+                        checksums[relative_path] = checksum
+
+        if not manifest:
+            return None
+        mismatches = [path for path, expected in manifest['entries'].iteritems()
+            if checksums.get(path) != expected]
+        if mismatches:
+            raise StorageException(
+                'Checksums of {} files copied from {} to {} do not match the bag manifest: {}'.format(
+                    len(mismatches), source, target, ', '.join(sorted(mismatches)[:10])))
+        LOGGER.info('Copied %s to %s, verified %s files against the bag manifest',
+            source, target, len(manifest['entries']))
+        return checksums
+
+    def _copy_file_native(self, source, destination, algorithm=None, buf=None):
+        """ Copies one file from source to destination.
+
+        If algorithm is given, returns the file's checksum using it.  Raises
+        StorageException if the copy isn't the same size as source, eg.
+        because source changed while it was read.
+
+        Preserves the modification time, and adds read and write permissions
+        for everyone, like _move_rsync.
+        """
+        if buf is None:
+            buf = bytearray(NATIVE_COPY_CHUNK_SIZE)
+        view = memoryview(buf)
+        checksum = hashlib.new(algorithm) if algorithm else None
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(destination),
+            prefix='.' + os.path.basename(destination) + '.')
+        size = 0
+        try:
+            with open(source, 'rb') as src, os.fdopen(fd, 'wb') as dst:
+                while True:
+                    length = src.readinto(buf)
+                    if not length:
+                        break
+                    if checksum:
+                        checksum.update(view[:length])
+                    dst.write(view[:length])
+                    size += length
+            source_stat = os.stat(source)
+            written = os.path.getsize(temp_path)
+            if not size == written == source_stat.st_size:
+                raise StorageException(
+                    'Copy of {} to {} is incomplete: read {} of {} bytes, wrote {}'.format(
+                        source, destination, size, source_stat.st_size, written))
+            os.chmod(temp_path, stat.S_IMODE(source_stat.st_mode) |
+                stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IWGRP |
+                stat.S_IROTH | stat.S_IWOTH)
+            os.utime(temp_path, (source_stat.st_atime, source_stat.st_mtime))
+            os.rename(temp_path, destination)
+        except (IOError, OSError, StorageException) as e:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            if isinstance(e, StorageException):
+                raise
+            raise StorageException('Unable to copy {} to {}: {}'.format(
+                source, destination, e))
+        return checksum.hexdigest() if checksum else None
+
+    def _move_rsync(self, source, destination, rsh=None):
         """ Moves a file from source to destination using rsync.
 
         All directories leading to destination must exist.
         Space._create_local_directory may be useful.
+
+        If rsh is given it is used as rsync's remote shell, eg. to reuse an
+        existing SSH connection.
+
+        Failures that rsync reports as transient (network or I/O errors, see
+        _rsync_error_is_transient) are retried with an exponential backoff.  Interrupted files are kept in a
+        hidden partial directory and used as the basis of the retry, so only
+        they are resumed; every other file gets rsync's normal checks.  Each
+        attempt is recorded in an RsyncMove.
         """
         source = utils.coerce_str(source)
         destination = utils.coerce_str(destination)
@@ -318,17 +936,97 @@ class Space(models.Model):
         if source == destination:
             return
 
-        # Rsync file over
-        # TODO Do this asyncronously, with restarting failed attempts
-        command = ['rsync', '-t', '-O', '--protect-args', '-vv', '--chmod=ugo+rw', '-r', source, destination]
-        LOGGER.info("rsync command: %s", command)
+        retries = utils.get_setting('rsync_retries')
+        if retries is None:
+            retries = RSYNC_RETRIES
+        delay = utils.get_setting('rsync_retry_delay')
+        if delay is None:
+            delay = RSYNC_RETRY_DELAY
 
-        p = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        stdout, _ = p.communicate()
-        if p.returncode != 0:
-            s = "Rsync failed with status {}: {}".format(p.returncode, stdout)
+        move = RsyncMove.objects.create(source=source, destination=destination)
+        attempt = 0
+        while True:
+            attempt += 1
+            # Keep interrupted files aside, so a retry can resume them without
+            # trusting anything else already in the destination
+            command = ['rsync', '-t', '-O', '--protect-args', '--progress', '--chmod=ugo+rw', '-r',
+                '--partial-dir', RSYNC_PARTIAL_DIR]
+            if rsh:
+                command.extend(['--rsh', rsh])
+            command.extend([source, destination])
+            LOGGER.info("rsync command (attempt %s): %s", attempt, command)
+
+            started = timezone.now()
+            returncode, stdout = self._run_rsync(command, move)
+            move.attempts.append({
+                'started': started.isoformat(),
+                'finished': timezone.now().isoformat(),
+                'returncode': returncode,
+                'output': stdout,
+            })
+            if returncode == 0:
+                move.status = RsyncMove.COMPLETE
+                move.completed_time = timezone.now()
+                move.save()
+                return
+
+            s = "Rsync failed with status {}: {}".format(returncode, stdout)
             LOGGER.warning(s)
-            raise StorageException(s)
+            if not _rsync_error_is_transient(returncode, stdout) or attempt > retries:
+                move.status = RsyncMove.FAILED
+                move.completed_time = timezone.now()
+                move.save()
+                raise StorageException(s)
+            move.save()
+
+            wait = min(delay * 2 ** (attempt - 1), RSYNC_MAX_RETRY_DELAY)
+            LOGGER.info("Retrying rsync from %s to %s in %s seconds", source, destination, wait)
+            time.sleep(wait)
+
+    def _run_rsync(self, command, move):
+        """ Runs an rsync command, recording its progress on the RsyncMove.
+
+        rsync's output is read as it is produced rather than buffered.
+        Returns the exit code and the last lines of output that were not
+        progress updates, for error reporting.
+        """
+        p = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        tail = collections.deque(maxlen=RSYNC_OUTPUT_LINES)
+        # --progress reports on each file, so keep a running total of the
+        # files finished in this run to add the current file's bytes to
+        bytes_base = move.bytes_transferred
+        files_base = move.files_transferred
+        bytes_finished = 0
+        files_finished = 0
+        buf = ''
+        while True:
+            chunk = os.read(p.stdout.fileno(), 65536)
+            if not chunk:
+                break
+            # Progress updates are terminated by \r, other output by \n
+            lines = re.split(r'[\r\n]', buf + chunk)
+            buf = lines.pop()
+            for line in lines:
+                match = RSYNC_PROGRESS_REGEX.match(line)
+                if not match:
+                    if line.strip():
+                        tail.append(line)
+                    continue
+                file_bytes = int(match.group('bytes').replace(',', ''))
+                if match.group('files'):
+                    # Last update for a file, so it is finished
+                    bytes_finished += file_bytes
+                    files_finished = int(match.group('files'))
+                    file_bytes = 0
+                move.update_progress(
+                    bytes_base + bytes_finished + file_bytes,
+                    files_base + files_finished)
+        if buf.strip():
+            tail.append(buf)
+        p.wait()
+        move.update_progress(bytes_base + bytes_finished,
+            files_base + files_finished, force=True)
+        return p.returncode, '\n'.join(tail)
 
     def _create_local_directory(self, path, mode=None):
         """ Creates a local directory at 'path' with 'mode' (default 775). """
@@ -352,24 +1050,92 @@ class Space(models.Model):
         except os.error as e:
             LOGGER.warning(e)
 
-    def _browse_local(self, path):
+    def _browse_local(self, path, properties=False, limit=None, cursor=None):
         """
         Returns browse results for a locally accessible filesystem.
+
+        If properties is True, also returns 'properties', a dict of entry name
+        to {'size': bytes, 'timestamp': modification time}.  For directories,
+        'size' is the total of the files below it and 'object count' is the
+        number of files; these are cached for browse_cache_ttl seconds.  If
+        properties is a collection of entry names, only those entries get
+        properties.
+
+        Uses scandir so file types come from the directory listing itself;
+        entries are only stat'd if the filesystem doesn't report their type,
+        they are symlinks, or properties are requested.
+
+        If limit is passed, only the first limit entries after cursor are
+        returned, as described in Space.browse.  They are picked as the
+        directory is read, without sorting or checking the other entries.
         """
         if isinstance(path, unicode):
             path = str(path)
+        after = _browse_after(cursor) if limit is not None else None
         if not os.path.exists(path):
             LOGGER.info('%s in %s does not exist', path, self)
-            return {'directories': [], 'entries': []}
-        # Sorted list of all entries in directory, excluding hidden files
-        entries = [name for name in os.listdir(path) if name[0] != '.']
-        entries = sorted(entries, key=lambda s: s.lower())
+            objects = {'directories': [], 'entries': []}
+            if limit is not None:
+                objects['next'] = None
+            return objects
+        # Exclude hidden files
+        listing = (e for e in scandir(path) if e.name[0] != '.')
+        next_cursor = None
+        if limit is not None:
+            if after:
+                listing = (e for e in listing if _browse_sort_key(e.name) > after)
+            listing = heapq.nsmallest(limit + 1, listing,
+                key=lambda e: _browse_sort_key(e.name))
+            if len(listing) > limit:
+                listing = listing[:limit]
+                next_cursor = _browse_cursor(listing[-1].name)
+        entries = []
         directories = []
-        for name in entries:
-            full_path = os.path.join(path, name)
-            if os.path.isdir(full_path) and os.access(full_path, os.R_OK):
-                directories.append(name)
-        return {'directories': directories, 'entries': entries}
+        entry_properties = {}
+        wanted = _wanted_properties(properties)
+        for entry in listing:
+            entries.append(entry.name)
+            try:
+                if entry.is_dir() and os.access(entry.path, os.R_OK):
+                    directories.append(entry.name)
+                if properties and (wanted is None or entry.name in wanted):
+                    entry_stat = entry.stat()
+                    entry_properties[entry.name] = {
+                        'size': entry_stat.st_size,
+                        'timestamp': entry_stat.st_mtime,
+                    }
+            except OSError:
+                # Eg. broken symlink, or deleted since the directory was read
+                LOGGER.debug('Unable to stat %s', entry.path, exc_info=True)
+        # Sorted list of all entries in directory
+        entries.sort(key=lambda s: s.lower())
+        directories.sort(key=lambda s: s.lower())
+        objects = {'directories': directories, 'entries': entries}
+        if properties:
+            self._add_directory_usage(path,
+                [d for d in directories if wanted is None or d in wanted],
+                entry_properties)
+            objects['properties'] = entry_properties
+        if limit is not None:
+            objects['next'] = next_cursor
+        return objects
+
+    def _add_directory_usage(self, path, directories, entry_properties):
+        """ Adds the recursive size and file count of each of directories in
+        path to entry_properties. """
+        ttl = _browse_cache_ttl()
+        uncached = []
+        for name in directories:
+            key = (self.uuid, os.path.normpath(os.path.join(path, name)))
+            usage = DIRECTORY_USAGE_CACHE.get(key, ttl) if ttl else None
+            if usage is None:
+                uncached.append(key[1])
+            else:
+                entry_properties.setdefault(name, {}).update(usage)
+        for dirpath, usage in _directory_usage(uncached).iteritems():
+            if ttl:
+                DIRECTORY_USAGE_CACHE.set((self.uuid, dirpath), usage)
+            entry_properties.setdefault(os.path.basename(dirpath), {}).update(usage)
 
     def _delete_path_local(self, delete_path):
         """
@@ -1,10 +1,18 @@
+import datetime
+import hashlib
 import os
 import requests
+import shutil
+import tempfile
+import urllib
 
 from django.test import TestCase
+from django.utils import timezone
 import vcr
 
+from common import utils
 from locations import models
+from locations.models import duracloud, space
 
 
 class TestDuracloud(TestCase):
@@ -172,3 +180,290 @@ class TestDuracloud(TestCase):
         # Verify deleted
         response = requests.get('https://archivematica.duracloud.org/durastore/testing/delete/delete%20%23.txt', auth=auth)
         assert response.status_code == 404
+
+    def test_index(self):
+        utils.set_setting('duracloud_index_max_age', 24)
+        self.ds_object._list_remote = lambda prefix: iter(
+            ['SampleTransfers/BagTransfer.zip', 'SampleTransfers/Images/lion.svg', 'other.txt'])
+        models.DuracloudContent.objects.create(duracloud=self.ds_object,
+            content_id='deleted.txt', indexed_time=timezone.now())
+        self.ds_object.refresh_index()
+        assert self.ds_object.index_refreshed_time is not None
+        assert self.ds_object.index_crawl_started is None
+        assert not self.ds_object.content_set.filter(content_id='deleted.txt').exists()
+        # Browsing uses the index, not DuraCloud
+        resp = self.ds_object.browse('SampleTransfers')
+        assert resp['directories'] == ['Images']
+        assert resp['entries'] == ['BagTransfer.zip', 'Images']
+        assert list(self.ds_object._get_files_list('sampletransfers', use_index=True)) == []
+        # Moves and deletes always list DuraCloud
+        self.ds_object._list_remote = lambda prefix: iter(['SampleTransfers/remote.txt'])
+        assert list(self.ds_object._get_files_list('SampleTransfers/')) == ['SampleTransfers/remote.txt']
+        # Writes through the storage service update the index
+        self.ds_object._index_content('SampleTransfers/new.txt', size=3)
+        assert self.ds_object.browse('SampleTransfers')['entries'] == ['BagTransfer.zip', 'Images', 'new.txt']
+        self.ds_object._unindex_content('SampleTransfers/new.txt')
+        assert self.ds_object.browse('SampleTransfers')['entries'] == ['BagTransfer.zip', 'Images']
+
+    def test_spawn_index_refresh_once(self):
+        started = []
+        class Process(object):
+            def __init__(self, target, args):
+                started.append(args)
+            def start(self):
+                pass
+        self.addCleanup(setattr, duracloud, 'Process', duracloud.Process)
+        duracloud.Process = Process
+        utils.set_setting('duracloud_index_max_age', 24)
+        assert not self.ds_object._index_is_fresh()
+        assert len(started) == 1
+        # A crawl is already running, so stale listings don't start another
+        assert not self.ds_object._index_is_fresh()
+        assert len(started) == 1
+
+    def test_browse_properties(self):
+        session = self.ds_object._session = FakeSession(self.ds_object.duraspace_url)
+        for content_id in ('transfer/a.txt', 'transfer/b.txt', 'transfer/sub/c.txt'):
+            session.store[content_id] = 'test'
+        heads = []
+        head = session.head
+        def failing_head(url):
+            heads.append(session._content_id(url))
+            if url.endswith('b.txt'):
+                return FakeResponse(500)
+            return head(url)
+        session.head = failing_head
+        resp = self.ds_object.browse('transfer', properties=('a.txt', 'b.txt'))
+        assert resp['entries'] == ['a.txt', 'b.txt', 'sub']
+        # Only the requested entries are fetched, and failures are skipped
+        assert sorted(heads) == ['transfer/a.txt', 'transfer/b.txt']
+        assert resp['properties'].keys() == ['a.txt']
+
+    def test_browse_properties_from_index(self):
+        session = self.ds_object._session = FakeSession(self.ds_object.duraspace_url)
+        for content_id in ('transfer/a.txt', 'transfer/b.txt'):
+            session.store[content_id] = 'test'
+        heads = []
+        head = session.head
+        def counting_head(url):
+            heads.append(session._content_id(url))
+            return head(url)
+        session.head = counting_head
+        # The index isn't used or updated unless it is enabled
+        self.ds_object._index_content('transfer/a.txt', size=3)
+        assert not self.ds_object.content_set.exists()
+        utils.set_setting('duracloud_index_max_age', 24)
+        self.ds_object._index_content('transfer/a.txt', size=3)
+        self.ds_object._index_content('transfer/b.txt', size=3)
+        # Properties recorded longer ago than the max age are fetched again
+        self.ds_object.content_set.filter(content_id='transfer/b.txt').update(
+            indexed_time=timezone.now() - datetime.timedelta(hours=25))
+        properties = self.ds_object.browse_properties('transfer', ['a.txt', 'b.txt'], [])
+        assert heads == ['transfer/b.txt']
+        assert properties['a.txt']['size'] == 3
+        assert properties['b.txt']['size'] == 4
+        utils.set_setting('duracloud_index_max_age', 0)
+        del heads[:]
+        properties = self.ds_object.browse_properties('transfer', ['a.txt', 'b.txt'], [])
+        assert sorted(heads) == ['transfer/a.txt', 'transfer/b.txt']
+        assert properties['a.txt']['size'] == 4
+
+    def test_browse_page_properties(self):
+        session = FakeSession(self.ds_object.duraspace_url)
+        for content_id in ('transfer/a.txt', 'transfer/b.txt', 'transfer/sub/c.txt'):
+            session.store[content_id] = 'test'
+        listed = []
+        get = session.get
+        def counting_get(url, params=None, **kwargs):
+            if params and 'marker' not in params:
+                listed.append(params['prefix'])
+            return get(url, params=params, **kwargs)
+        session.get = counting_get
+        # Space.browse uses a new Duracloud, so give them all the fake session
+        self.addCleanup(setattr, models.Duracloud, 'session', models.Duracloud.session)
+        models.Duracloud.session = property(lambda self: session)
+        self.addCleanup(space.BROWSE_CACHE.clear)
+        page = self.ds_object.space.browse('transfer', limit=2, properties=True)
+        assert page['entries'] == ['a.txt', 'b.txt']
+        assert sorted(page['properties']) == ['a.txt', 'b.txt']
+        page = self.ds_object.space.browse('transfer', limit=2,
+            cursor=page['next'], properties=True)
+        assert page['entries'] == ['sub']
+        assert page['properties']['sub']['object count'] == 1
+        # The space is listed once for both pages, and only the directory on
+        # the page is listed for its properties
+        assert listed == ['transfer/', 'transfer/sub/']
+
+    def test_write_response_checks_download(self):
+        class Response(object):
+            def __init__(self, body, headers):
+                self.body = body
+                self.headers = headers
+            def iter_content(self, chunk_size):
+                return iter([self.body[:2], self.body[2:]])
+            def close(self):
+                pass
+        dest = os.path.join(tempfile.mkdtemp(), 'test.txt')
+        self.addCleanup(shutil.rmtree, os.path.dirname(dest))
+        self.ds_object._write_response(Response('test\n', {
+            'Content-Length': '5', 'Content-MD5': 'd8e8fca2dc0f896fd7cb4cb0031ba249'}),
+            'test.txt', dest)
+        assert open(dest).read() == 'test\n'
+        with self.assertRaises(models.StorageException):
+            self.ds_object._write_response(Response('tes', {'Content-Length': '5'}),
+                'test.txt', dest)
+        assert not os.path.exists(dest)
+        # Connection lost part way through the body
+        class ResetResponse(Response):
+            def iter_content(self, chunk_size):
+                yield self.body[:2]
+                raise requests.exceptions.ConnectionError('Connection reset')
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            self.ds_object._write_response(ResetResponse('test\n', {}),
+                'test.txt', dest)
+        assert not os.path.exists(dest)
+
+    def test_transfer_all_reports_failures(self):
+        transferred = []
+
+        def transfer(content_id, path):
+            if content_id == 'bad':
+                raise models.StorageException('Unable to store')
+            transferred.append(content_id)
+        with self.assertRaises(models.StorageException) as cm:
+            self.ds_object._transfer_all(transfer,
+                [('a', 'a'), ('bad', 'bad'), ('b', 'b')])
+        # Later transfers aren't abandoned
+        assert transferred == ['a', 'b']
+        assert '1 of 3 transfers failed: bad: Unable to store' in str(cm.exception)
+
+    def test_chunked_upload_and_download(self):
+        session = self.ds_object._session = FakeSession(self.ds_object.duraspace_url)
+        store = session.store
+        utils.set_setting('duracloud_chunk_size', 1)
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        upload = os.path.join(tmp_dir, 'aip.7z')
+        with open(upload, 'wb') as f:
+            f.write(os.urandom(2 * 1024 * 1024 + 10))
+        self.ds_object.move_from_storage_service(upload, 'aips/aip.7z')
+        assert sorted(store) == ['aips/aip.7z.dura-chunk-0000',
+            'aips/aip.7z.dura-chunk-0001', 'aips/aip.7z.dura-chunk-0002',
+            'aips/aip.7z.dura-manifest']
+        # Listings show the chunked content, not its chunks
+        assert list(self.ds_object._get_files_list('aips/')) == ['aips/aip.7z']
+        # Uploading again only sends chunks that are missing
+        del store['aips/aip.7z.dura-chunk-0001']
+        session.puts = []
+        self.ds_object.move_from_storage_service(upload, 'aips/aip.7z')
+        assert session.puts == ['aips/aip.7z.dura-chunk-0001', 'aips/aip.7z.dura-manifest']
+        # Downloads are reassembled
+        download = os.path.join(tmp_dir, 'download.7z')
+        self.ds_object.move_to_storage_service('aips/aip.7z', download, None)
+        assert open(download, 'rb').read() == open(upload, 'rb').read()
+        store['aips/aip.7z.dura-chunk-0002'] = 'corrupt'
+        with self.assertRaises(models.StorageException):
+            self.ds_object.move_to_storage_service('aips/aip.7z', download, None)
+        assert not os.path.exists(download)
+
+    def test_skip_unchanged(self):
+        session = self.ds_object._session = FakeSession(self.ds_object.duraspace_url)
+        utils.set_setting('duracloud_skip_unchanged', True)
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        for name in ('a.txt', 'b.txt'):
+            with open(os.path.join(tmp_dir, name), 'w') as f:
+                f.write(name)
+        self.ds_object.move_from_storage_service(os.path.join(tmp_dir, ''), 'transfer/')
+        assert sorted(session.puts) == ['transfer/a.txt', 'transfer/b.txt']
+        with open(os.path.join(tmp_dir, 'b.txt'), 'w') as f:
+            f.write('changed')
+        session.puts = []
+        self.ds_object.move_from_storage_service(os.path.join(tmp_dir, ''), 'transfer/')
+        assert session.puts == ['transfer/b.txt']
+        assert session.store['transfer/b.txt'] == 'changed'
+
+    def test_delete_folder_summary(self):
+        self.addCleanup(setattr, duracloud, 'DURACLOUD_RETRY_DELAY', duracloud.DURACLOUD_RETRY_DELAY)
+        duracloud.DURACLOUD_RETRY_DELAY = 0
+        session = self.ds_object._session = FakeSession(self.ds_object.duraspace_url)
+        for name in ('a', 'b', 'c', 'd'):
+            session.store['aip/' + name] = name
+        # Deleted by something else after being listed
+        session.responses['aip/c'] = [404]
+        # Overloaded once, then deleted
+        session.responses['aip/b'] = [503]
+        session.responses['aip/d'] = [500] * (duracloud.DURACLOUD_RETRIES + 1)
+        summary = self.ds_object.delete_path('aip/')
+        assert sorted(summary['deleted']) == ['aip/a', 'aip/b']
+        assert summary['not found'] == ['aip/c']
+        assert summary['failed'].keys() == ['aip/d']
+        assert sorted(session.store.keys()) == ['aip/c', 'aip/d']
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, content='', headers=None):
+        self.status_code = status_code
+        self.content = self.text = content
+        self.headers = headers or {}
+        self.reason = ''
+
+    def iter_content(self, chunk_size):
+        return iter([self.content])
+
+    def close(self):
+        pass
+
+
+class FakeSession(object):
+    """ Stands in for a requests session to a DuraCloud space, storing
+    content in memory. """
+
+    def __init__(self, duraspace_url):
+        self.duraspace_url = duraspace_url
+        self.store = {}
+        self.puts = []
+        # Status codes to respond with before handling requests for a path
+        self.responses = {}
+
+    def _content_id(self, url):
+        return urllib.unquote(url.replace(self.duraspace_url, ''))
+
+    def put(self, url, data, headers=None):
+        content_id = self._content_id(url)
+        self.store[content_id] = data if isinstance(data, str) else ''.join(data)
+        self.puts.append(content_id)
+        return FakeResponse(201)
+
+    def get(self, url, params=None, **kwargs):
+        content_id = self._content_id(url)
+        if not content_id:
+            # Listing, a page at a time
+            prefix, marker = params['prefix'], params.get('marker', '')
+            items = sorted(c for c in self.store if c.startswith(prefix) and c > marker)[:2]
+            return FakeResponse(200, '<space>{}</space>'.format(
+                ''.join('<item>{}</item>'.format(c) for c in items)))
+        if content_id not in self.store:
+            return FakeResponse(404)
+        return FakeResponse(200, self.store[content_id])
+
+    def request(self, method, url, **kwargs):
+        statuses = self.responses.get(self._content_id(url))
+        if statuses:
+            return FakeResponse(statuses.pop(0))
+        return getattr(self, method.lower())(url, **kwargs)
+
+    def delete(self, url):
+        content_id = self._content_id(url)
+        if content_id not in self.store:
+            return FakeResponse(404)
+        del self.store[content_id]
+        return FakeResponse(204)
+
+    def head(self, url):
+        content_id = self._content_id(url)
+        if content_id not in self.store:
+            return FakeResponse(404)
+        return FakeResponse(200, headers={
+            'Content-Length': str(len(self.store[content_id])),
+            'Content-MD5': hashlib.md5(self.store[content_id]).hexdigest()})
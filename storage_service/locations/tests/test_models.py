@@ -1,7 +1,17 @@
+import hashlib
+import os
+import shutil
+import signal
+import subprocess
+import tempfile
+import time
 
 from django.test import TestCase
+from lxml import etree
 
+from common import utils
 from locations import models
+from locations.models import lockssomatic
 
 
 class TestLockssomatic(TestCase):
@@ -28,3 +38,234 @@ class TestLockssomatic(TestCase):
         assert self.lom_object.collection_iri != ''
         assert self.lom_object.checksum_type != None
 
+
+    def test_write_chunks(self):
+        class FakePackage(object):
+            misc_attributes = {}
+            saves = 0
+            def save(self):
+                self.saves += 1
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        package = FakePackage()
+        package.full_path = os.path.join(tmp_dir, 'aip.7z')
+        with open(package.full_path, 'wb') as f:
+            f.write('0123456789' * 2 + '01')
+        self.lom_object.au_size = 10
+        self.lom_object.checksum_type = 'sha1'
+        chunks = self.lom_object._write_chunks(package)
+        assert [c['size'] for c in chunks] == [10, 10, 2]
+        assert chunks[0]['path'] == os.path.join(tmp_dir, 'aip.tar-1')
+        assert chunks[0]['checksum'] == hashlib.sha1('0123456789').hexdigest()
+        assert chunks[0]['checksum_type'] == 'SHA-1'
+        assert ''.join(open(c['path'], 'rb').read() for c in chunks) == open(package.full_path, 'rb').read()
+        assert package.saves == 3
+
+        # Resumes after the complete chunks, rewriting the partial one
+        with open(chunks[2]['path'], 'wb') as f:
+            f.write('x')
+        os.utime(chunks[0]['path'], (0, 0))
+        mtime = os.path.getmtime(chunks[0]['path'])
+        assert self.lom_object._write_chunks(package) == chunks
+        assert os.path.getmtime(chunks[0]['path']) == mtime
+        assert open(chunks[2]['path'], 'rb').read() == '01'
+        assert package.saves == 4
+
+        # Unknown checksum types fall back to md5
+        self.lom_object.checksum_type = 'unknown'
+        chunks = self.lom_object._write_chunks(package)
+        assert chunks[0]['checksum_type'] == 'MD5'
+
+    def test_split_package_virtual(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        location = models.Location(space=self.lom_object.space, relative_path=tmp_dir)
+        package = models.Package(current_location=location, current_path='aip.7z',
+            pointer_file_location=location, pointer_file_path='pointer.xml',
+            misc_attributes={})
+        package.save = lambda: None
+        with open(package.full_path, 'wb') as f:
+            f.write('0123456789' * 2 + '01')
+        with open(package.full_pointer_file_path, 'w') as f:
+            f.write("""<mets:mets xmlns:mets="http://www.loc.gov/METS/" xmlns:xlink="http://www.w3.org/1999/xlink">
+  <mets:amdSec ID="amdSec_1"/>
+  <mets:fileSec>
+    <mets:fileGrp USE="Archival Information Package">
+      <mets:file ID="aip.7z"><mets:FLocat LOCTYPE="OTHER" OTHERLOCTYPE="SYSTEM" xlink:href="{}"/></mets:file>
+    </mets:fileGrp>
+  </mets:fileSec>
+  <mets:structMap TYPE="physical">
+    <mets:div TYPE="Archival Information Package"><mets:fptr FILEID="aip.7z"/></mets:div>
+  </mets:structMap>
+</mets:mets>""".format(package.full_path))
+        self.lom_object.au_size = 10
+        self.lom_object.checksum_type = 'md5'
+        self.lom_object.virtual_chunks = True
+        output_files = self.lom_object._split_package(package)
+        assert output_files == [os.path.join(tmp_dir, 'aip.tar-' + str(i)) for i in (1, 2, 3)]
+        assert sorted(os.listdir(tmp_dir)) == ['aip.7z', 'pointer.xml']
+        root = etree.parse(package.full_pointer_file_path)
+        areas = root.findall('.//mets:div[@TYPE="LOCKSS chunk"]/mets:fptr/mets:area', namespaces=utils.NSMAP)
+        assert [(a.get('FILEID'), a.get('BEGIN'), a.get('END')) for a in areas] == [
+            ('aip.7z', '0', '9'), ('aip.7z', '10', '19'), ('aip.7z', '20', '21')]
+        chunk = root.find('.//mets:fileGrp[@USE="LOCKSS chunk"]/mets:file[@ID="aip.tar-3"]', namespaces=utils.NSMAP)
+        assert chunk.get('SIZE') == '2'
+        assert chunk.get('CHECKSUM') == hashlib.md5('01').hexdigest()
+        assert chunk.find('mets:FLocat', namespaces=utils.NSMAP) is None
+
+        # Downloads of each chunk are served from its byte range
+        assert package.get_download('3') == (package.full_path, (20, 2))
+        assert package.get_download_range(None) is None
+        response = utils.download_file_stream(package.full_path,
+            byte_range=(10, 10), filename='aip.tar-2')
+        assert ''.join(response) == '0123456789'
+        assert response['Content-Length'] == '10'
+
+    def test_poll_lockss_status_backs_off(self):
+        location = models.Location.objects.create(space=self.lom_object.space,
+            purpose=models.Location.AIP_STORAGE, relative_path='aips')
+        package = models.Package.objects.create(current_location=location,
+            current_path='aip.7z', package_type=models.Package.AIP,
+            status=models.Package.STAGING,
+            misc_attributes={'state_iri': 'http://lom/state', 'edit_iri': 'http://lom/edit'})
+        statement = etree.fromstring(
+            '<atom:feed xmlns:atom="{atom}" xmlns:lom="{lom}"><lom:server state="disagreement"/></atom:feed>'.format(**utils.NSMAP))
+        fetched = []
+        def fetch_statement(lom, package, session=None):
+            fetched.append(package.uuid)
+            return statement
+        for name, value in (('update_service_document', lambda lom: True),
+                ('_fetch_statement', fetch_statement)):
+            self.addCleanup(setattr, models.Lockssomatic, name, getattr(models.Lockssomatic, name))
+            setattr(models.Lockssomatic, name, value)
+
+        summary = lockssomatic.poll_lockss_status(workers=1)
+        assert summary == {'uploaded': 0, 'staging': 1, 'skipped': 0}
+        poll = models.Package.objects.get(pk=package.pk).misc_attributes['lockss_poll']
+        assert poll['attempts'] == 1
+        # Not polled again until the back-off has passed
+        assert lockssomatic.poll_lockss_status(workers=1)['skipped'] == 1
+        assert fetched == [package.uuid]
+        lockssomatic.poll_lockss_status(workers=1, force=True)
+        poll2 = models.Package.objects.get(pk=package.pk).misc_attributes['lockss_poll']
+        assert poll2['attempts'] == 2
+        assert poll2['next_poll'] - poll['next_poll'] >= lockssomatic.LOCKSS_POLL_DELAY
+
+    def test_service_document_cache(self):
+        fetches = []
+        def fetch_service_document(lom):
+            fetches.append(lom.space_id)
+            return {'time': time.time(), 'sd_iri': lom.sd_iri,
+                'on_behalf_of': lom.content_provider_id, 'connection': 'conn',
+                'au_size': 1000, 'collection_iri': 'http://lom/col-iri/1',
+                'checksum_type': 'md5'}
+        self.addCleanup(setattr, models.Lockssomatic, '_fetch_service_document', models.Lockssomatic._fetch_service_document)
+        models.Lockssomatic._fetch_service_document = fetch_service_document
+        self.addCleanup(lockssomatic.SERVICE_DOCUMENT_CACHE.clear)
+
+        assert self.lom_object.update_service_document()
+        assert models.Lockssomatic.objects.get(pk=self.lom_object.pk).au_size == 1000
+        # Other instances in this process reuse the service document, and
+        # don't save unchanged values
+        lom = models.Lockssomatic.objects.get(pk=self.lom_object.pk)
+        lom.save = lambda: self.fail('Unchanged values saved')
+        assert lom.update_service_document()
+        assert lom.sword_connection == 'conn'
+        assert len(fetches) == 1
+        # Fetched again once the TTL expires, or after an error
+        utils.set_setting('lockss_service_document_ttl', 0)
+        assert lom.update_service_document()
+        assert len(fetches) == 2
+        utils.set_setting('lockss_service_document_ttl', 60)
+        lom.invalidate_service_document()
+        assert lom.update_service_document()
+        assert len(fetches) == 3
+
+    def test_mets_metadata_cached(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        location = models.Location(space=self.lom_object.space, relative_path=tmp_dir)
+        package = models.Package(current_location=location, current_path='aip',
+            misc_attributes={})
+        package.save = lambda: None
+        os.makedirs(os.path.join(tmp_dir, 'aip', 'data'))
+        with open(os.path.join(tmp_dir, 'aip', 'data', 'METS.{}.xml'.format(package.uuid)), 'w') as f:
+            f.write("""<mets:mets xmlns:mets="{mets}" xmlns:dcterms="{dcterms}">
+  <mets:dmdSec><mets:mdWrap MDTYPE="DC"><mets:xmlData><dcterms:dublincore>
+    <dcterms:title>Title</dcterms:title>
+  </dcterms:dublincore></mets:xmlData></mets:mdWrap></mets:dmdSec>
+</mets:mets>""".format(**utils.NSMAP))
+        metadata = self.lom_object._mets_metadata(package)
+        assert metadata['title'] == metadata['slug'] == 'Title'
+        assert metadata['author'] is None
+        assert package.misc_attributes['mets_metadata'] == metadata
+        # Cached, so the package isn't read again
+        package.open_file = lambda path: self.fail('METS read again')
+        assert self.lom_object._mets_metadata(package) == metadata
+
+
+class TestPipelineLocalFS(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        space = models.Space.objects.create(
+            access_protocol=models.Space.PIPELINE_LOCAL_FS, path='/')
+        self.pipeline = models.PipelineLocalFS.objects.create(space=space,
+            remote_user='archivematica', remote_name='pipeline')
+        self.addCleanup(models.pipeline_local._ssh_masters_checked.clear)
+
+    def _fake_ssh(self, script):
+        """ Puts an ssh on the PATH that logs its arguments and runs script. """
+        bin_dir = os.path.join(self.tmp_dir, 'bin')
+        os.mkdir(bin_dir)
+        with open(os.path.join(bin_dir, 'ssh'), 'w') as f:
+            f.write('#!/bin/sh\n')
+            f.write('echo "$@" >> {}/ssh.log\n'.format(self.tmp_dir))
+            f.write(script)
+        os.chmod(os.path.join(bin_dir, 'ssh'), 0755)
+        self.addCleanup(os.environ.__setitem__, 'PATH', os.environ['PATH'])
+        os.environ['PATH'] = bin_dir + os.pathsep + os.environ['PATH']
+
+    def test_ssh_master_does_not_hold_output(self):
+        # A fake ssh with no master running, whose master lingers in the
+        # background like ControlPersist, and whose clients print 'ok'
+        self._fake_ssh(
+            'case "$*" in\n'
+            '  *"-O check"*) exit 255 ;;\n'
+            '  *" -M "*) sleep 30 & echo $! > {}/master.pid; exit 0 ;;\n'
+            'esac\n'
+            'echo ok\n'.format(self.tmp_dir))
+
+        start = time.time()
+        command = self.pipeline._ssh_command()
+        output = subprocess.check_output(command + ['archivematica@pipeline', 'true'])
+        os.kill(int(open(os.path.join(self.tmp_dir, 'master.pid')).read()), signal.SIGTERM)
+        assert output == 'ok\n'
+        # Returned without waiting for the master to exit
+        assert time.time() - start < 10
+        assert 'ControlMaster=no' in command
+        assert os.path.join(models.pipeline_local.SSH_CONTROL_DIR, '%C') in ' '.join(command)
+        # The master was started once no running master was found
+        log = open(os.path.join(self.tmp_dir, 'ssh.log')).read().splitlines()
+        assert '-O check' in log[0]
+        assert '-f -N -M' in log[1]
+
+    def test_ssh_master_checked_once(self):
+        # A running master, and a client that fails to connect
+        self._fake_ssh(
+            'case "$*" in\n'
+            '  *"-O check"*) exit 0 ;;\n'
+            'esac\n'
+            'exit 255\n')
+        self.pipeline._ssh_command()
+        self.pipeline._ssh_command()
+        log = open(os.path.join(self.tmp_dir, 'ssh.log')).read().splitlines()
+        assert len(log) == 1
+        # Checked again after a command fails to connect
+        with self.assertRaises(subprocess.CalledProcessError):
+            self.pipeline._create_remote_directory('/dir')
+        self.pipeline._ssh_command()
+        log = open(os.path.join(self.tmp_dir, 'ssh.log')).read().splitlines()
+        assert len(log) == 3
+        assert '-O check' in log[2]
@@ -0,0 +1,213 @@
+import datetime
+import json
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+from django.test.client import Client
+from django.utils import timezone
+
+from locations import models
+from locations.models import move_job
+
+
+class TestMoveJob(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.tmp_dir, 'src', 'transfer'))
+        with open(os.path.join(self.tmp_dir, 'src', 'transfer', 'test.txt'), 'w') as f:
+            f.write('test file\n')
+        self.space = models.Space.objects.create(
+            access_protocol=models.Space.LOCAL_FILESYSTEM,
+            path=self.tmp_dir,
+            staging_path=os.path.join(self.tmp_dir, 'staging'),
+            copy_engine=models.Space.NATIVE,
+            max_concurrent_moves=1)
+        models.LocalFilesystem.objects.create(space=self.space)
+        self.origin = models.Location.objects.create(
+            space=self.space, relative_path='src',
+            purpose=models.Location.TRANSFER_SOURCE)
+        self.destination = models.Location.objects.create(
+            space=self.space, relative_path='dest',
+            purpose=models.Location.CURRENTLY_PROCESSING)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_run(self):
+        job = models.MoveJob.objects.create(
+            origin_location=self.origin,
+            destination_location=self.destination,
+            files_total=2)
+        models.MoveJobFile.objects.create(
+            job=job, source='transfer/', destination='transfer/')
+        models.MoveJobFile.objects.create(
+            job=job, source='missing/', destination='missing/')
+        job.run()
+        job = models.MoveJob.objects.get(uuid=job.uuid)
+        assert job.status == models.MoveJob.FAILED
+        assert job.files_moved == 1
+        assert job.files_failed == 1
+        assert job.bytes_moved == len('test file\n')
+        assert job.completed_time is not None
+        assert os.path.isfile(os.path.join(self.tmp_dir, 'dest', 'transfer', 'test.txt'))
+        failed = job.file_set.get(source='missing/')
+        assert failed.status == models.MoveJob.FAILED
+        assert failed.error
+        # Jobs can only be claimed once
+        models.MoveJob.objects.filter(uuid=job.uuid).update(status=models.MoveJob.PROCESSING)
+        job.run()
+        assert models.MoveJob.objects.get(uuid=job.uuid).files_moved == 1
+
+    def test_run_waits_for_other_jobs(self):
+        # Another job is already using the space's only move
+        other = models.MoveJob.objects.create(
+            origin_location=self.origin,
+            destination_location=self.destination,
+            status=models.MoveJob.PROCESSING,
+            heartbeat_time=timezone.now())
+        running = models.MoveJobFile.objects.create(job=other,
+            source='other/', destination='other/',
+            status=models.MoveJob.PROCESSING)
+        job = models.MoveJob.objects.create(
+            origin_location=self.origin,
+            destination_location=self.destination,
+            files_total=1)
+        models.MoveJobFile.objects.create(
+            job=job, source='transfer/', destination='transfer/')
+        waits = []
+
+        def finish_other(seconds):
+            waits.append(seconds)
+            assert not os.path.exists(os.path.join(self.tmp_dir, 'dest', 'transfer'))
+            models.MoveJobFile.objects.filter(pk=running.pk).update(
+                status=models.MoveJob.COMPLETE)
+        self.addCleanup(setattr, move_job.time, 'sleep', move_job.time.sleep)
+        move_job.time.sleep = finish_other
+        job.run()
+        assert len(waits) == 1
+        assert models.MoveJob.objects.get(uuid=job.uuid).status == models.MoveJob.COMPLETE
+        assert os.path.isfile(os.path.join(self.tmp_dir, 'dest', 'transfer', 'test.txt'))
+
+    def test_run_without_waiting(self):
+        other = models.MoveJob.objects.create(
+            origin_location=self.origin,
+            destination_location=self.destination,
+            status=models.MoveJob.PROCESSING,
+            heartbeat_time=timezone.now())
+        models.MoveJobFile.objects.create(job=other,
+            source='other/', destination='other/',
+            status=models.MoveJob.PROCESSING)
+        job = models.MoveJob.objects.create(
+            origin_location=self.origin,
+            destination_location=self.destination,
+            files_total=1)
+        models.MoveJobFile.objects.create(
+            job=job, source='transfer/', destination='transfer/')
+
+        def sleep(seconds):
+            raise AssertionError('Waited for a free move')
+        self.addCleanup(setattr, move_job.time, 'sleep', move_job.time.sleep)
+        move_job.time.sleep = sleep
+        job.run(wait=False)
+        assert models.MoveJob.objects.get(uuid=job.uuid).status == models.MoveJob.COMPLETE
+        assert os.path.isfile(os.path.join(self.tmp_dir, 'dest', 'transfer', 'test.txt'))
+
+    def test_run_keeps_reaped_status(self):
+        job = models.MoveJob.objects.create(
+            origin_location=self.origin,
+            destination_location=self.destination,
+            files_total=1)
+        models.MoveJobFile.objects.create(
+            job=job, source='transfer/', destination='transfer/')
+        move_file = job._move_file
+
+        def reaped_move_file(*args):
+            # Another process gives up on the job while it is moving
+            models.MoveJob.objects.filter(uuid=job.uuid).update(
+                status=models.MoveJob.FAILED)
+            move_file(*args)
+        job._move_file = reaped_move_file
+        job.run()
+        assert models.MoveJob.objects.get(uuid=job.uuid).status == models.MoveJob.FAILED
+
+    def test_run_reaps_dead_jobs(self):
+        # A job whose process died while holding the space's only move
+        dead = models.MoveJob.objects.create(
+            origin_location=self.origin,
+            destination_location=self.destination,
+            status=models.MoveJob.PROCESSING,
+            heartbeat_time=timezone.now() - datetime.timedelta(
+                seconds=move_job.MOVE_JOB_STALE + 1))
+        models.MoveJobFile.objects.create(job=dead,
+            source='other/', destination='other/',
+            status=models.MoveJob.PROCESSING)
+        job = models.MoveJob.objects.create(
+            origin_location=self.origin,
+            destination_location=self.destination,
+            files_total=1)
+        models.MoveJobFile.objects.create(
+            job=job, source='transfer/', destination='transfer/')
+        job.run()
+        assert models.MoveJob.objects.get(uuid=job.uuid).status == models.MoveJob.COMPLETE
+        dead = models.MoveJob.objects.get(uuid=dead.uuid)
+        assert dead.status == models.MoveJob.FAILED
+        assert dead.files_failed == 1
+        assert dead.file_set.get().error
+
+    def test_run_times_out_waiting(self):
+        other = models.MoveJob.objects.create(
+            origin_location=self.origin,
+            destination_location=self.destination,
+            status=models.MoveJob.PROCESSING,
+            heartbeat_time=timezone.now())
+        models.MoveJobFile.objects.create(job=other,
+            source='other/', destination='other/',
+            status=models.MoveJob.PROCESSING)
+        job = models.MoveJob.objects.create(
+            origin_location=self.origin,
+            destination_location=self.destination,
+            files_total=1)
+        models.MoveJobFile.objects.create(
+            job=job, source='transfer/', destination='transfer/')
+        self.addCleanup(setattr, move_job, 'MOVE_SLOT_TIMEOUT', move_job.MOVE_SLOT_TIMEOUT)
+        move_job.MOVE_SLOT_TIMEOUT = -1
+        job.run()
+        job = models.MoveJob.objects.get(uuid=job.uuid)
+        assert job.status == models.MoveJob.FAILED
+        assert 'Timed out' in job.file_set.get().error
+        assert not os.path.exists(os.path.join(self.tmp_dir, 'dest', 'transfer'))
+
+    def test_move_endpoint_creates_job(self):
+        body = {
+            'origin_location': '/api/v2/location/{}/'.format(self.origin.uuid),
+            'pipeline': '/api/v2/pipeline/{}/'.format('does-not-exist'),
+            'files': [{'source': 'transfer/', 'destination': 'transfer/'}],
+        }
+        response = Client().post(
+            '/api/v2/location/{}/'.format(self.destination.uuid),
+            data=json.dumps(body), content_type='application/json')
+        assert response.status_code == 200
+        job_uri = json.loads(response.content)['job']
+        response = Client().get(job_uri, {'format': 'json'})
+        assert response.status_code == 200
+        job = json.loads(response.content)
+        assert job['status'] == models.MoveJob.COMPLETE
+        assert job['files_moved'] == 1
+        assert job['files'][0]['source'] == 'transfer/'
+
+    def test_move_endpoint_requires_boolean_async(self):
+        body = {
+            'origin_location': '/api/v2/location/{}/'.format(self.origin.uuid),
+            'pipeline': '/api/v2/pipeline/{}/'.format('does-not-exist'),
+            'files': [{'source': 'transfer/', 'destination': 'transfer/'}],
+            'async': 'false',
+        }
+        response = Client().post(
+            '/api/v2/location/{}/'.format(self.destination.uuid),
+            data=json.dumps(body), content_type='application/json')
+        assert response.status_code == 400
+        assert not models.MoveJob.objects.exists()
+        assert not os.path.exists(os.path.join(self.tmp_dir, 'dest', 'transfer'))
@@ -0,0 +1,162 @@
+import datetime
+import os
+import shutil
+import tarfile
+import tempfile
+
+from django.test import TestCase
+from django.utils import timezone
+
+from locations import models
+
+
+class TestPackage(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.space = models.Space.objects.create(
+            access_protocol=models.Space.LOCAL_FILESYSTEM,
+            path=self.tmp_dir,
+            staging_path=os.path.join(self.tmp_dir, 'staging'))
+        models.LocalFilesystem.objects.create(space=self.space)
+        self.location = models.Location.objects.create(
+            space=self.space, relative_path='aips',
+            purpose=models.Location.AIP_STORAGE)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_update_quotas_concurrent(self):
+        package = models.Package(current_location=self.location, size=100)
+        # Two processes each holding their own copy of the Space and Location
+        space1, location1 = models.Space.objects.get(pk=self.space.pk), models.Location.objects.get(pk=self.location.pk)
+        space2, location2 = models.Space.objects.get(pk=self.space.pk), models.Location.objects.get(pk=self.location.pk)
+        package._update_quotas(space1, location1)
+        package._update_quotas(space2, location2)
+        assert models.Space.objects.get(pk=self.space.pk).used == 200
+        assert models.Location.objects.get(pk=self.location.pk).used == 200
+        assert space2.used == 200
+
+    def test_delete_from_storage_frees_quota(self):
+        os.makedirs(os.path.join(self.tmp_dir, 'aips', 'aip'))
+        package = models.Package.objects.create(current_location=self.location,
+            current_path='aip', size=100, status=models.Package.UPLOADED,
+            package_type=models.Package.AIP)
+        package._update_quotas(self.space, self.location)
+        package.delete_from_storage()
+        assert models.Space.objects.get(pk=self.space.pk).used == 0
+        assert models.Location.objects.get(pk=self.location.pk).used == 0
+        # Deleting again doesn't free the space twice
+        package.delete_from_storage()
+        assert models.Location.objects.get(pk=self.location.pk).used == 0
+
+    def test_delete_from_storage_uncounted_package(self):
+        os.makedirs(os.path.join(self.tmp_dir, 'aips', 'aip'))
+        package = models.Package.objects.create(current_location=self.location,
+            current_path='aip', size=100, status=models.Package.FAIL,
+            package_type=models.Package.AIP)
+        package.delete_from_storage()
+        assert package.status == models.Package.DELETED
+        assert models.Space.objects.get(pk=self.space.pk).used == 0
+        assert models.Location.objects.get(pk=self.location.pk).used == 0
+
+    def test_delete_from_storage_failure(self):
+        os.makedirs(os.path.join(self.tmp_dir, 'aips', 'aip'))
+        package = models.Package.objects.create(current_location=self.location,
+            current_path='aip', size=100, status=models.Package.UPLOADED,
+            package_type=models.Package.AIP)
+        package._update_quotas(self.space, self.location)
+        def failing_delete(space, delete_path):
+            raise models.StorageException('Permission denied')
+        self.addCleanup(setattr, models.Space, 'delete_path',
+            models.Space.__dict__['delete_path'])
+        models.Space.delete_path = failing_delete
+        success, error = package.delete_from_storage()
+        assert not success
+        assert error == 'Permission denied'
+        # The package is still stored and counted
+        package = models.Package.objects.get(pk=package.pk)
+        assert package.status == models.Package.UPLOADED
+        assert models.Location.objects.get(pk=self.location.pk).used == 100
+
+    def test_quota_reservation(self):
+        self.location.quota = 250
+        self.location.save()
+        package = models.Package.objects.create(current_location=self.location,
+            current_path='aip', size=100, package_type=models.Package.AIP)
+        first = models.QuotaReservation.reserve(package, self.space, self.location)
+        second = models.QuotaReservation.reserve(package, self.space, self.location)
+        # Only 50 bytes are left unreserved
+        with self.assertRaises(models.StorageException):
+            models.QuotaReservation.reserve(package, self.space, self.location)
+        assert models.Location.objects.get(pk=self.location.pk).reserved == 200
+        assert models.Space.objects.get(pk=self.space.pk).reserved == 200
+
+        first.convert()
+        second.release()
+        second.release()
+        location = models.Location.objects.get(pk=self.location.pk)
+        assert location.used == 100
+        assert location.reserved == 0
+        assert models.Space.objects.get(pk=self.space.pk).reserved == 0
+
+    def test_quota_reservation_expires(self):
+        package = models.Package.objects.create(current_location=self.location,
+            current_path='aip', size=100, package_type=models.Package.AIP)
+        reservation = models.QuotaReservation.reserve(package, self.space, self.location)
+        models.QuotaReservation.objects.filter(pk=reservation.pk).update(
+            expires_time=timezone.now() - datetime.timedelta(hours=1))
+        models.QuotaReservation.release_expired()
+        assert models.Location.objects.get(pk=self.location.pk).reserved == 0
+        # The store finished after all, so usage is still recorded
+        reservation.convert()
+        location = models.Location.objects.get(pk=self.location.pk)
+        assert location.used == 100
+        assert location.reserved == 0
+
+    def _read_file(self, package, relative_path):
+        with package.open_file(relative_path) as f:
+            return f.read() if f else None
+
+    def test_open_file(self):
+        aip_dir = os.path.join(self.tmp_dir, 'aips', 'aip')
+        os.makedirs(os.path.join(aip_dir, 'data'))
+        with open(os.path.join(aip_dir, 'data', 'METS.xml'), 'w') as f:
+            f.write('<mets/>')
+        package = models.Package(current_location=self.location, current_path='aip')
+        assert self._read_file(package, 'aip/data/METS.xml') == '<mets/>'
+        assert self._read_file(package, 'aip/data/missing.xml') is None
+        for mode, current_path in (('w', 'aip.tar'), ('w:bz2', 'aip.tar.bz2')):
+            tar = tarfile.open(os.path.join(self.tmp_dir, 'aips', current_path), mode)
+            tar.add(aip_dir, 'aip')
+            tar.close()
+            package = models.Package(current_location=self.location, current_path=current_path)
+            assert self._read_file(package, 'aip/data/METS.xml') == '<mets/>'
+            assert self._read_file(package, 'aip/data/missing.xml') is None
+
+    def test_open_file_removes_fetched_copy(self):
+        aip_dir = os.path.join(self.tmp_dir, 'aips', 'aip')
+        os.makedirs(os.path.join(aip_dir, 'data'))
+        with open(os.path.join(aip_dir, 'data', 'METS.xml'), 'w') as f:
+            f.write('<mets/>')
+        tar = tarfile.open(os.path.join(self.tmp_dir, 'aips', 'aip.tar'), 'w')
+        tar.add(aip_dir, 'aip')
+        tar.close()
+        internal = models.Location.objects.create(space=self.space,
+            relative_path='internal',
+            purpose=models.Location.STORAGE_SERVICE_INTERNAL)
+        os.makedirs(internal.full_path)
+        package = models.Package(current_location=self.location, current_path='aip.tar')
+
+        # As if the package were on remote storage
+        def fetch_local_path():
+            temp_dir = tempfile.mkdtemp(dir=internal.full_path)
+            shutil.copy(os.path.join(self.tmp_dir, 'aips', 'aip.tar'), temp_dir)
+            package.local_path_location = internal
+            package.local_path = os.path.join(temp_dir, 'aip.tar')
+            return package.local_path
+        package.get_local_path = lambda: package.local_path
+        package.fetch_local_path = fetch_local_path
+        assert self._read_file(package, 'aip/data/METS.xml') == '<mets/>'
+        assert os.listdir(internal.full_path) == []
+        assert package.local_path is None
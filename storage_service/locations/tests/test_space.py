@@ -0,0 +1,310 @@
+import datetime
+import os
+import shutil
+from StringIO import StringIO
+import tempfile
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from common import utils
+from locations import models
+
+
+class TestSpace(TestCase):
+
+    def setUp(self):
+        self.space = models.Space(access_protocol=models.Space.LOCAL_FILESYSTEM)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp_dir, 'src', 'aip')
+        os.makedirs(os.path.join(self.src, 'data'))
+        with open(os.path.join(self.src, 'data', 'test.txt'), 'w') as f:
+            f.write('test file\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_move_local_same_device_keep_source(self):
+        self.space.copy_engine = models.Space.NATIVE
+        dest = os.path.join(self.tmp_dir, 'staging', 'aip')
+        self.space._create_local_directory(dest)
+        self.space._move_local(self.src + os.sep, dest, keep_source=True)
+        assert open(os.path.join(dest, 'data', 'test.txt')).read() == 'test file\n'
+        # Source is untouched, and the copy doesn't share its data
+        assert os.path.isfile(os.path.join(self.src, 'data', 'test.txt'))
+        assert os.stat(os.path.join(dest, 'data', 'test.txt')).st_nlink == 1
+
+    def test_move_local_same_device_rename(self):
+        dest = os.path.join(self.tmp_dir, 'final')
+        self.space._create_local_directory(os.path.join(dest, ''))
+        self.space._move_local(self.src, dest, keep_source=False)
+        # No trailing / on source, so it is put inside dest
+        assert open(os.path.join(dest, 'aip', 'data', 'test.txt')).read() == 'test file\n'
+        assert not os.path.exists(self.src)
+
+    def test_local_move_target_existing(self):
+        dest = os.path.join(self.tmp_dir, 'final', 'aip')
+        os.makedirs(dest)
+        # Empty directories can be replaced
+        assert self.space._local_move_target(self.src + os.sep, dest) == dest
+        # Anything else has to be merged by rsync
+        open(os.path.join(dest, 'other.txt'), 'w').close()
+        assert self.space._local_move_target(self.src + os.sep, dest) is None
+
+    def test_move_to_space_skips_staging(self):
+        space = models.Space.objects.create(
+            access_protocol=models.Space.LOCAL_FILESYSTEM,
+            path=self.tmp_dir,
+            staging_path=os.path.join(self.tmp_dir, 'staging'),
+            copy_engine=models.Space.NATIVE)
+        models.LocalFilesystem.objects.create(space=space)
+        space.move_to_space('src/aip/', 'aips/aip', space)
+        assert open(os.path.join(self.tmp_dir, 'aips', 'aip', 'data', 'test.txt')).read() == 'test file\n'
+        assert not os.path.exists(os.path.join(self.tmp_dir, 'staging'))
+
+    def test_move_to_space_invalidates_browse_cache(self):
+        from locations.models.space import BROWSE_CACHE
+        space = models.Space.objects.create(
+            access_protocol=models.Space.LOCAL_FILESYSTEM,
+            path=self.tmp_dir,
+            staging_path=os.path.join(self.tmp_dir, 'staging'),
+            copy_engine=models.Space.NATIVE)
+        models.LocalFilesystem.objects.create(space=space)
+        cache_key = (space.uuid, os.path.join(self.tmp_dir, 'aips'), (), ())
+        self.addCleanup(BROWSE_CACHE.clear)
+        # A listing cached while the move is running
+        move_to_storage_service = models.LocalFilesystem.__dict__['move_to_storage_service']
+        def browse_during_move(local_fs, *args, **kwargs):
+            BROWSE_CACHE.set(cache_key, {'entries': []})
+            return move_to_storage_service(local_fs, *args, **kwargs)
+        self.addCleanup(setattr, models.LocalFilesystem,
+            'move_to_storage_service', move_to_storage_service)
+        models.LocalFilesystem.move_to_storage_service = browse_during_move
+        space.move_to_space('src/aip/', 'aips/aip', space)
+        assert BROWSE_CACHE.get(cache_key, 60) is None
+
+    def _fake_rsync(self, *returncodes, **kwargs):
+        """ Puts an rsync on the PATH that exits with each of returncodes in
+        turn, logging its arguments and printing kwargs['output']. """
+        bin_dir = os.path.join(self.tmp_dir, 'bin')
+        os.mkdir(bin_dir)
+        with open(os.path.join(bin_dir, 'output'), 'w') as f:
+            f.write(kwargs.get('output', ''))
+        with open(os.path.join(bin_dir, 'rsync'), 'w') as f:
+            f.write('#!/bin/sh\n')
+            f.write('echo "$@" >> {}/rsync.log\n'.format(self.tmp_dir))
+            f.write('cat {}/output\n'.format(bin_dir))
+            f.write('n=$(wc -l < {}/rsync.log)\n'.format(self.tmp_dir))
+            for i, code in enumerate(returncodes, 1):
+                f.write('[ $n -eq {} ] && exit {}\n'.format(i, code))
+        os.chmod(os.path.join(bin_dir, 'rsync'), 0755)
+        self.addCleanup(os.environ.__setitem__, 'PATH', os.environ['PATH'])
+        os.environ['PATH'] = bin_dir + os.pathsep + os.environ['PATH']
+        utils.set_setting('rsync_retry_delay', 0)
+
+    def test_move_rsync_retries_transient_errors(self):
+        self._fake_rsync(12, 0)
+        self.space._move_rsync(self.src, self.tmp_dir)
+        move = models.RsyncMove.objects.get(source=self.src)
+        assert move.status == models.RsyncMove.COMPLETE
+        assert [a['returncode'] for a in move.attempts] == [12, 0]
+        commands = open(os.path.join(self.tmp_dir, 'rsync.log')).read().splitlines()
+        # Only interrupted files are resumed
+        assert '--partial-dir' in commands[0]
+        assert '--partial-dir' in commands[1]
+        assert '--append-verify' not in commands[1]
+
+    def test_move_rsync_fatal_error(self):
+        self._fake_rsync(1, 0)
+        with self.assertRaises(models.StorageException):
+            self.space._move_rsync(self.src, self.tmp_dir)
+        move = models.RsyncMove.objects.get(source=self.src)
+        assert move.status == models.RsyncMove.FAILED
+        assert len(move.attempts) == 1
+
+    def test_move_rsync_partial_transfer(self):
+        # Missing or unreadable files aren't retried
+        self._fake_rsync(23, 0, output=
+            'rsync: link_stat "/src/aip" failed: No such file or directory (2)\n')
+        with self.assertRaises(models.StorageException):
+            self.space._move_rsync(self.src, self.tmp_dir)
+        assert len(models.RsyncMove.objects.get(source=self.src).attempts) == 1
+        # I/O errors are
+        models.RsyncMove.objects.all().delete()
+        os.remove(os.path.join(self.tmp_dir, 'rsync.log'))
+        with open(os.path.join(self.tmp_dir, 'bin', 'output'), 'w') as f:
+            f.write('rsync: read errors mapping "/src/aip/data/test.txt": Input/output error (5)\n')
+        self.space._move_rsync(self.src, self.tmp_dir)
+        move = models.RsyncMove.objects.get(source=self.src)
+        assert [a['returncode'] for a in move.attempts] == [23, 0]
+
+    def test_move_rsync_ssh_error(self):
+        # Authentication failures aren't retried
+        self._fake_rsync(255, 0, output='user@host: Permission denied (publickey).\n')
+        with self.assertRaises(models.StorageException):
+            self.space._move_rsync(self.src, self.tmp_dir)
+        assert len(models.RsyncMove.objects.get(source=self.src).attempts) == 1
+        # Dropped connections are
+        models.RsyncMove.objects.all().delete()
+        os.remove(os.path.join(self.tmp_dir, 'rsync.log'))
+        with open(os.path.join(self.tmp_dir, 'bin', 'output'), 'w') as f:
+            f.write('Connection to host closed by remote host.\n')
+        self.space._move_rsync(self.src, self.tmp_dir)
+        move = models.RsyncMove.objects.get(source=self.src)
+        assert [a['returncode'] for a in move.attempts] == [255, 0]
+
+    def test_delete_expired_rsync_moves(self):
+        old = models.RsyncMove.objects.create(source='old', destination='old',
+            status=models.RsyncMove.COMPLETE,
+            completed_time=timezone.now() - datetime.timedelta(days=31))
+        running = models.RsyncMove.objects.create(source='running',
+            destination='running')
+        call_command('delete_expired_rsync_moves', stdout=StringIO())
+        assert not models.RsyncMove.objects.filter(pk=old.pk).exists()
+        assert models.RsyncMove.objects.filter(pk=running.pk).exists()
+
+    def test_move_rsync_progress(self):
+        self._fake_rsync(0, output=
+            'aip/data/a.txt\n'
+            '        512  50%    1.00MB/s    0:00:01\r'
+            '      1,024 100%    1.00MB/s    0:00:01 (xfr#1, to-chk=1/3)\n'
+            'aip/data/b.txt\n'
+            '      2,048 100%    2.00MB/s    0:00:01 (xfr#2, to-chk=0/3)\n'
+            'sent 3,100 bytes  received 50 bytes  total size 3,072\n')
+        self.space._move_rsync(self.src, self.tmp_dir)
+        move = models.RsyncMove.objects.get(source=self.src)
+        assert move.bytes_transferred == 3072
+        assert move.files_transferred == 2
+        assert move.updated_time is not None
+        # Only non-progress output is kept
+        assert move.attempts[0]['output'].splitlines() == [
+            'aip/data/a.txt', 'aip/data/b.txt',
+            'sent 3,100 bytes  received 50 bytes  total size 3,072']
+
+    def _make_bag(self, checksum):
+        with open(os.path.join(self.src, 'bagit.txt'), 'w') as f:
+            f.write('BagIt-Version: 0.97\nTag-File-Character-Encoding: UTF-8\n')
+        with open(os.path.join(self.src, 'manifest-md5.txt'), 'w') as f:
+            f.write('{}  data/test.txt\n'.format(checksum))
+
+    def test_copy_native_verifies_bag(self):
+        self._make_bag('b05403212c66bdc8ccc597fedf6cd5fe')
+        dest = os.path.join(self.tmp_dir, 'final', '')
+        self.space._create_local_directory(dest)
+        checksums = self.space._copy_native(self.src, dest)
+        assert checksums['data/test.txt'] == 'b05403212c66bdc8ccc597fedf6cd5fe'
+        copied = os.path.join(dest, 'aip', 'data', 'test.txt')
+        assert open(copied).read() == 'test file\n'
+        assert int(os.path.getmtime(copied)) == int(os.path.getmtime(os.path.join(self.src, 'data', 'test.txt')))
+        # Source is untouched
+        assert os.path.isfile(os.path.join(self.src, 'data', 'test.txt'))
+
+    def test_copy_native_bad_checksum(self):
+        self._make_bag('0' * 32)
+        dest = os.path.join(self.tmp_dir, 'final', '')
+        self.space._create_local_directory(dest)
+        with self.assertRaises(models.StorageException):
+            self.space._copy_native(self.src + os.sep, dest)
+
+    def test_copy_native_without_bag(self):
+        dest = os.path.join(self.tmp_dir, 'final', '')
+        self.space._create_local_directory(dest)
+        # Nothing to verify against, so nothing is checksummed
+        assert self.space._copy_native(self.src, dest) is None
+        assert open(os.path.join(dest, 'aip', 'data', 'test.txt')).read() == 'test file\n'
+
+    def test_copy_native_checks_size(self):
+        source = os.path.join(self.src, 'data', 'test.txt')
+        dest = os.path.join(self.tmp_dir, 'test.txt')
+        # Source grows while it is being copied
+        stat = os.stat
+        def grown_stat(path):
+            result = stat(path)
+            if path == source:
+                return os.stat_result(result[:6] + (result.st_size + 1, ) + result[7:])
+            return result
+        self.addCleanup(setattr, os, 'stat', stat)
+        os.stat = grown_stat
+        with self.assertRaises(models.StorageException):
+            self.space._copy_native(source, dest)
+        os.stat = stat
+        assert os.listdir(self.tmp_dir) == ['src']
+        self.space._copy_native(source, dest)
+        assert open(dest).read() == 'test file\n'
+
+    def test_browse_cache(self):
+        from locations.models.space import BrowseCache
+        cache = BrowseCache(2)
+        cache.set(('space', '/a'), {'entries': ['1']})
+        cached = cache.get(('space', '/a'), 60)
+        assert cached == {'entries': ['1']}
+        # Callers can't modify the cached value
+        cached['entries'].append('2')
+        assert cache.get(('space', '/a'), 60) == {'entries': ['1']}
+        # Expired
+        assert cache.get(('space', '/a'), -1) is None
+        # Least recently used is evicted
+        cache.set(('space', '/a'), 'a')
+        cache.set(('space', '/b'), 'b')
+        cache.get(('space', '/a'), 60)
+        cache.set(('space', '/c'), 'c')
+        assert cache.get(('space', '/b'), 60) is None
+        assert cache.get(('space', '/a'), 60) == 'a'
+        # Writes invalidate the path, its parents and its children
+        cache.set(('space', '/a/b'), 'ab')
+        cache.set(('other', '/a/b/c'), 'abc')
+        cache.invalidate('space', '/a/b/c')
+        assert cache.get(('space', '/a/b'), 60) is None
+        assert cache.get(('space', '/a'), 60) is None
+        assert cache.get(('other', '/a/b/c'), 60) == 'abc'
+        cache.invalidate('other', '/a')
+        assert cache.get(('other', '/a/b/c'), 60) is None
+
+    def test_browse_local(self):
+        os.mkdir(os.path.join(self.src, 'Logs'))
+        os.mkdir(os.path.join(self.src, '.hidden'))
+        os.symlink(os.path.join(self.src, 'data'), os.path.join(self.src, 'link'))
+        open(os.path.join(self.src, 'bagit.txt'), 'w').close()
+        result = self.space._browse_local(self.src)
+        assert result == {
+            'directories': ['data', 'link', 'Logs'],
+            'entries': ['bagit.txt', 'data', 'link', 'Logs'],
+        }
+        result = self.space._browse_local(self.src, properties=True)
+        assert result['properties']['bagit.txt']['size'] == 0
+        assert result['properties']['data']['timestamp'] == os.stat(os.path.join(self.src, 'data')).st_mtime
+        # Directories are totalled recursively, ignoring hidden files
+        os.makedirs(os.path.join(self.src, 'data', 'sub', 'deeper'))
+        with open(os.path.join(self.src, 'data', 'sub', 'deeper', 'b.txt'), 'w') as f:
+            f.write('12345')
+        open(os.path.join(self.src, 'data', '.hidden'), 'w').close()
+        models.space.DIRECTORY_USAGE_CACHE.clear()
+        result = self.space._browse_local(self.src, properties=True)
+        assert result['properties']['data']['size'] == len('test file\n') + 5
+        assert result['properties']['data']['object count'] == 2
+        assert result['properties']['Logs']['object count'] == 0
+
+    def test_browse_page(self):
+        for name in ('b.txt', 'A.txt', 'c'):
+            open(os.path.join(self.src, name), 'w').close()
+        space = models.Space.objects.create(
+            access_protocol=models.Space.LOCAL_FILESYSTEM, path=self.tmp_dir)
+        models.LocalFilesystem.objects.create(space=space)
+        page = space.browse(self.src, limit=2)
+        assert page['entries'] == ['A.txt', 'b.txt']
+        assert page['directories'] == []
+        # Entries removed before the cursor don't shift the next page
+        os.remove(os.path.join(self.src, 'A.txt'))
+        page = space.browse(self.src, limit=2, cursor=page['next'])
+        assert page['entries'] == ['c', 'data']
+        assert page['directories'] == ['data']
+        assert page['next'] is None
+        with self.assertRaises(ValueError):
+            space.browse(self.src, limit=2, cursor='!')
+        # Properties are only computed for the page
+        page = space.browse(self.src, limit=2, properties=True)
+        assert sorted(page['properties']) == ['b.txt', 'c']
+        page = space.browse(self.src, limit=2, cursor=page['next'], properties=True)
+        assert sorted(page['properties']) == ['data']
+        assert page['properties']['data']['object count'] == 1
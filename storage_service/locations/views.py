@@ -61,16 +61,20 @@ def aip_delete_request(request):
                     event.package.status = event.store_data
                     messages.success(request, "Request rejected, package still stored.")
                 elif 'approve' in request.POST:
-                    event.status = Event.APPROVED
-                    event.package.status = Package.DELETED
+                    # Status before the request, so deleting only frees
+                    # usage the package actually counted towards
+                    event.package.status = event.store_data
                     success, err_msg = event.package.delete_from_storage()
                     if not success:
+                        # Leave the request open and the package as it was,
+                        # so the delete can be approved again
                         messages.error(request,
-                            "Package was not deleted from disk correctly: {}. Please contact an administrator or see logs for details".format(err_msg))
-                    else:
-                        messages.success(request, "Request approved.  Package deleted successfully.")
-                        if err_msg:
-                            messages.info(request, err_msg)
+                            "Package was not deleted from disk correctly: {}. The request is still open. Please contact an administrator or see logs for details".format(err_msg))
+                        return redirect('aip_delete_request')
+                    event.status = Event.APPROVED
+                    messages.success(request, "Request approved.  Package deleted successfully.")
+                    if err_msg:
+                        messages.info(request, err_msg)
                 event.save()
                 event.package.save()
                 return redirect('aip_delete_request')